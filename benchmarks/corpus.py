@@ -0,0 +1,71 @@
+"""
+Синтетический корпус фильмов, персон и жанров, повторяющий структуру индексов ETL.
+Генерация детерминирована (seed), поэтому результаты разных прогонов сопоставимы.
+"""
+import random
+import uuid
+from typing import Dict, List
+
+WORDS = (
+    "star war love night city dark light house dead king queen last lost blue red road time "
+    "man woman girl boy world story dream life river fire ice moon sun ghost secret return"
+).split()
+GENRES = (
+    "Action Adventure Animation Biography Comedy Crime Documentary Drama Family Fantasy History "
+    "Horror Music Musical Mystery News Reality-TV Romance Sci-Fi Short Sport Talk-Show Thriller War Western"
+).split()
+
+
+def _uuid(rnd: random.Random) -> str:
+    return str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+
+
+def _title(rnd: random.Random, words: int) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(words)).title()
+
+
+def generate_corpus(films: int = 5000, persons: int = 3000, seed: int = 42) -> Dict[str, Dict[str, dict]]:
+    """
+    Создаёт документы индексов movies, person и genre.
+
+    :param films: количество фильмов
+    :param persons: количество персон
+    :param seed:
+    :return: документы по индексам и id
+    """
+    rnd = random.Random(seed)  # noqa: S311 - синтетические данные, не криптография
+
+    genre_docs = {}
+    for name in GENRES:
+        id_ = _uuid(rnd)
+        genre_docs[id_] = {"id": id_, "name": name}
+
+    person_docs = {}
+    for _ in range(persons):
+        id_ = _uuid(rnd)
+        person_docs[id_] = {"id": id_, "fullname": _title(rnd, 2), "film_ids": []}
+    person_ids: List[str] = list(person_docs)
+
+    film_docs = {}
+    for _ in range(films):
+        id_ = _uuid(rnd)
+        actors = rnd.sample(person_ids, k=min(len(person_ids), rnd.randint(2, 8)))
+        writers = rnd.sample(person_ids, k=min(len(person_ids), rnd.randint(1, 3)))
+        film = {
+            "id": id_,
+            "title": _title(rnd, rnd.randint(1, 4)),
+            "imdb_rating": round(rnd.uniform(1, 10), 1),
+            "description": " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(20, 60))),
+            "genre": rnd.sample(GENRES, k=rnd.randint(1, 3)),
+            "director": person_docs[rnd.choice(person_ids)]["fullname"],
+            "actors": [{"id": p, "name": person_docs[p]["fullname"]} for p in actors],
+            "writers": [{"id": p, "name": person_docs[p]["fullname"]} for p in writers],
+        }
+        film_docs[id_] = film
+        for role, ids in (("actor", actors), ("writer", writers)):
+            for person_id in ids:
+                person_docs[person_id]["film_ids"].append(
+                    {"id": id_, "title": film["title"], "imdb_rating": film["imdb_rating"], "role": role}
+                )
+
+    return {"movies": film_docs, "person": person_docs, "genre": genre_docs}
@@ -0,0 +1,481 @@
+"""
+In-process заменители aioredis и AsyncElasticsearch для бенчмарков.
+
+Реализуют только то подмножество API, которым пользуется сервис. Каждый вызов (и каждый
+пайплайн целиком) стоит одну задержку сети, заданную в миллисекундах.
+"""
+import asyncio
+import copy
+import operator
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from elasticsearch import NotFoundError, RequestError
+
+RANGE_OPERATORS = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+
+
+class FakeRedis:
+    SET_IF_NOT_EXIST = "SET_IF_NOT_EXIST"
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.data: Dict[str, Any] = {}
+        self.expire_at: Dict[str, float] = {}
+        self.calls = 0
+
+    async def _rtt(self) -> None:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+    def flushall(self) -> None:
+        self.data.clear()
+        self.expire_at.clear()
+
+    def _alive(self, key: str) -> bool:
+        expire_at = self.expire_at.get(key)
+        if expire_at is not None and expire_at <= time.time():
+            self.data.pop(key, None)
+            self.expire_at.pop(key, None)
+        return key in self.data
+
+    @staticmethod
+    def _bytes(value: Any) -> bytes:
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def _set_expire(self, key: str, seconds: float) -> None:
+        if seconds:
+            self.expire_at[key] = time.time() + seconds
+        else:
+            self.expire_at.pop(key, None)
+
+    # --- строки
+    def _get(self, key):
+        return self.data.get(key) if self._alive(key) else None
+
+    def _set(self, key, value, expire=0, pexpire=0, exist=None):
+        if exist == self.SET_IF_NOT_EXIST and self._alive(key):
+            return None
+        self.data[key] = self._bytes(value)
+        self._set_expire(key, expire or pexpire / 1000)
+        return True
+
+    def _delete(self, *keys):
+        removed = 0
+        for key in keys:
+            # ключи из smembers и zrange приходят байтами, как из настоящего redis
+            key = key.decode() if isinstance(key, bytes) else key
+            removed += self._alive(key)
+            self.data.pop(key, None)
+            self.expire_at.pop(key, None)
+        return removed
+
+    def _expire(self, key, seconds):
+        if not self._alive(key):
+            return 0
+        self._set_expire(key, seconds)
+        return 1
+
+    def _exists(self, *keys):
+        return sum(self._alive(key) for key in keys)
+
+    # --- хеши
+    def _hgetall(self, key):
+        return dict(self.data[key]) if self._alive(key) else {}
+
+    def _hmset_dict(self, key, mapping):
+        value = self.data.setdefault(key, {})
+        value.update({self._bytes(field): self._bytes(item) for field, item in mapping.items()})
+        return True
+
+    def _hset(self, key, field, item):
+        self.data.setdefault(key, {})[self._bytes(field)] = self._bytes(item)
+        return 1
+
+    # --- множества
+    def _sadd(self, key, member, *members):
+        value = self.data.setdefault(key, set())
+        before = len(value)
+        value.update(self._bytes(m) for m in (member, *members))
+        return len(value) - before
+
+    def _smembers(self, key):
+        return list(self.data[key]) if self._alive(key) else []
+
+    # --- сортированные множества
+    def _zadd(self, key, score, member, *pairs):
+        value = self.data.setdefault(key, {})
+        value[self._bytes(member)] = float(score)
+        for i in range(0, len(pairs), 2):
+            value[self._bytes(pairs[i + 1])] = float(pairs[i])
+        return 1
+
+    def _zincrby(self, key, increment, member):
+        value = self.data.setdefault(key, {})
+        member = self._bytes(member)
+        value[member] = value.get(member, 0.0) + increment
+        return value[member]
+
+    def _zcard(self, key):
+        return len(self.data[key]) if self._alive(key) else 0
+
+    def _zrange(self, key, start=0, stop=-1, withscores=False, reverse=False):
+        value = self.data[key] if self._alive(key) else {}
+        members = sorted(value, key=lambda m: (value[m], m), reverse=reverse)
+        members = members[start : None if stop == -1 else stop + 1]
+        if withscores:
+            return [(m, value[m]) for m in members]
+        return members
+
+    def _zrevrange(self, key, start=0, stop=-1, withscores=False):
+        return self._zrange(key, start, stop, withscores, reverse=True)
+
+    def _zremrangebyrank(self, key, start, stop):
+        if not self._alive(key):
+            return 0
+        value = self.data[key]
+        members = sorted(value, key=lambda m: (value[m], m))
+        stop = len(members) + stop if stop < 0 else stop
+        removed = members[start : stop + 1]
+        for member in removed:
+            del value[member]
+        return len(removed)
+
+    def _rename(self, key, newkey):
+        self.data[newkey] = self.data.pop(key)
+        if key in self.expire_at:
+            self.expire_at[newkey] = self.expire_at.pop(key)
+        else:
+            self.expire_at.pop(newkey, None)
+        return True
+
+    def _publish(self, channel, message):
+        return 0
+
+    def _eval(self, script, keys=(), args=()):
+        # скрипты сервиса: запись в обратный индекс и снятие блокировки по токену
+        if "zremrangebyscore" in script:
+            return self._add_to_reverse_index(keys[0], *args)
+        if self.data.get(keys[0]) == self._bytes(args[0]):
+            return self._delete(keys[0])
+        return 0
+
+    def _add_to_reverse_index(self, key, member, ttl, now, expire_at):
+        value = self.data[key] if self._alive(key) else {}
+        self.data[key] = {m: score for m, score in value.items() if score > now}
+        self.data[key][self._bytes(member)] = float(expire_at)
+        if self.expire_at.get(key, 0) - time.time() < ttl:
+            self._set_expire(key, ttl)
+        return 1
+
+    def __getattr__(self, name: str):
+        command = getattr(type(self), f"_{name}", None)
+        if command is None:
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            await self._rtt()
+            return command(self, *args, **kwargs)
+
+        return call
+
+    async def mget(self, key, *keys):
+        await self._rtt()
+        return [self._get(k) for k in (key, *keys)]
+
+    def pipeline(self) -> "FakePipeline":
+        return FakePipeline(self)
+
+    def multi_exec(self) -> "FakePipeline":
+        return FakePipeline(self)
+
+    def close(self) -> None:
+        pass
+
+    async def wait_closed(self) -> None:
+        pass
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands: List[tuple] = []
+
+    def __getattr__(self, name: str):
+        command = getattr(FakeRedis, f"_{name}")
+
+        def add(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+
+        return add
+
+    async def execute(self) -> list:
+        await self.redis._rtt()
+        return [command(self.redis, *args, **kwargs) for command, args, kwargs in self.commands]
+
+
+class FakeElasticsearch:
+    """
+    Поиск поддерживает match_all, multi_match (совпадение слов в строковых полях), term/terms-фильтры,
+    сортировку, from/size, search_after, _source includes и point-in-time.
+    """
+
+    def __init__(self, docs: Dict[str, Dict[str, dict]], latency_ms: float = 0.0):
+        self.docs = docs
+        self.latency = latency_ms / 1000
+        self.calls = 0
+        self._pits: Dict[str, str] = {}
+
+    async def _rtt(self) -> None:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+    async def close(self) -> None:
+        pass
+
+    @staticmethod
+    def _project(source: dict, includes: Optional[List[str]]) -> dict:
+        if not includes:
+            return copy.deepcopy(source)
+        if isinstance(includes, str):
+            includes = includes.split(",")
+        return {field: copy.deepcopy(value) for field, value in source.items() if field in includes}
+
+    async def get(self, index: str, id_: str, _source_includes=None, **kwargs) -> dict:
+        await self._rtt()
+        doc = self.docs.get(index, {}).get(id_)
+        if doc is None:
+            raise NotFoundError(404, "not_found", {"_index": index, "_id": id_, "found": False})
+        return {"_index": index, "_id": id_, "found": True, "_source": self._project(doc, _source_includes)}
+
+    async def mget(self, body: dict, index: str, _source_includes=None, **kwargs) -> dict:
+        await self._rtt()
+        docs = []
+        for id_ in body["ids"]:
+            doc = self.docs.get(index, {}).get(id_)
+            if doc is None:
+                docs.append({"_index": index, "_id": id_, "found": False})
+            else:
+                docs.append({"_index": index, "_id": id_, "found": True, "_source": self._project(doc, _source_includes)})
+        return {"docs": docs}
+
+    async def open_point_in_time(self, index: str, keep_alive: str = None, **kwargs) -> dict:
+        await self._rtt()
+        pit_id = f"pit-{len(self._pits)}"
+        self._pits[pit_id] = index
+        return {"id": pit_id}
+
+    async def close_point_in_time(self, body: dict = None, **kwargs) -> dict:
+        await self._rtt()
+        self._pits.pop(body["id"], None)
+        return {"succeeded": True}
+
+    async def search(self, body: dict = None, index: str = None, **kwargs) -> dict:
+        await self._rtt()
+        return self._search(body, index)
+
+    async def msearch(self, body: list, index: str = None, **kwargs) -> dict:
+        await self._rtt()
+        responses = [self._search(body[i + 1], body[i].get("index", index)) for i in range(0, len(body), 2)]
+        return {"took": sum(response["took"] for response in responses), "responses": responses}
+
+    def _search(self, body: Optional[dict], index: Optional[str]) -> dict:
+        started = time.perf_counter()
+        body = body or {}
+        if "pit" in body:
+            index = self._pit_index(body["pit"]["id"])
+
+        sort = self._sort_spec(body.get("sort"))
+        hits = self._matching_hits(self.docs.get(index, {}).values(), body.get("query", {}), sort)
+        matched = [doc for _, doc in hits]
+        page = self._page(hits, body, sort)
+
+        source = body.get("_source")
+        includes = source.get("includes") if isinstance(source, dict) else source
+        response = {
+            "took": int((time.perf_counter() - started) * 1000),
+            "hits": {
+                "total": {"value": len(matched), "relation": "eq"},
+                "hits": [self._hit(index, score, doc, includes, sort) for score, doc in page],
+            },
+        }
+        if "pit" in body:
+            response["pit_id"] = body["pit"]["id"]
+        if "aggs" in body:
+            response["aggregations"] = {name: self._aggregation(agg, matched) for name, agg in body["aggs"].items()}
+        return response
+
+    def _matching_hits(self, docs: Iterable[dict], query: dict, sort: List[tuple]) -> List[tuple]:
+        hits = [(self._score(doc, query), doc) for doc in docs]
+        hits = [(score, doc) for score, doc in hits if score is not None]
+        hits.sort(key=lambda hit: self._sort_key(hit, sort))
+        return hits
+
+    def _pit_index(self, pit_id: str) -> str:
+        if pit_id not in self._pits:
+            raise NotFoundError(404, "search_context_missing_exception", {"error": {"type": "search_context_missing_exception"}})
+        return self._pits[pit_id]
+
+    def _page(self, hits: List[tuple], body: dict, sort: List[tuple]) -> List[tuple]:
+        if "search_after" in body:
+            if len(body["search_after"]) != len(sort):
+                raise RequestError(400, "illegal_argument_exception", {"error": {"type": "illegal_argument_exception"}})
+            after = self._after_key(body["search_after"], sort)
+            hits = [hit for hit in hits if self._sort_key(hit, sort) > after]
+        else:
+            hits = hits[int(body.get("from", 0)) :]
+        return hits[: int(body.get("size", 10))]
+
+    def _hit(self, index: str, score: float, doc: dict, includes: Optional[List[str]], sort: List[tuple]) -> dict:
+        return {
+            "_index": index,
+            "_id": doc["id"],
+            "_score": score,
+            "_source": self._project(doc, includes),
+            "sort": [score if field == "_score" else doc.get(field) for field, _ in sort],
+        }
+
+    def _score(self, doc: dict, query: dict) -> Optional[float]:
+        """
+        Возвращает релевантность документа или None, если он не подходит под запрос.
+        Неизвестные виды запросов (и match_all) подходят под любой документ.
+        """
+        if not query:
+            return 1.0
+        kind, params = next(iter(query.items()))
+        scorer = getattr(self, f"_score_{kind}", None)
+        return 1.0 if scorer is None else scorer(doc, params)
+
+    @staticmethod
+    def _score_multi_match(doc: dict, params: dict) -> Optional[float]:
+        words = str(params["query"]).lower().split()
+        text = " ".join(str(value) for value in doc.values() if isinstance(value, str)).lower()
+        score = float(sum(text.count(word) for word in words))
+        return score if score else None
+
+    def _score_term(self, doc: dict, params: dict) -> Optional[float]:
+        field, value = next(iter(params.items()))
+        value = value["value"] if isinstance(value, dict) else value
+        return 1.0 if self._has_value(doc.get(field), value) else None
+
+    def _score_terms(self, doc: dict, params: dict) -> Optional[float]:
+        field, values = next(iter(params.items()))
+        return 1.0 if any(self._has_value(doc.get(field), value) for value in values) else None
+
+    @staticmethod
+    def _score_range(doc: dict, params: dict) -> Optional[float]:
+        field, bounds = next(iter(params.items()))
+        value = doc.get(field)
+        if value is None:
+            return None
+        return 1.0 if all(RANGE_OPERATORS[op](value, bound) for op, bound in bounds.items()) else None
+
+    def _score_bool(self, doc: dict, query: dict) -> Optional[float]:
+        score = self._score_required(doc, query)
+        if score is None:
+            return None
+        should = [self._score(doc, subquery) for subquery in query.get("should", [])]
+        should = [s for s in should if s is not None]
+        if query.get("should") and not should and not query.get("must"):
+            return None
+        return (score + sum(should)) or 1.0
+
+    def _score_required(self, doc: dict, query: dict) -> Optional[float]:
+        """
+        Сумма релевантности must-условий или None, если не выполнено хотя бы одно must- или filter-условие.
+        """
+        if any(self._score(doc, subquery) is None for subquery in self._clauses(query, "filter")):
+            return None
+        scores = [self._score(doc, subquery) for subquery in self._clauses(query, "must")]
+        return None if None in scores else sum(scores)
+
+    @staticmethod
+    def _clauses(query: dict, clause: str) -> List[dict]:
+        subqueries = query.get(clause, [])
+        return subqueries if isinstance(subqueries, list) else [subqueries]
+
+    @staticmethod
+    def _has_value(field_value: Any, value: Any) -> bool:
+        if isinstance(field_value, list):
+            return value in field_value
+        return field_value == value
+
+    @staticmethod
+    def _sort_spec(sort: Optional[list]) -> List[tuple]:
+        if not sort:
+            return [("_score", "desc")]
+        return [_sort_item(item) for item in sort]
+
+    @staticmethod
+    def _value_key(value: Any, order: str) -> tuple:
+        # документы без значения поля - в конце выдачи при любом направлении сортировки
+        if value is None:
+            return (1, 0)
+        if isinstance(value, (int, float)):
+            return (0, -value if order == "desc" else value)
+        return (0, _Reversed(value) if order == "desc" else value)
+
+    def _sort_key(self, hit: tuple, sort: List[tuple]) -> tuple:
+        score, doc = hit
+        return tuple(self._value_key(score if field == "_score" else doc.get(field), order) for field, order in sort)
+
+    def _after_key(self, after: list, sort: List[tuple]) -> tuple:
+        return tuple(self._value_key(value, order) for value, (_, order) in zip(after, sort))
+
+    def _aggregation(self, agg: dict, docs: List[dict]) -> dict:
+        if "terms" in agg:
+            return {"buckets": self._terms_buckets(agg["terms"], docs)}
+        if "range" in agg:
+            return {"buckets": self._range_buckets(agg["range"], docs)}
+        return {}
+
+    @staticmethod
+    def _terms_buckets(params: dict, docs: List[dict]) -> List[dict]:
+        counts: Dict[Any, int] = {}
+        for doc in docs:
+            values = doc.get(params["field"])
+            for value in values if isinstance(values, list) else [values]:
+                if value is not None:
+                    counts[value] = counts.get(value, 0) + 1
+        buckets = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[: params.get("size", 10)]
+        return [{"key": key, "doc_count": count} for key, count in buckets]
+
+    @staticmethod
+    def _range_buckets(params: dict, docs: List[dict]) -> List[dict]:
+        values = [doc[params["field"]] for doc in docs if doc.get(params["field"]) is not None]
+        return [
+            {
+                **bucket,
+                "doc_count": sum(
+                    1
+                    for value in values
+                    if ("from" not in bucket or value >= bucket["from"]) and ("to" not in bucket or value < bucket["to"])
+                ),
+            }
+            for bucket in params["ranges"]
+        ]
+
+
+def _sort_item(item: Any) -> tuple:
+    if isinstance(item, str):
+        return item, "desc" if item == "_score" else "asc"
+    field, order = next(iter(item.items()))
+    return field, order["order"] if isinstance(order, dict) else order
+
+
+class _Reversed:
+    """
+    Обёртка для сортировки строк по убыванию внутри кортежа ключа.
+    """
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __eq__(self, other: "_Reversed") -> bool:
+        return self.value == other.value
+
+    def __lt__(self, other: "_Reversed") -> bool:
+        return self.value > other.value
+
+    def __gt__(self, other: "_Reversed") -> bool:
+        return self.value < other.value
@@ -0,0 +1,256 @@
+"""
+Бенчмарк эндпоинтов api/v1 без docker-compose.
+
+Приложение из main.py запускается в процессе поверх FakeRedis и FakeElasticsearch
+с настраиваемой задержкой. Для каждого эндпоинта замеряются пропускная способность и p50/p99
+в трёх режимах:
+- cold - кеши пустые, каждый запрос уникален;
+- warm - тот же набор запросов повторяется после прогрева;
+- mixed - запросы к «горячему» подмножеству документов по распределению Ципфа, кеши изначально пустые.
+
+Результаты пишутся в JSON для сравнения между коммитами.
+
+Запуск из корня репозитория:
+    PYTHONPATH=src python -m benchmarks.run --output bench.json
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import subprocess  # noqa: S404 - только git rev-parse для метки коммита в отчёте
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import httpx
+import orjson
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.fakes import FakeElasticsearch, FakeRedis
+
+Request = Tuple[str, str, dict]  # метод, url, json-тело
+
+
+def build_requests(corpus: Dict[str, Dict[str, dict]]) -> Dict[str, Callable[[str], Request]]:
+    """
+    Генераторы запросов по эндпоинтам. Генератор получает id документа (фильма, персоны или жанра)
+    и детерминированно строит по нему запрос, чтобы режимы cold/warm/mixed управляли повторяемостью запросов.
+
+    :param corpus:
+    :return:
+    """
+    films = corpus["movies"]
+    persons = corpus["person"]
+    film_ids = list(films)
+
+    def batch_for(id_: str) -> dict:
+        return {"ids": [id_, *random.Random(id_).sample(film_ids, 9)]}  # noqa: S311
+
+    def film_word(id_: str) -> str:
+        return films[id_]["title"].split()[0]
+
+    def person_word(id_: str) -> str:
+        return persons[id_]["fullname"].split()[0]
+
+    def page_for(id_: str) -> int:
+        return int(id_[:4], 16) % 50 + 1
+
+    return {
+        "film_details": lambda id_: ("GET", f"/api/v1/film/{id_}", None),
+        "film_search": lambda id_: ("GET", f"/api/v1/film/search?query={film_word(id_)}&page[size]=20", None),
+        "film_filter": lambda id_: ("GET", f"/api/v1/film/?page[size]=20&page[number]={page_for(id_)}", None),
+        "film_batch": lambda id_: ("POST", "/api/v1/film/batch", batch_for(id_)),
+        "genre_list": lambda id_: ("GET", "/api/v1/genre/", None),
+        "genre_details": lambda id_: ("GET", f"/api/v1/genre/{id_}", None),
+        "person_details": lambda id_: ("GET", f"/api/v1/person/{id_}", None),
+        "person_films": lambda id_: ("GET", f"/api/v1/person/{id_}/film", None),
+        "person_search": lambda id_: ("GET", f"/api/v1/person/search?query={person_word(id_)}&page[size]=20", None),
+    }
+
+
+ENDPOINT_INDEX = {
+    "film_details": "movies",
+    "film_search": "movies",
+    "film_filter": "movies",
+    "film_batch": "movies",
+    "genre_list": "genre",
+    "genre_details": "genre",
+    "person_details": "person",
+    "person_films": "person",
+    "person_search": "person",
+}
+
+
+def reset_caches(app, redis: FakeRedis) -> None:
+    """
+    Очищает redis и все кеши в памяти воркера: сервисы пересоздаются, стек middleware собирается заново.
+
+    :param app:
+    :param redis:
+    :return:
+    """
+    from services.film import get_film_service
+    from services.genre import get_genre_service
+    from services.person import get_person_service
+
+    redis.flushall()
+    for factory in (get_film_service, get_genre_service, get_person_service):
+        factory.cache_clear()
+    app.middleware_stack = app.build_middleware_stack()
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+
+async def measure(client: httpx.AsyncClient, requests: List[Request], concurrency: int) -> dict:
+    """
+    Выполняет запросы с заданной конкурентностью и считает статистику.
+
+    :param client:
+    :param requests:
+    :param concurrency:
+    :return:
+    """
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    queue = list(reversed(requests))
+
+    async def worker() -> None:
+        while queue:
+            method, url, body = queue.pop()
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3) if latencies else 0.0,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+def zipf_ids(ids: List[Any], count: int, rnd: random.Random, exponent: float = 1.1) -> List[Any]:
+    weights = [1 / (rank ** exponent) for rank in range(1, len(ids) + 1)]
+    return rnd.choices(ids, weights=weights, k=count)
+
+
+async def workload_requests(
+    client: httpx.AsyncClient,
+    workload: str,
+    requests: List[Request],
+    rnd: random.Random,
+    args: argparse.Namespace,
+) -> List[Request]:
+    """
+    Набор запросов режима. Для warm набор сначала один раз выполняется, чтобы прогреть кеши.
+
+    :param client:
+    :param workload: cold, warm или mixed
+    :param requests: запросы по всем документам индекса эндпоинта, в порядке документов
+    :param rnd:
+    :param args:
+    :return:
+    """
+    if workload == "cold":
+        return rnd.sample(requests, k=min(len(requests), args.requests))
+    if workload == "warm":
+        warm_set = rnd.sample(requests, k=min(len(requests), args.warm_set))
+        await measure(client, warm_set, args.concurrency)
+        return [warm_set[i % len(warm_set)] for i in range(args.requests)]
+    return zipf_ids(requests, args.requests, rnd)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    import main
+    from db import elastic, redis
+    from services.genre_catalog import genre_catalog
+
+    corpus = generate_corpus(films=args.films, persons=args.persons, seed=args.seed)
+    fake_redis = FakeRedis(latency_ms=args.redis_latency_ms)
+    fake_es = FakeElasticsearch(corpus, latency_ms=args.es_latency_ms)
+    redis.redis = fake_redis
+    elastic.es = fake_es
+
+    rnd = random.Random(args.seed)  # noqa: S311 - детерминированная нагрузка, не криптография
+    generators = build_requests(corpus)
+    endpoints = args.endpoints or list(generators)
+
+    results: Dict[str, Dict[str, dict]] = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for endpoint in endpoints:
+            ids = list(corpus[ENDPOINT_INDEX[endpoint]])
+            make = generators[endpoint]
+            results[endpoint] = {}
+
+            for workload in args.workloads:
+                reset_caches(main.app, fake_redis)
+                await genre_catalog.load(fake_es)
+                requests = await workload_requests(client, workload, [make(id_) for id_ in ids], rnd, args)
+                es_calls, redis_calls = fake_es.calls, fake_redis.calls
+
+                stats = await measure(client, requests, args.concurrency)
+                stats["es_calls"] = fake_es.calls - es_calls
+                stats["redis_calls"] = fake_redis.calls - redis_calls
+                results[endpoint][workload] = stats
+                sys.stderr.write(
+                    f"{endpoint:16} {workload:6} {stats['throughput_rps']:>10} rps  "
+                    f"p50 {stats['p50_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms\n"
+                )
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+
+
+def git_commit() -> str:
+    try:
+        output = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL)  # noqa: S603,S607
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк эндпоинтов api/v1 на in-process заменителях redis и эластика")
+    parser.add_argument("--films", type=int, default=5000)
+    parser.add_argument("--persons", type=int, default=3000)
+    parser.add_argument("--requests", type=int, default=500, help="запросов на эндпоинт и режим")
+    parser.add_argument("--warm-set", type=int, default=50, help="количество разных запросов в режиме warm")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--redis-latency-ms", type=float, default=0.3)
+    parser.add_argument("--es-latency-ms", type=float, default=5.0)
+    parser.add_argument("--workloads", nargs="+", choices=["cold", "warm", "mixed"], default=["cold", "warm", "mixed"])
+    parser.add_argument("--endpoints", nargs="+", default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_output.json")
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    logging.disable(logging.WARNING)
+    report = asyncio.run(run(args))
+    with open(args.output, "wb") as f:
+        f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Сжатие HTTP-ответов с выбором алгоритма по заголовку Accept-Encoding.
+
+brotli и zstandard - необязательные зависимости (requirements/compression.txt): без них ответы сжимаются только gzip.
+"""
+import gzip
+import zlib
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from core.config import RESPONSE_COMPRESS_BROTLI_QUALITY, RESPONSE_COMPRESS_GZIP_LEVEL, RESPONSE_COMPRESS_ZSTD_LEVEL
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Доступные алгоритмы в порядке предпочтения сервера при равном q
+ENCODERS: Dict[str, Callable[[bytes], bytes]] = {}
+if zstandard is not None:
+    ENCODERS["zstd"] = zstandard.ZstdCompressor(level=RESPONSE_COMPRESS_ZSTD_LEVEL).compress
+if brotli is not None:
+    ENCODERS["br"] = partial(brotli.compress, quality=RESPONSE_COMPRESS_BROTLI_QUALITY)
+# mtime=0 - одинаковое тело всегда сжимается в одинаковые байты
+ENCODERS["gzip"] = partial(gzip.compress, compresslevel=RESPONSE_COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+class _BrotliStream:
+    """Потоковый компрессор brotli с тем же интерфейсом, что у zlib и zstandard: compress и flush"""
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=RESPONSE_COMPRESS_BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+# Потоковые компрессоры для ответов, которые отдаются частями (StreamingResponse)
+STREAM_ENCODERS: Dict[str, Callable[[], Any]] = {}
+if zstandard is not None:
+    STREAM_ENCODERS["zstd"] = zstandard.ZstdCompressor(level=RESPONSE_COMPRESS_ZSTD_LEVEL).compressobj
+if brotli is not None:
+    STREAM_ENCODERS["br"] = _BrotliStream
+# wbits=31 - формат gzip
+STREAM_ENCODERS["gzip"] = partial(zlib.compressobj, RESPONSE_COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Выбирает алгоритм сжатия с наибольшим q из поддерживаемых клиентом.
+
+    Пример работы:
+    "gzip, br;q=0.9" -> "gzip"
+    "gzip;q=0, *" -> "zstd" (если установлен zstandard)
+
+    :param accept_encoding: значение заголовка Accept-Encoding
+    :return: None - отдавать без сжатия
+    """
+    if not accept_encoding:
+        return None
+
+    weights = dict(parse_coding(item) for item in accept_encoding.split(","))
+
+    def weight(coding: str) -> float:
+        return weights.get(coding, weights.get("*", 0.0))
+
+    # max отдаёт первый из равных: при равном q выигрывает алгоритм, предпочтительный для сервера
+    best = max(ENCODERS, key=weight)
+    return best if weight(best) > 0 else None
+
+
+def parse_coding(item: str) -> Tuple[str, float]:
+    """
+    Разбирает элемент Accept-Encoding: "br;q=0.9" -> ("br", 0.9). Некорректный q считается нулевым.
+
+    :param item:
+    :return: алгоритм в нижнем регистре и его q
+    """
+    coding, _, params = item.partition(";")
+    weight = 1.0
+    for param in params.split(";"):
+        name, _, value = param.partition("=")
+        if name.strip() == "q":
+            weight = parse_quality(value)
+    return coding.strip().lower(), weight
+
+
+def parse_quality(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    return ENCODERS[encoding](body)
+
+
+def stream_compressor(encoding: str) -> Any:
+    """
+    Потоковый компрессор: compress(часть) отдаёт готовые сжатые байты (возможно, пустые), flush() - остаток.
+
+    :param encoding: алгоритм, выбранный choose_encoding
+    :return:
+    """
+    return STREAM_ENCODERS[encoding]()
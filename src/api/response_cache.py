@@ -0,0 +1,462 @@
+"""
+Кеш готовых HTTP-ответов.
+
+Тело ответа кешируется в том виде, в каком его отдаёт эндпоинт, по пути и набору query-параметров.
+При попадании байты отдаются клиенту напрямую: без вызова эндпоинта, валидации pydantic
+и повторной сериализации.
+
+Ответ помечается id документов из тела и пути запроса и сбрасывается при изменении любого из них
+(см. services.invalidation).
+
+Вместе с телом хранятся ETag (хеш тела) и время создания ответа, поэтому условные запросы
+(If-None-Match, If-Modified-Since) отвечаются 304 без вызова эндпоинта и без пересчёта хеша.
+
+Сжатые тела (поля body:<encoding>) хранятся там же: горячий ответ сжимается каждым алгоритмом один раз.
+"""
+import hashlib
+import re
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Iterator, List, Optional, Pattern, Set, Tuple
+from urllib.parse import parse_qsl
+
+import orjson
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api.compression import ENCODERS, choose_encoding, compress
+from core.config import (
+    CACHE_INVALIDATION_ENABLED,
+    CACHE_KEY_PREFIX,
+    LOCAL_CACHE_EXPIRE_IN_SECONDS,
+    LOCAL_CACHE_MAX_BYTES,
+    LOCAL_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_SCHEMA_VERSION,
+    RESPONSE_COMPRESS_MIN_BYTES,
+)
+from core.metrics import CACHE_REQUESTS, REDIS_LATENCY, SERIALIZATION_LATENCY
+from db import redis
+from services.invalidation import add_to_reverse_index, cache_invalidator
+from services.local_cache import LocalCache
+from services.utils import hash_body
+
+# Заголовки, которые не сохраняются вместе с телом: их значение зависит от конкретной отправки
+SKIP_HEADERS = {b"content-length", b"date", b"server"}
+# Заголовки, которые повторяются в ответе 304
+NOT_MODIFIED_HEADERS = {"cache-control", "etag", "last-modified", "vary"}
+# Поля тела ответа с id документов
+DOC_ID_FIELDS = {"id", "uuid"}
+# id документов в пути запроса: /api/v1/film/<uuid>, /api/v1/person/<uuid>/film
+UUID_RE = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+
+def response_cache_key(path: str, query_string: bytes) -> str:
+    """
+    Ключ ответа: путь + хеш отсортированных query-параметров.
+    Порядок параметров в URL на ключ не влияет.
+
+    :param path:
+    :param query_string:
+    :return:
+    """
+    params = sorted(parse_qsl(query_string.decode("latin-1"), keep_blank_values=True))
+    return f"{CACHE_KEY_PREFIX}:response:v{RESPONSE_CACHE_SCHEMA_VERSION}:{path}:{hash_body(params)}"
+
+
+def response_etag(body: bytes) -> bytes:
+    """
+    Сильный ETag ответа - хеш тела.
+
+    :param body:
+    :return:
+    """
+    return b'"' + hashlib.blake2b(body, digest_size=16).hexdigest().encode() + b'"'
+
+
+def encoded_etag(etag: bytes, encoding: Optional[str]) -> bytes:
+    """
+    ETag сжатого представления: у разных представлений одного ответа ETag должны различаться.
+
+    :param etag:
+    :param encoding:
+    :return:
+    """
+    if not encoding:
+        return etag
+    return etag[:-1] + b"-" + encoding.encode() + b'"'
+
+
+def is_not_modified(request_headers: Headers, etags: List[bytes], modified_at: float) -> bool:
+    """
+    Проверяет условный запрос. If-None-Match приоритетнее If-Modified-Since (RFC 7232, 6).
+
+    :param request_headers:
+    :param etags: ETag всех представлений ответа - у клиента может быть закешировано любое из них
+    :param modified_at: время создания ответа, unix timestamp
+    :return:
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or any(etag.decode() in tags for etag in etags)
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(modified_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def response_doc_ids(path: str, body: bytes) -> Set[str]:
+    """
+    id документов, от которых зависит ответ: id из пути и все значения полей id/uuid в теле,
+    включая вложенные (актёры фильма, фильмы персоны).
+
+    :param path:
+    :param body:
+    :return:
+    """
+    ids = set(UUID_RE.findall(path))
+    try:
+        ids.update(_doc_ids(orjson.loads(body)))
+    except orjson.JSONDecodeError:
+        pass
+    return ids
+
+
+def _doc_ids(value: Any) -> Iterator[str]:
+    if isinstance(value, dict):
+        yield from _dict_doc_ids(value)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _doc_ids(item)
+
+
+def _dict_doc_ids(value: dict) -> Iterator[str]:
+    for field, item in value.items():
+        if field in DOC_ID_FIELDS and isinstance(item, str):
+            yield item
+        else:
+            yield from _doc_ids(item)
+
+
+class ResponseCacheMiddleware:
+    """
+    ASGI-middleware, кеширующее успешные GET-ответы настроенных маршрутов в локальном кеше воркера и в redis.
+    Успешные ответы этих маршрутов получают ETag, Last-Modified и Cache-Control маршрута,
+    на условные запросы отвечает 304.
+
+    :param routes: список (регулярное выражение пути, TTL в секундах, Cache-Control); выигрывает первое совпадение,
+                   TTL 0 отключает кеширование маршрута
+    :param enabled: False - ответы не кешируются, но заголовки и 304 работают
+    :param compression: сжимать ответы по Accept-Encoding
+    """
+
+    def __init__(self, app: ASGIApp, routes: List[Tuple[str, int, str]], enabled: bool = True, compression: bool = True):
+        self.app = app
+        self.routes: List[Tuple[Pattern, int, str]] = [
+            (re.compile(pattern), ttl, cache_control) for pattern, ttl, cache_control in routes
+        ]
+        self.enabled = enabled
+        self.compression = compression
+        self.local_cache = LocalCache(
+            max_entries=LOCAL_CACHE_MAX_ENTRIES,
+            max_bytes=LOCAL_CACHE_MAX_BYTES,
+            ttl=LOCAL_CACHE_EXPIRE_IN_SECONDS,
+            name="response",
+        )
+        cache_invalidator.track(self.local_cache)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        route = self._match_route(scope["path"]) if scope["type"] == "http" and scope["method"] == "GET" else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        ttl, cache_control = route
+        ttl = ttl if self.enabled else 0
+        key = response_cache_key(scope["path"], scope["query_string"])
+        cached = await self._lookup(key, scope["path"]) if ttl else None
+        if cached is None:
+            cached, ttl = await self._call_and_store(key, ttl, scope, receive, send)
+        if cached is not None:
+            await self._send_cached(key, cached, scope, cache_control, ttl, send)
+
+    async def _lookup(self, key: str, path: str) -> Optional[Dict[bytes, bytes]]:
+        cached = await self._get(key, path)
+        CACHE_REQUESTS.labels(type(self).__name__, "", "response", "miss" if cached is None else "hit").inc()
+        return cached
+
+    async def _call_and_store(
+        self,
+        key: str,
+        ttl: int,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ) -> Tuple[Optional[Dict[bytes, bytes]], int]:
+        """
+        Вызывает эндпоинт и сохраняет успешный ответ. Неуспешный ответ отправляется клиенту как есть.
+
+        :param key:
+        :param ttl: TTL маршрута, 0 - ответ не кешируется
+        :param scope:
+        :param receive:
+        :param send:
+        :return: запись ответа для отправки (None, если ответ уже отправлен) и TTL, с которым она сохранена
+        """
+        start, body = await self._collect_response(scope, receive)
+        if start is None:
+            return None, 0
+        if start["status"] != 200:
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+            return None, 0
+
+        entry = self._make_entry(start, body, Headers(scope=scope))
+        if not ttl or not self._is_cacheable(start):
+            return entry, 0
+        await self._put(key, entry, ttl, response_doc_ids(scope["path"], body))
+        return entry, ttl
+
+    async def _collect_response(self, scope: Scope, receive: Receive) -> Tuple[Optional[Message], bytes]:
+        """
+        Вызывает эндпоинт и собирает ответ целиком: ETag и сжатие зависят от всего тела.
+
+        :param scope:
+        :param receive:
+        :return: сообщение начала ответа (None, если эндпоинт ничего не отправил) и тело
+        """
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send_wrapper)
+        return start, b"".join(chunks)
+
+    def _make_entry(self, start: Message, body: bytes, request_headers: Headers) -> Dict[bytes, bytes]:
+        """
+        Запись кеша ответа. Сжатое тело для этого клиента сохраняется вместе с ответом, без отдельной записи в redis.
+
+        :param start: сообщение начала ответа эндпоинта
+        :param body:
+        :param request_headers:
+        :return:
+        """
+        headers = [[name.decode(), value.decode()] for name, value in start["headers"] if name.lower() not in SKIP_HEADERS]
+        entry = {
+            b"body": body,
+            b"headers": orjson.dumps(headers),
+            b"etag": response_etag(body),
+            b"modified_at": str(time.time()).encode(),
+        }
+        encoding = self._choose_encoding(request_headers, body)
+        if encoding:
+            entry[b"body:" + encoding.encode()] = self._compress(body, encoding)
+        return entry
+
+    @staticmethod
+    def _is_cacheable(start: Message) -> bool:
+        if start["status"] != 200:
+            return False
+        for name, value in start["headers"]:
+            if name.lower() == b"cache-control" and b"no-store" in value:
+                return False
+        return True
+
+    def _match_route(self, path: str) -> Optional[Tuple[int, str]]:
+        """
+        TTL кеша и Cache-Control первого подходящего маршрута.
+
+        :param path:
+        :return: None, если маршрут не настроен
+        """
+        for pattern, ttl, cache_control in self.routes:
+            if pattern.match(path):
+                return ttl, cache_control
+        return None
+
+    async def _get(self, key: str, path: str) -> Optional[Dict[bytes, bytes]]:
+        """
+        Ищет ответ в локальном кеше, затем в redis. Ответ из redis попадает в локальный кеш
+        с теми же тегами документов, что и при сохранении.
+
+        :param key:
+        :param path: путь запроса, из него берутся id документов
+        :return:
+        """
+        cached = self.local_cache.get(key)
+        if cached is not None:
+            return cached
+
+        with REDIS_LATENCY.labels("hgetall").time():
+            cached = await redis.redis.hgetall(key)
+        if not cached or b"body" not in cached:
+            return None
+        self.local_cache.put(
+            key,
+            cached,
+            size=sum(len(value) for value in cached.values()),
+            tags=response_doc_ids(path, cached[b"body"]),
+        )
+        return cached
+
+    async def _put(self, key: str, entry: Dict[bytes, bytes], ttl: int, doc_ids: Set[str]) -> None:
+        """
+        Сохраняет ответ хешем redis: поля тела, заголовков, ETag и времени создания лежат рядом под одним ключом.
+
+        :param key:
+        :param entry:
+        :param ttl:
+        :param doc_ids: документы ответа для обратного индекса
+        :return:
+        """
+        tr = redis.redis.multi_exec()
+        tr.delete(key)
+        tr.hmset_dict(key, entry)
+        tr.expire(key, ttl)
+        if CACHE_INVALIDATION_ENABLED:
+            add_to_reverse_index(tr, key, doc_ids, ttl)
+        with REDIS_LATENCY.labels("multi_exec").time():
+            await tr.execute()
+        self.local_cache.put(key, entry, size=sum(len(value) for value in entry.values()), tags=doc_ids)
+
+    def _choose_encoding(self, request_headers: Headers, body: bytes) -> Optional[str]:
+        if not self.compression or len(body) < RESPONSE_COMPRESS_MIN_BYTES:
+            return None
+        return choose_encoding(request_headers.get("accept-encoding"))
+
+    @staticmethod
+    def _compress(body: bytes, encoding: str) -> bytes:
+        with SERIALIZATION_LATENCY.labels(f"compress_{encoding}", "").time():
+            return compress(body, encoding)
+
+    async def _encoded_body(self, key: str, cached: Dict[bytes, bytes], encoding: str, ttl: int, path: str) -> bytes:
+        """
+        Сжатое тело ответа. Если его ещё нет - сжимает и дописывает в запись кеша.
+        Поле дописывается в redis вместе с оставшимся TTL ответа: если ответ успели сбросить,
+        в redis остаётся запись без тела, которая считается промахом и истекает сама.
+
+        :param key:
+        :param cached:
+        :param encoding:
+        :param ttl: TTL ответа в redis, 0 - ответ не хранится
+        :param path: путь запроса, для тегов локального кеша
+        :return:
+        """
+        field = b"body:" + encoding.encode()
+        encoded = cached.get(field)
+        if encoded is not None:
+            return encoded
+
+        encoded = self._compress(cached[b"body"], encoding)
+        cached[field] = encoded
+        if not ttl:
+            return encoded
+
+        remaining = int(ttl - (time.time() - float(cached.get(b"modified_at", 0))))
+        if remaining > 0:
+            pipe = redis.redis.pipeline()
+            pipe.hset(key, field, encoded)
+            pipe.expire(key, remaining)
+            with REDIS_LATENCY.labels("pipeline").time():
+                await pipe.execute()
+        self.local_cache.put(
+            key,
+            cached,
+            size=sum(len(value) for value in cached.values()),
+            tags=response_doc_ids(path, cached[b"body"]),
+        )
+        return encoded
+
+    async def _send_cached(
+        self,
+        key: str,
+        cached: Dict[bytes, bytes],
+        scope: Scope,
+        cache_control: str,
+        ttl: int,
+        send: Send,
+    ) -> None:
+        """
+        Отправляет сохранённый ответ в подходящем клиенту сжатии или 304, если у клиента актуальная версия.
+        Cache-Control маршрута не перекрывает заголовок, выставленный эндпоинтом (например, no-store).
+        Записи, сохранённые до появления ETag, получают его при отправке.
+
+        :param key:
+        :param cached:
+        :param scope:
+        :param cache_control:
+        :param ttl: TTL ответа в redis, 0 - ответ не хранится
+        :param send:
+        :return:
+        """
+        request_headers = Headers(scope=scope)
+        etag = cached.get(b"etag") or response_etag(cached[b"body"])
+        modified_at = float(cached.get(b"modified_at", time.time()))
+        encoding = self._choose_encoding(request_headers, cached[b"body"])
+
+        headers = [(name.encode(), value.encode()) for name, value in orjson.loads(cached[b"headers"])]
+        if cache_control and not any(name.lower() == b"cache-control" for name, _ in headers):
+            headers.append((b"cache-control", cache_control.encode()))
+        if self.compression and len(cached[b"body"]) >= RESPONSE_COMPRESS_MIN_BYTES:
+            headers.append((b"vary", b"Accept-Encoding"))
+        headers.append((b"etag", encoded_etag(etag, encoding)))
+        headers.append((b"last-modified", formatdate(modified_at, usegmt=True).encode()))
+
+        if is_not_modified(request_headers, representation_etags(etag), modified_at):
+            await send_not_modified(headers, send)
+            return
+
+        body = await self._select_body(key, cached, encoding, ttl, scope["path"])
+        if encoding:
+            headers.append((b"content-encoding", encoding.encode()))
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _select_body(self, key: str, cached: Dict[bytes, bytes], encoding: Optional[str], ttl: int, path: str) -> bytes:
+        """
+        Тело ответа в выбранном сжатии: несжатое, сохранённое сжатое или сжатое сейчас (см. _encoded_body).
+
+        :param key:
+        :param cached:
+        :param encoding: алгоритм сжатия, None - без сжатия
+        :param ttl: TTL ответа в redis, 0 - ответ не хранится
+        :param path: путь запроса, для тегов локального кеша
+        :return:
+        """
+        if not encoding:
+            return cached[b"body"]
+        return await self._encoded_body(key, cached, encoding, ttl, path)
+
+
+def representation_etags(etag: bytes) -> List[bytes]:
+    """
+    ETag всех представлений ответа: у клиента может быть закешировано любое из них.
+
+    :param etag: ETag несжатого тела
+    :return:
+    """
+    return [etag, *[encoded_etag(etag, encoding) for encoding in ENCODERS]]
+
+
+async def send_not_modified(headers: List[Tuple[bytes, bytes]], send: Send) -> None:
+    """
+    Отвечает 304 с заголовками, которые повторяются в ответе без тела (RFC 7232, 4.1).
+
+    :param headers: заголовки полного ответа
+    :param send:
+    :return:
+    """
+    headers = [(name, value) for name, value in headers if name.decode().lower() in NOT_MODIFIED_HEADERS]
+    await send({"type": "http.response.start", "status": 304, "headers": headers})
+    await send({"type": "http.response.body", "body": b""})
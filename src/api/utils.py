@@ -1,11 +1,34 @@
-async def generate_body(query, from_, size) -> dict:
+import base64
+from http import HTTPStatus
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Type
+
+import orjson
+from elasticsearch import NotFoundError, RequestError
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from api.compression import choose_encoding, stream_compressor
+from core.config import CURSOR_PIT_KEEP_ALIVE, FACETS_GENRE_SIZE, FACETS_IMDB_RATING_BOUNDS, RESPONSE_COMPRESSION_ENABLED
+from services.base_service import BaseService
+from services.cache_entry import SearchPage
+from strings.exceptions import CURSOR_EXPIRED, INVALID_CURSOR, UNKNOWN_FIELDS
+
+# Заголовок ответа с курсором следующей страницы
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+async def generate_body(query, from_, size, cursor: Optional[dict] = None) -> dict:
     """
     Создаёт тело запроса к эластику.
     Если query не задан - возвращает все документы.
+    Если передан курсор - страница выбирается через search_after вместо from.
 
     :param query:
     :param from_: номер выводимой страницы
     :param size: кол-во данных (документов) на странице
+    :param cursor: расшифрованный курсор (см. decode_cursor)
     :return:
     """
 
@@ -16,7 +39,11 @@ async def generate_body(query, from_, size) -> dict:
 
     body = {"query": {"bool": {"must": [match]}}}
 
-    if from_:
+    if cursor:
+        body["search_after"] = cursor["search_after"]
+        if cursor.get("pit"):
+            body["pit"] = {"id": cursor["pit"], "keep_alive": CURSOR_PIT_KEEP_ALIVE}
+    elif from_:
         body["from"] = from_
     if size:
         body["size"] = size
@@ -53,3 +80,247 @@ async def add_filter_to_body(body, filter_genre) -> dict:
 
     body["query"]["bool"]["must"].append(filter_dict)
     return body
+
+
+async def add_tiebreaker_to_body(body) -> dict:
+    """
+    Дополняет сортировку уникальным полем id, чтобы порядок документов был однозначным
+    и по значениям сортировки последнего документа можно было продолжить выдачу (search_after).
+
+    :param body:
+    :return:
+    """
+    sort = body.get("sort", [{"_score": "desc"}])
+    body["sort"] = [*sort, {"id": "asc"}]
+    return body
+
+
+async def add_pit_to_body(body, pit_id: str) -> dict:
+    """
+    Выполняет запрос внутри point-in-time: все страницы курсора видят один снимок индекса.
+
+    :param body:
+    :param pit_id:
+    :return:
+    """
+    body["pit"] = {"id": pit_id, "keep_alive": CURSOR_PIT_KEEP_ALIVE}
+    return body
+
+
+async def add_cursor_pit_to_body(body: dict, pit: bool, service: BaseService, response: Response) -> dict:
+    """
+    С pit=true первая страница курсора открывает point-in-time, следующие продолжают его из курсора.
+    Ответ с pit не кешируется: курсор в нём принадлежит конкретному клиенту.
+
+    :param body:
+    :param pit: клиент просит зафиксировать снимок индекса
+    :param service: сервис индекса запроса
+    :param response:
+    :return:
+    """
+    if pit and "search_after" not in body:
+        body = await add_pit_to_body(body, await service.open_point_in_time())
+    if "pit" in body:
+        response.headers["Cache-Control"] = "no-store"
+    return body
+
+
+def build_facets_aggs() -> dict:
+    """
+    Агрегации эластика для фасетов выдачи фильмов: количество фильмов по жанрам и по диапазонам рейтинга.
+    Считаются по тому же запросу, что и выдача, включая фильтр по жанру (add_filter_to_body).
+
+    :return:
+    """
+    bounds = [None, *FACETS_IMDB_RATING_BOUNDS, None]
+    ranges = []
+    for from_, to in zip(bounds, bounds[1:]):
+        bucket = {}
+        if from_ is not None:
+            bucket["from"] = from_
+        if to is not None:
+            bucket["to"] = to
+        ranges.append(bucket)
+    return {
+        "genre": {"terms": {"field": "genre", "size": FACETS_GENRE_SIZE}},
+        "imdb_rating": {"range": {"field": "imdb_rating", "ranges": ranges}},
+    }
+
+
+def facets_from_aggregations(aggregations: dict) -> dict:
+    """
+    Переводит ответ эластика по агрегациям build_facets_aggs в фасеты ответа API.
+
+    :param aggregations:
+    :return:
+    """
+    return {
+        "genre": [{"name": bucket["key"], "count": bucket["doc_count"]} for bucket in aggregations["genre"]["buckets"]],
+        "imdb_rating": [
+            {"from": bucket.get("from"), "to": bucket.get("to"), "count": bucket["doc_count"]}
+            for bucket in aggregations["imdb_rating"]["buckets"]
+        ],
+    }
+
+
+def encode_cursor(search_after: list, pit_id: Optional[str] = None) -> str:
+    """
+    Упаковывает значения search_after (и id point-in-time) в непрозрачную для клиента строку.
+
+    :param search_after:
+    :param pit_id:
+    :return:
+    """
+    data = {"search_after": search_after}
+    if pit_id:
+        data["pit"] = pit_id
+    return base64.urlsafe_b64encode(orjson.dumps(data)).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[dict]:
+    """
+    Распаковывает курсор, полученный от клиента.
+
+    :param cursor:
+    :return:
+    """
+    if not cursor:
+        return None
+    try:
+        data = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=INVALID_CURSOR)
+    if not isinstance(data, dict) or not isinstance(data.get("search_after"), list):
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=INVALID_CURSOR)
+    return data
+
+
+def check_cursor(body: dict) -> None:
+    """
+    Проверяет, что курсор подходит к запросу: значений search_after столько же, сколько полей сортировки.
+    Курсор от другой сортировки иначе отклонил бы сам эластик.
+
+    :param body: тело запроса к эластику со сортировкой (add_tiebreaker_to_body)
+    :return:
+    """
+    if "search_after" in body and len(body["search_after"]) != len(body["sort"]):
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=INVALID_CURSOR)
+
+
+async def search_cursor_page(search: Callable[[dict], Awaitable[SearchPage]], body: dict) -> SearchPage:
+    """
+    Выполняет поиск страницы. Ошибки эластика на запросе с курсором - ошибки клиента:
+    курсор не подходит к запросу (400) или point-in-time курсора уже закрыт (410).
+
+    :param search: поиск страницы по телу запроса (search_page сервиса)
+    :param body:
+    :return:
+    """
+    if "search_after" not in body and "pit" not in body:
+        return await search(body)
+    try:
+        return await search(body)
+    except RequestError:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=INVALID_CURSOR)
+    except NotFoundError:
+        raise HTTPException(status_code=HTTPStatus.GONE, detail=CURSOR_EXPIRED)
+
+
+def source_fields(model: Type[BaseModel]) -> List[str]:
+    """
+    Поля документа эластика, нужные для построения модели ответа.
+
+    :param model:
+    :return:
+    """
+    return list(model.__fields__)
+
+
+async def add_source_to_body(body, model: Type[BaseModel]) -> dict:
+    """
+    Ограничивает _source в ответе эластика полями модели ответа.
+
+    :param body:
+    :param model:
+    :return:
+    """
+    body["_source"] = {"includes": source_fields(model)}
+    return body
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[List[str]]:
+    """
+    Разбирает список полей через запятую и проверяет, что все они есть в модели.
+
+    :param fields:
+    :param model:
+    :return: None - все поля
+    """
+    if not fields:
+        return None
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in model.__fields__]
+    if unknown:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=f"{UNKNOWN_FIELDS}: {', '.join(unknown)}")
+    return names or None
+
+
+async def export_response(
+    pages: AsyncIterator[List[BaseModel]],
+    fields: Optional[List[str]],
+    accept_encoding: Optional[str],
+) -> StreamingResponse:
+    """
+    Отдаёт выгрузку документов потоком NDJSON (документ на строку), сжатым по Accept-Encoding.
+    Первая страница запрашивается до ответа: недоступность эластика превращается в обычную ошибку,
+    а не в оборванный поток с кодом 200. Следующие страницы запрашиваются по мере того, как клиент
+    забирает предыдущие.
+
+    :param pages: страницы документов (BaseService.export)
+    :param fields: отдавать только эти поля документов
+    :param accept_encoding: заголовок Accept-Encoding запроса
+    :return:
+    """
+    try:
+        first = await pages.__anext__()
+    except StopAsyncIteration:
+        first = []
+
+    encoding = choose_encoding(accept_encoding) if RESPONSE_COMPRESSION_ENABLED else None
+    headers = {"Cache-Control": "no-store"}
+    if encoding:
+        headers.update({"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+    return StreamingResponse(ndjson_stream(first, pages, fields, encoding), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+
+async def ndjson_stream(
+    first: List[BaseModel],
+    pages: AsyncIterator[List[BaseModel]],
+    fields: Optional[List[str]],
+    encoding: Optional[str],
+) -> AsyncIterator[bytes]:
+    """
+    Сериализует страницы документов в NDJSON, по куску на страницу.
+
+    :param first: уже полученная первая страница
+    :param pages: остальные страницы
+    :param fields:
+    :param encoding: алгоритм сжатия или None
+    :return:
+    """
+    include = set(fields) if fields else None
+    compressor = stream_compressor(encoding) if encoding else None
+
+    async def all_pages() -> AsyncIterator[List[BaseModel]]:
+        yield first
+        async for docs in pages:
+            yield docs
+
+    async for docs in all_pages():
+        chunk = b"".join(orjson.dumps(doc.dict(include=include)) + b"\n" for doc in docs)
+        if compressor:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
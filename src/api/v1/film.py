@@ -1,18 +1,211 @@
+from functools import partial
 from http import HTTPStatus
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 
-from api.utils import add_filter_to_body, add_sort_to_body, generate_body
-from models.film_response import FilmDetailResponse, ShortFilmResponse
+from api.utils import (
+    NEXT_CURSOR_HEADER,
+    add_cursor_pit_to_body,
+    add_filter_to_body,
+    add_sort_to_body,
+    add_source_to_body,
+    add_tiebreaker_to_body,
+    build_facets_aggs,
+    check_cursor,
+    decode_cursor,
+    encode_cursor,
+    export_response,
+    facets_from_aggregations,
+    generate_body,
+    parse_fields,
+    search_cursor_page,
+    source_fields,
+)
+from core import config
+from core.metrics import TimedRoute
+from models.batch_request import BatchRequest
+from models.film import Film
+from models.film_response import FilmDetailResponse, FilmSearchFacetsResponse, ShortFilmResponse
+from models.genre import Genre
+from services.cache_entry import SearchPage
 from services.film import FilmService, get_film_service
-from strings.exceptions import FILM_NOT_FOUND
+from services.film_ranking import film_rankings
+from services.genre import GenreService, get_genre_service
+from services.suggest import film_suggest
+from strings.exceptions import FILM_NOT_FOUND, SUGGEST_NOT_READY
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+
+async def build_film_search_body(
+    query: Optional[str],
+    from_: Optional[str],
+    size: Optional[str],
+    sort: Optional[str],
+    filter_genre: Optional[Genre],
+    cursor_data: Optional[dict] = None,
+) -> dict:
+    """
+    Тело поискового запроса по фильмам. Вынесено отдельно, чтобы прогрев кеша строил
+    те же запросы (и ключи кеша), что и эндпоинты.
+
+    :param query:
+    :param from_:
+    :param size:
+    :param sort:
+    :param filter_genre:
+    :param cursor_data: расшифрованный курсор
+    :return:
+    """
+    body = await generate_body(query, from_, size, cursor_data)
+
+    if sort:
+        body = await add_sort_to_body(body, sort)
+    body = await add_tiebreaker_to_body(body)
+    body = await add_source_to_body(body, ShortFilmResponse)
+
+    if filter_genre:
+        body = await add_filter_to_body(body, filter_genre)
+    return body
+
+
+async def get_filter_genre(filter_genre_id: Optional[str], genre_service: GenreService) -> Optional[Genre]:
+    """
+    Жанр фильтра выдачи фильмов.
+
+    :param filter_genre_id:
+    :param genre_service:
+    :return: None - фильтр не задан
+    """
+    if not filter_genre_id:
+        return None
+    filter_genre = await genre_service.get_by_id(filter_genre_id)
+    if not filter_genre:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=FILM_NOT_FOUND)
+    return filter_genre
+
+
+def ranking_page_bounds(from_: Optional[str], size: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Смещение и размер страницы рейтинга из параметров page[number] и page[size].
+    Страницы за пределами ELASTIC_MAX_RESULT_WINDOW не отдаются: иначе одна страница выгружала бы
+    весь рейтинг, а эластик такой запрос отклоняет.
+
+    :param from_:
+    :param size:
+    :return: None - параметры некорректны, ответ об ошибке сформирует эластик
+    """
+    offset, size = from_ or "0", size or str(config.DEFAULT_PAGE_SIZE)
+    if not offset.isdigit() or not size.isdigit() or int(size) == 0:
+        return None
+    if int(offset) + int(size) > config.ELASTIC_MAX_RESULT_WINDOW:
+        return None
+    return int(offset), int(size)
+
+
+async def film_ranking_page(
+    response: Response,
+    from_: Optional[str],
+    size: Optional[str],
+    sort: str,
+    filter_genre_id: Optional[str],
+    film_service: FilmService,
+    genre_service: GenreService,
+) -> Optional[List[Film]]:
+    """
+    Страница film_filter из рейтингов фильмов в redis (services.film_ranking): порядок фильмов берётся из sorted set,
+    а сами фильмы - пачкой из кеша (get_many). Выдача и курсор следующей страницы совпадают с выдачей эластика.
+
+    :param response:
+    :param from_:
+    :param size:
+    :param sort:
+    :param filter_genre_id:
+    :param film_service:
+    :param genre_service:
+    :return: None - страницу нужно запросить у эластика
+    """
+    bounds = ranking_page_bounds(from_, size)
+    if bounds is None:
+        return None
+    offset, size = bounds
+
+    filter_genre = await get_filter_genre(filter_genre_id, genre_service)
+    genre_name = filter_genre.name if filter_genre else None
+    ranked = await film_rankings.page(film_service.redis, sort.startswith("-"), genre_name, offset, size)
+    if ranked is None:
+        return None
+    if len(ranked) >= size:
+        last_id, last_rating = ranked[-1]
+        if last_rating is None:
+            # Значения сортировки фильма без рейтинга в курсоре знает только эластик
+            return None
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([last_rating, last_id])
+
+    films = await film_service.get_many([id_ for id_, _ in ranked], fields=source_fields(ShortFilmResponse))
+    if not films:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=FILM_NOT_FOUND)
+    return films
+
+
+async def film_search_page(
+    response: Response,
+    query: Optional[str],
+    from_: Optional[str],
+    size: Optional[str],
+    sort: Optional[str],
+    filter_genre_id: Optional[str],
+    cursor: Optional[str],
+    pit: bool,
+    film_service: FilmService,
+    genre_service: GenreService,
+    aggs: Optional[dict] = None,
+) -> SearchPage:
+    """
+    Страница выдачи фильмов из эластика, общая для поиска, списка фильмов и их фасетов.
+    Курсор следующей страницы записывается в заголовок ответа.
+
+    :param response:
+    :param query:
+    :param from_:
+    :param size:
+    :param sort:
+    :param filter_genre_id:
+    :param cursor:
+    :param pit:
+    :param film_service:
+    :param genre_service:
+    :param aggs: агрегации эластика, считаются вместе со страницей
+    :return:
+    """
+    cursor_data = decode_cursor(cursor)
+    filter_genre = await get_filter_genre(filter_genre_id, genre_service)
+    body = await build_film_search_body(query, from_, size, sort, filter_genre, cursor_data)
+    check_cursor(body)
+
+    body = await add_cursor_pit_to_body(body, pit, film_service, response)
+
+    search = partial(film_service.search_page_with_aggs, aggs=aggs) if aggs else film_service.search_page
+    page = await search_cursor_page(search, body)
+
+    # Курсор полностью заполненной последней страницы ведёт на пустую страницу, а не на 404
+    if not page and not cursor_data:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=FILM_NOT_FOUND)
+
+    if page.next_search_after:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(page.next_search_after, page.pit_id)
+    return page
+
+
+def film_facets_response(page: SearchPage) -> FilmSearchFacetsResponse:
+    return FilmSearchFacetsResponse(result=page.docs, facets=facets_from_aggregations(page.aggregations))
 
 
 @router.get("/search", response_model=List[ShortFilmResponse])
 async def film_search(
+    response: Response,
     query: Optional[str] = Query("", alias="query"),
     from_: Optional[str] = Query(
         None,
@@ -28,39 +221,184 @@ async def film_search(
     ),
     sort: Optional[str] = Query(None, regex="-?imdb_rating"),
     filter_genre_id: Optional[str] = Query(None, alias="filter[genre]"),
+    cursor: Optional[str] = Query(
+        None,
+        description=f"Курсор следующей страницы из заголовка {NEXT_CURSOR_HEADER}, заменяет page[number]",
+    ),
+    pit: bool = Query(False, description="Зафиксировать снимок индекса для обхода курсором"),
     film_service: FilmService = Depends(get_film_service),
+    genre_service: GenreService = Depends(get_genre_service),
 ) -> Optional[List[ShortFilmResponse]]:
     """
-    Поиск по фильмам с пагинацией, фильтрацией по жанрам и сортировкой
+    Поиск по фильмам с пагинацией, фильтрацией по жанрам и сортировкой.
 
+    :param response:
     :param query:
     :param from_:
     :param size:
     :param sort:
     :param filter_genre_id:
+    :param cursor:
+    :param pit:
     :param film_service:
+    :param genre_service:
     :return:
     """
     if query == "" and len(query) == 0:
         return
 
-    body = await generate_body(query, from_, size)
+    page = await film_search_page(response, query, from_, size, sort, filter_genre_id, cursor, pit, film_service, genre_service)
+    return page.docs
 
-    if sort:
-        body = await add_sort_to_body(body, sort)
 
-    if filter_genre_id:
-        filter_genre = await film_service.get_by_id(filter_genre_id, index="genre")
-        if not filter_genre:
-            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=FILM_NOT_FOUND)
-        body = await add_filter_to_body(body, filter_genre)
+@router.get("/search/facets", response_model=FilmSearchFacetsResponse)
+async def film_search_facets(
+    response: Response,
+    query: str = Query(..., min_length=1),
+    from_: Optional[str] = Query(
+        None,
+        alias="page[number]",
+        title="страница",
+        description="Порядковый номер страницы результатов",
+    ),
+    size: Optional[str] = Query(
+        None,
+        alias="page[size]",
+        title="размер страницы",
+        description="Количество документов на странице",
+    ),
+    sort: Optional[str] = Query(None, regex="-?imdb_rating"),
+    filter_genre_id: Optional[str] = Query(None, alias="filter[genre]"),
+    cursor: Optional[str] = Query(
+        None,
+        description=f"Курсор следующей страницы из заголовка {NEXT_CURSOR_HEADER}, заменяет page[number]",
+    ),
+    pit: bool = Query(False, description="Зафиксировать снимок индекса для обхода курсором"),
+    film_service: FilmService = Depends(get_film_service),
+    genre_service: GenreService = Depends(get_genre_service),
+) -> FilmSearchFacetsResponse:
+    """
+    Поиск по фильмам, как /search, вместе с количеством фильмов по жанрам и диапазонам рейтинга.
+    Фасеты кешируются отдельно от страниц и не сбрасываются по событиям изменения фильмов, только по TTL.
+    GET /api/v1/film/search/facets?query=<запрос>
 
-    result = await film_service.search(body=body)
+    :param response:
+    :param query:
+    :param from_:
+    :param size:
+    :param sort:
+    :param filter_genre_id:
+    :param cursor:
+    :param pit:
+    :param film_service:
+    :param genre_service:
+    :return:
+    """
+    page = await film_search_page(
+        response, query, from_, size, sort, filter_genre_id, cursor, pit, film_service, genre_service, build_facets_aggs()
+    )
+    return film_facets_response(page)
 
-    if not result:
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=FILM_NOT_FOUND)
 
-    return result
+@router.get("/suggest", response_model=List[ShortFilmResponse])
+async def film_suggest_titles(
+    query: str = Query(..., min_length=1, description="Начало названия или одного из его слов"),
+    size: Optional[int] = Query(None, ge=1, le=config.SUGGEST_MAX_SIZE, description="Количество подсказок"),
+) -> List[ShortFilmResponse]:
+    """
+    Подсказки названий фильмов при наборе, лучшие по рейтингу. Отдаются из памяти воркера без эластика.
+    GET /api/v1/film/suggest?query=<начало названия>
+
+    :param query:
+    :param size:
+    :return:
+    """
+    if not film_suggest.loaded:
+        raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail=SUGGEST_NOT_READY, headers={"Retry-After": "1"})
+    return [
+        ShortFilmResponse(id=suggestion.id, title=suggestion.text, imdb_rating=suggestion.score)
+        for suggestion in film_suggest.suggest(query, size)
+    ]
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def film_export(
+    fields: Optional[str] = Query(None, description="Поля фильма через запятую, по умолчанию все"),
+    accept_encoding: Optional[str] = Header(None),
+    film_service: FilmService = Depends(get_film_service),
+) -> StreamingResponse:
+    """
+    Выгрузка всех фильмов потоком NDJSON (фильм на строку) для пакетной обработки
+    GET /api/v1/film/export?fields=id,title,imdb_rating
+
+    :param fields:
+    :param accept_encoding:
+    :param film_service:
+    :return:
+    """
+    fields = parse_fields(fields, Film)
+    return await export_response(film_service.export(fields), fields, accept_encoding)
+
+
+@router.post("/batch", response_model=List[FilmDetailResponse])
+async def film_batch(batch: BatchRequest, film_service: FilmService = Depends(get_film_service)) -> List[FilmDetailResponse]:
+    """
+    Отдаёт полную информацию по списку фильмов, ненайденные id пропускаются
+    POST /api/v1/film/batch
+
+    :param batch:
+    :param film_service:
+    :return:
+    """
+    films = await film_service.get_many(batch.ids)
+    return [FilmDetailResponse(**film.dict()) for film in films]
+
+
+@router.get("/facets", response_model=FilmSearchFacetsResponse)
+async def film_filter_facets(
+    response: Response,
+    from_: Optional[str] = Query(
+        None,
+        alias="page[number]",
+        title="страница",
+        description="Порядковый номер страницы результатов",
+    ),
+    size: Optional[str] = Query(
+        None,
+        alias="page[size]",
+        title="размер страницы",
+        description="Количество документов на странице",
+    ),
+    sort: Optional[str] = Query("imdb_rating", regex="-?imdb_rating"),
+    filter_genre_id: Optional[str] = Query(None, alias="filter[genre]"),
+    cursor: Optional[str] = Query(
+        None,
+        description=f"Курсор следующей страницы из заголовка {NEXT_CURSOR_HEADER}, заменяет page[number]",
+    ),
+    pit: bool = Query(False, description="Зафиксировать снимок индекса для обхода курсором"),
+    film_service: FilmService = Depends(get_film_service),
+    genre_service: GenreService = Depends(get_genre_service),
+) -> FilmSearchFacetsResponse:
+    """
+    Список фильмов, как /, вместе с количеством фильмов по жанрам и диапазонам рейтинга. Всегда идёт в эластик.
+    Фасеты кешируются отдельно от страниц и не сбрасываются по событиям изменения фильмов, только по TTL.
+    GET /api/v1/film/facets
+
+    :param response:
+    :param from_:
+    :param size:
+    :param sort:
+    :param filter_genre_id:
+    :param cursor:
+    :param pit:
+    :param film_service:
+    :param genre_service:
+    :return:
+    """
+    page = await film_search_page(
+        response, None, from_, size, sort, filter_genre_id, cursor, pit, film_service, genre_service, build_facets_aggs()
+    )
+    return film_facets_response(page)
 
 
 @router.get("/{film_id}", response_model=FilmDetailResponse)
@@ -82,6 +420,7 @@ async def film_details(film_id: str, film_service: FilmService = Depends(get_fil
 
 @router.get("/", response_model=List[ShortFilmResponse])
 async def film_filter(
+    response: Response,
     from_: Optional[str] = Query(
         None,
         alias="page[number]",
@@ -96,14 +435,18 @@ async def film_filter(
     ),
     sort: Optional[str] = Query("imdb_rating", regex="-?imdb_rating"),
     filter_genre_id: Optional[str] = Query(None, alias="filter[genre]"),
+    cursor: Optional[str] = Query(
+        None,
+        description=f"Курсор следующей страницы из заголовка {NEXT_CURSOR_HEADER}, заменяет page[number]",
+    ),
+    pit: bool = Query(False, description="Зафиксировать снимок индекса для обхода курсором"),
     film_service: FilmService = Depends(get_film_service),
+    genre_service: GenreService = Depends(get_genre_service),
 ) -> List[ShortFilmResponse]:
-    result = await film_search(
-        query=None,
-        from_=from_,
-        size=size,
-        sort=sort,
-        filter_genre_id=filter_genre_id,
-        film_service=film_service,
-    )
-    return result
+    if config.FILM_RANKING_ENABLED and sort and not cursor and not pit:
+        films = await film_ranking_page(response, from_, size, sort, filter_genre_id, film_service, genre_service)
+        if films is not None:
+            return films
+
+    page = await film_search_page(response, None, from_, size, sort, filter_genre_id, cursor, pit, film_service, genre_service)
+    return page.docs
@@ -3,21 +3,29 @@ from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
 
+from core.metrics import TimedRoute
+from models.batch_request import BatchRequest
 from models.genre_response import GenreResponse
 from services.genre import GenreService, get_genre_service
 from strings.exceptions import GENRE_NOT_FOUND
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 @router.get("/", response_model=List[GenreResponse])
 async def genres_list(genre_service: GenreService = Depends(get_genre_service)) -> List[GenreResponse]:
-    genres: list = await genre_service.search(body={})
+    genres = await genre_service.get_all()
     if not genres:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=GENRE_NOT_FOUND)
     return [GenreResponse(uuid=genre.id, name=genre.name) for genre in genres]
 
 
+@router.post("/batch", response_model=List[GenreResponse])
+async def genres_batch(batch: BatchRequest, genre_service: GenreService = Depends(get_genre_service)) -> List[GenreResponse]:
+    genres = await genre_service.get_many(batch.ids)
+    return [GenreResponse(uuid=genre.id, name=genre.name) for genre in genres]
+
+
 @router.get("/{genre_id}", response_model=GenreResponse)
 async def genre_details(genre_id: str, genre_service: GenreService = Depends(get_genre_service)) -> GenreResponse:
     genre = await genre_service.get_by_id(genre_id)
@@ -1,45 +1,165 @@
 from http import HTTPStatus
-from typing import List
+from typing import List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 
-from api.v1.film import generate_body
-from models.person_response import PersonFilmResponse, PersonResponse
+from api.utils import (
+    NEXT_CURSOR_HEADER,
+    add_cursor_pit_to_body,
+    add_tiebreaker_to_body,
+    check_cursor,
+    decode_cursor,
+    encode_cursor,
+    export_response,
+    generate_body,
+    parse_fields,
+    search_cursor_page,
+)
+from core import config
+from core.metrics import TimedRoute
+from models.batch_request import BatchRequest
+from models.film import Film
+from models.person import Film as PersonFilm
+from models.person import Person
+from models.person_response import (
+    PersonExpandedResponse,
+    PersonFilmDetailResponse,
+    PersonFilmResponse,
+    PersonResponse,
+    PersonSuggestResponse,
+)
+from services.film import FilmService, get_film_service
 from services.person import PersonService, get_person_service
-from strings.exceptions import PERSON_NOT_FOUND
+from services.suggest import person_suggest
+from strings.exceptions import PERSON_NOT_FOUND, SUGGEST_NOT_READY
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
-@router.get("/search", response_model=List[PersonResponse])
+def person_to_response(person: Person) -> PersonResponse:
+    return PersonResponse(uuid=person.id, full_name=person.fullname, films=[{film.id: film.role} for film in person.film_ids])
+
+
+def person_film_detail(person_film: PersonFilm, film: Optional[Film]) -> PersonFilmDetailResponse:
+    """
+    Фильм персоны с данными из индекса фильмов. Если фильма там нет, отдаются данные, скопированные в персону.
+
+    :param person_film: фильм из персоны
+    :param film: фильм из индекса фильмов
+    :return:
+    """
+    if film is None:
+        return PersonFilmDetailResponse(
+            uuid=person_film.id, title=person_film.title, imdb_rating=person_film.imdb_rating, role=person_film.role
+        )
+    return PersonFilmDetailResponse(
+        **film.dict(exclude={"id", "title"}),
+        uuid=film.id,
+        title=film.title or person_film.title,
+        role=person_film.role,
+    )
+
+
+async def expand_films(persons: List[Person], film_service: FilmService) -> List[List[PersonFilmDetailResponse]]:
+    """
+    Данные фильмов персон из индекса фильмов: title и imdb_rating в персоне копируются при индексации и отстают.
+    Фильмы всех персон запрашиваются одним get_many: каждый фильм один раз, на всю страницу персон -
+    не больше одного MGET в redis и одного mget в эластик по промахам.
+
+    :param persons:
+    :param film_service:
+    :return: фильмы каждой персоны в порядке persons
+    """
+    films = await film_service.get_many([film.id for person in persons for film in person.film_ids or []])
+    films_by_id = {film.id: film for film in films}
+    return [[person_film_detail(film, films_by_id.get(film.id)) for film in person.film_ids or []] for person in persons]
+
+
+@router.get("/search", response_model=Union[List[PersonExpandedResponse], List[PersonResponse]])
 async def person_search(
+    response: Response,
     query: str,
     page_number: int = Query(None, alias="page[number]"),
     page_size: int = Query(None, alias="page[size]"),
+    cursor: Optional[str] = Query(
+        None,
+        description=f"Курсор следующей страницы из заголовка {NEXT_CURSOR_HEADER}, заменяет page[number]",
+    ),
+    pit: bool = Query(False, description="Зафиксировать снимок индекса для обхода курсором"),
+    expand: bool = Query(False, alias="expand[films]", description="Добавить данные фильмов из индекса фильмов"),
     service: PersonService = Depends(get_person_service),
-) -> List[PersonResponse]:
-    body = await generate_body(query, page_number, page_size)
-    searched_persons = await service.search(body=body)
-    if not searched_persons:
+    film_service: FilmService = Depends(get_film_service),
+) -> Union[List[PersonExpandedResponse], List[PersonResponse]]:
+    cursor_data = decode_cursor(cursor)
+    body = await generate_body(query, page_number, page_size, cursor_data)
+    body = await add_tiebreaker_to_body(body)
+    check_cursor(body)
+    body = await add_cursor_pit_to_body(body, pit, service, response)
+
+    page = await search_cursor_page(service.search_page, body)
+    # Курсор полностью заполненной последней страницы ведёт на пустую страницу, а не на 404
+    if not page and not cursor_data:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=PERSON_NOT_FOUND)
+    if page.next_search_after:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(page.next_search_after, page.pit_id)
+    if expand:
+        films = await expand_films(page.docs, film_service)
+        return [
+            PersonExpandedResponse(**person_to_response(person).dict(), film_details=person_films)
+            for person, person_films in zip(page.docs, films)
+        ]
+    return [person_to_response(person) for person in page.docs]
+
+
+@router.get("/suggest", response_model=List[PersonSuggestResponse])
+async def person_suggest_names(
+    query: str = Query(..., min_length=1, description="Начало имени или фамилии"),
+    size: Optional[int] = Query(None, ge=1, le=config.SUGGEST_MAX_SIZE, description="Количество подсказок"),
+) -> List[PersonSuggestResponse]:
+    if not person_suggest.loaded:
+        raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail=SUGGEST_NOT_READY, headers={"Retry-After": "1"})
     return [
-        PersonResponse(uuid=person.id, full_name=person.fullname, films=[{film.id: film.role} for film in person.film_ids])
-        for person in searched_persons
+        PersonSuggestResponse(uuid=suggestion.id, full_name=suggestion.text, films_count=int(suggestion.score))
+        for suggestion in person_suggest.suggest(query, size)
     ]
 
 
+@router.get("/export", response_class=StreamingResponse)
+async def person_export(
+    fields: Optional[str] = Query(None, description="Поля персоны через запятую, по умолчанию все"),
+    accept_encoding: Optional[str] = Header(None),
+    service: PersonService = Depends(get_person_service),
+) -> StreamingResponse:
+    fields = parse_fields(fields, Person)
+    return await export_response(service.export(fields), fields, accept_encoding)
+
+
+@router.post("/batch", response_model=List[PersonResponse])
+async def person_batch(batch: BatchRequest, person_service: PersonService = Depends(get_person_service)) -> List[PersonResponse]:
+    persons = await person_service.get_many(batch.ids)
+    return [person_to_response(person) for person in persons]
+
+
 @router.get("/{person_id}", response_model=PersonResponse)
 async def person_details(person_id: str, person_service: PersonService = Depends(get_person_service)) -> PersonResponse:
     person = await person_service.get_by_id(person_id)
     if not person:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=PERSON_NOT_FOUND)
-    return PersonResponse(uuid=person.id, full_name=person.fullname, films=[{film.id: film.role} for film in person.film_ids])
+    return person_to_response(person)
 
 
-@router.get("/{person_id}/film", response_model=List[PersonFilmResponse])
-async def person_films(person_id: str, person_service: PersonService = Depends(get_person_service)) -> List[PersonFilmResponse]:
+@router.get("/{person_id}/film", response_model=Union[List[PersonFilmDetailResponse], List[PersonFilmResponse]])
+async def person_films(
+    person_id: str,
+    expand: bool = Query(False, alias="expand[films]", description="Отдать данные фильмов из индекса фильмов"),
+    person_service: PersonService = Depends(get_person_service),
+    film_service: FilmService = Depends(get_film_service),
+) -> Union[List[PersonFilmDetailResponse], List[PersonFilmResponse]]:
     person = await person_service.get_by_id(person_id)
     if not person:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=PERSON_NOT_FOUND)
+    if expand:
+        return (await expand_films([person], film_service))[0]
 
     return [PersonFilmResponse(uuid=film.id, title=film.title, imdb_rating=film.imdb_rating) for film in person.film_ids]
@@ -13,13 +13,41 @@ logging_config.dictConfig(LOGGING)
 # Название проекта. Используется в Swagger-документации
 PROJECT_NAME = os.getenv("PROJECT_NAME", "movies")
 
-# Настройки Redis
+# Настройки Redis, размеры пула соединений - на каждый воркер
 REDIS_HOST = os.getenv("REDIS_HOST", "127.0.0.1")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_POOL_MIN_SIZE = int(os.getenv("REDIS_POOL_MIN_SIZE", 10))
+REDIS_POOL_MAX_SIZE = int(os.getenv("REDIS_POOL_MAX_SIZE", 20))
+REDIS_CONNECT_TIMEOUT_IN_SECONDS = float(os.getenv("REDIS_CONNECT_TIMEOUT_IN_SECONDS", 5))
 
-# Настройки Elasticsearch
+# Настройки Elasticsearch, размер пула соединений - на каждый воркер
 ELASTIC_HOST = os.getenv("ELASTIC_HOST", "127.0.0.1")
 ELASTIC_PORT = int(os.getenv("ELASTIC_PORT", 9200))
+ELASTIC_MAXSIZE = int(os.getenv("ELASTIC_MAXSIZE", 25))
+ELASTIC_TIMEOUT_IN_SECONDS = float(os.getenv("ELASTIC_TIMEOUT_IN_SECONDS", 10))
+ELASTIC_MAX_RETRIES = int(os.getenv("ELASTIC_MAX_RETRIES", 1))
+# Таймауты отдельных вызовов эластика из сервисов: чтения по id (get, mget) и поиска (search, msearch)
+ELASTIC_GET_TIMEOUT_IN_SECONDS = float(os.getenv("ELASTIC_GET_TIMEOUT_IN_SECONDS", 1))
+ELASTIC_SEARCH_TIMEOUT_IN_SECONDS = float(os.getenv("ELASTIC_SEARCH_TIMEOUT_IN_SECONDS", 3))
+# Предохранитель на индекс: размыкается, когда в окне из последних WINDOW вызовов (не меньше MIN_CALLS)
+# доля ошибок достигла FAILURE_RATE; через OPEN_SECONDS пропускает HALF_OPEN_CALLS пробных вызовов
+ELASTIC_BREAKER_WINDOW = int(os.getenv("ELASTIC_BREAKER_WINDOW", 20))
+ELASTIC_BREAKER_MIN_CALLS = int(os.getenv("ELASTIC_BREAKER_MIN_CALLS", 10))
+ELASTIC_BREAKER_FAILURE_RATE = float(os.getenv("ELASTIC_BREAKER_FAILURE_RATE", 0.5))
+ELASTIC_BREAKER_OPEN_SECONDS = float(os.getenv("ELASTIC_BREAKER_OPEN_SECONDS", 10))
+ELASTIC_BREAKER_HALF_OPEN_CALLS = int(os.getenv("ELASTIC_BREAKER_HALF_OPEN_CALLS", 1))
+# Ограничитель одновременных вызовов эластика на индекс и вид вызова (search, get): лимит в пределах MIN..MAX
+# растёт на быстрых вызовах и умножается на BACKOFF, когда вызов дольше LATENCY_TARGET или эластик ответил ошибкой.
+# Вызовы сверх лимита ждут в очереди до QUEUE_SIZE штук не дольше QUEUE_TIMEOUT, остальные получают 503
+ELASTIC_LIMITER_ENABLED = os.getenv("ELASTIC_LIMITER_ENABLED", "true").lower() == "true"
+ELASTIC_LIMITER_INITIAL_LIMIT = int(os.getenv("ELASTIC_LIMITER_INITIAL_LIMIT", 10))
+ELASTIC_LIMITER_MIN_LIMIT = int(os.getenv("ELASTIC_LIMITER_MIN_LIMIT", 2))
+ELASTIC_LIMITER_MAX_LIMIT = int(os.getenv("ELASTIC_LIMITER_MAX_LIMIT", ELASTIC_MAXSIZE))
+ELASTIC_LIMITER_BACKOFF = float(os.getenv("ELASTIC_LIMITER_BACKOFF", 0.9))
+ELASTIC_LIMITER_SEARCH_LATENCY_TARGET_IN_SECONDS = float(os.getenv("ELASTIC_LIMITER_SEARCH_LATENCY_TARGET_IN_SECONDS", 0.5))
+ELASTIC_LIMITER_GET_LATENCY_TARGET_IN_SECONDS = float(os.getenv("ELASTIC_LIMITER_GET_LATENCY_TARGET_IN_SECONDS", 0.1))
+ELASTIC_LIMITER_QUEUE_SIZE = int(os.getenv("ELASTIC_LIMITER_QUEUE_SIZE", 100))
+ELASTIC_LIMITER_QUEUE_TIMEOUT_IN_SECONDS = float(os.getenv("ELASTIC_LIMITER_QUEUE_TIMEOUT_IN_SECONDS", 1))
 
 # Корень проекта
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -27,6 +55,148 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Настройки сервера
 SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
 SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
+# development - один процесс с DEBUG-логированием, production - несколько воркеров на uvloop/httptools
+SERVER_MODE = os.getenv("SERVER_MODE", "development")
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", os.cpu_count() or 1))
+SERVER_KEEP_ALIVE_TIMEOUT_IN_SECONDS = int(os.getenv("SERVER_KEEP_ALIVE_TIMEOUT_IN_SECONDS", 5))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", 2048))
+SERVER_ACCESS_LOG = os.getenv("SERVER_ACCESS_LOG", "false").lower() == "true"
 
 # TTL кэша
 CACHE_EXPIRE_IN_SECONDS = int(os.getenv("CACHE_EXPIRE_IN_SECONDS", 5 * 60))
+
+# Настройки in-process кеша (L1) перед Redis, на каждый воркер и сервис
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", 10_000))
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+LOCAL_CACHE_EXPIRE_IN_SECONDS = int(os.getenv("LOCAL_CACHE_EXPIRE_IN_SECONDS", 30))
+
+# Распределённая блокировка в redis при промахе кеша, чтобы в эластик за ключом ходил один воркер
+CACHE_LOCK_ENABLED = os.getenv("CACHE_LOCK_ENABLED", "false").lower() == "true"
+CACHE_LOCK_EXPIRE_IN_MS = int(os.getenv("CACHE_LOCK_EXPIRE_IN_MS", 3000))
+CACHE_LOCK_POLL_INTERVAL_IN_MS = int(os.getenv("CACHE_LOCK_POLL_INTERVAL_IN_MS", 50))
+
+# Максимальное количество id в одном batch-запросе
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 100))
+
+# Префикс ключей в redis и версии схемы закешированных данных по сервисам.
+# Увеличение версии инвалидирует всё пространство ключей сервиса после изменения модели.
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "movies_api")
+FILM_CACHE_SCHEMA_VERSION = int(os.getenv("FILM_CACHE_SCHEMA_VERSION", 1))
+GENRE_CACHE_SCHEMA_VERSION = int(os.getenv("GENRE_CACHE_SCHEMA_VERSION", 1))
+PERSON_CACHE_SCHEMA_VERSION = int(os.getenv("PERSON_CACHE_SCHEMA_VERSION", 1))
+
+# Soft/hard TTL кеша по сервисам. После soft TTL запись отдаётся как есть и обновляется в фоне,
+# после hard TTL удаляется из redis и следующий запрос ждёт эластик
+FILM_CACHE_SOFT_TTL_IN_SECONDS = int(os.getenv("FILM_CACHE_SOFT_TTL_IN_SECONDS", CACHE_EXPIRE_IN_SECONDS))
+FILM_CACHE_HARD_TTL_IN_SECONDS = int(os.getenv("FILM_CACHE_HARD_TTL_IN_SECONDS", 6 * CACHE_EXPIRE_IN_SECONDS))
+GENRE_CACHE_SOFT_TTL_IN_SECONDS = int(os.getenv("GENRE_CACHE_SOFT_TTL_IN_SECONDS", CACHE_EXPIRE_IN_SECONDS))
+GENRE_CACHE_HARD_TTL_IN_SECONDS = int(os.getenv("GENRE_CACHE_HARD_TTL_IN_SECONDS", 12 * CACHE_EXPIRE_IN_SECONDS))
+PERSON_CACHE_SOFT_TTL_IN_SECONDS = int(os.getenv("PERSON_CACHE_SOFT_TTL_IN_SECONDS", CACHE_EXPIRE_IN_SECONDS))
+PERSON_CACHE_HARD_TTL_IN_SECONDS = int(os.getenv("PERSON_CACHE_HARD_TTL_IN_SECONDS", 6 * CACHE_EXPIRE_IN_SECONDS))
+
+# Размер страницы эластика по умолчанию и время жизни point-in-time для курсорной пагинации
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 10))
+CURSOR_PIT_KEEP_ALIVE = os.getenv("CURSOR_PIT_KEEP_ALIVE", "1m")
+# index.max_result_window индексов: страницы с from + size больше него эластик отклоняет
+ELASTIC_MAX_RESULT_WINDOW = int(os.getenv("ELASTIC_MAX_RESULT_WINDOW", 10000))
+
+# Выгрузка индекса целиком (/export): документов на запрос к эластику и время жизни point-in-time между запросами.
+# Следующая страница запрашивается, только когда клиент забрал предыдущую, поэтому keep-alive покрывает медленного клиента
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+EXPORT_PIT_KEEP_ALIVE = os.getenv("EXPORT_PIT_KEEP_ALIVE", "5m")
+
+# Фасеты поиска фильмов (/film/search/facets и /film/facets): сколько жанров отдавать и границы диапазонов рейтинга
+FACETS_GENRE_SIZE = int(os.getenv("FACETS_GENRE_SIZE", 50))
+FACETS_IMDB_RATING_BOUNDS = [float(bound) for bound in os.getenv("FACETS_IMDB_RATING_BOUNDS", "4,6,8").split(",")]
+
+# Записи кеша больше этого размера (в байтах) сжимаются zlib с указанным уровнем
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", 4096))
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL", 1))
+
+# HTTP-кеширование ответов клиентами и CDN: max-age и stale-while-revalidate заголовка Cache-Control
+# для выдач (поиск, списки) и для карточек документов
+HTTP_CACHE_LIST_MAX_AGE_IN_SECONDS = int(os.getenv("HTTP_CACHE_LIST_MAX_AGE_IN_SECONDS", 30))
+HTTP_CACHE_DETAILS_MAX_AGE_IN_SECONDS = int(os.getenv("HTTP_CACHE_DETAILS_MAX_AGE_IN_SECONDS", 300))
+HTTP_CACHE_STALE_WHILE_REVALIDATE_IN_SECONDS = int(os.getenv("HTTP_CACHE_STALE_WHILE_REVALIDATE_IN_SECONDS", 600))
+HTTP_CACHE_LIST_CONTROL = (
+    f"public, max-age={HTTP_CACHE_LIST_MAX_AGE_IN_SECONDS}, "
+    f"stale-while-revalidate={HTTP_CACHE_STALE_WHILE_REVALIDATE_IN_SECONDS}"
+)
+HTTP_CACHE_DETAILS_CONTROL = (
+    f"public, max-age={HTTP_CACHE_DETAILS_MAX_AGE_IN_SECONDS}, "
+    f"stale-while-revalidate={HTTP_CACHE_STALE_WHILE_REVALIDATE_IN_SECONDS}"
+)
+
+# Кеш готовых HTTP-ответов: маршрут (регулярное выражение пути) -> TTL в секундах и заголовок Cache-Control.
+# Выигрывает первое совпадение, TTL 0 отключает кеширование маршрута в redis (ETag и Cache-Control остаются),
+# пустой Cache-Control не добавляет заголовок.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_SCHEMA_VERSION = int(os.getenv("RESPONSE_CACHE_SCHEMA_VERSION", 1))
+RESPONSE_CACHE_EXPIRE_IN_SECONDS = int(os.getenv("RESPONSE_CACHE_EXPIRE_IN_SECONDS", 60))
+RESPONSE_CACHE_ROUTES = [
+    (r"^/api/v1/(film|person)/search/?$", RESPONSE_CACHE_EXPIRE_IN_SECONDS, HTTP_CACHE_LIST_CONTROL),
+    (r"^/api/v1/film/(search/)?facets/?$", RESPONSE_CACHE_EXPIRE_IN_SECONDS, HTTP_CACHE_LIST_CONTROL),
+    (r"^/api/v1/(film|genre)/?$", RESPONSE_CACHE_EXPIRE_IN_SECONDS, HTTP_CACHE_LIST_CONTROL),
+    # Подсказки и так отдаются из памяти воркера: в redis не кешируются, но кешируются клиентом
+    (r"^/api/v1/(film|person)/suggest/?$", 0, HTTP_CACHE_LIST_CONTROL),
+    # Выгрузка (/export) стримится и не проходит через кеш ответов: ни один маршрут ей не соответствует
+    (
+        r"^/api/v1/(film|genre|person)/(?!(export|facets)/?$)[^/]+/?$",
+        RESPONSE_CACHE_EXPIRE_IN_SECONDS,
+        HTTP_CACHE_DETAILS_CONTROL,
+    ),
+    (r"^/api/v1/person/[^/]+/film/?$", RESPONSE_CACHE_EXPIRE_IN_SECONDS, HTTP_CACHE_DETAILS_CONTROL),
+]
+
+# Справочник жанров в памяти: период перезагрузки и максимальное количество жанров
+GENRE_CATALOG_REFRESH_INTERVAL_IN_SECONDS = int(os.getenv("GENRE_CATALOG_REFRESH_INTERVAL_IN_SECONDS", 5 * 60))
+GENRE_CATALOG_MAX_SIZE = int(os.getenv("GENRE_CATALOG_MAX_SIZE", 1000))
+
+# Подсказки при наборе из памяти воркера: период полной перезагрузки индекса подсказок, размер страницы загрузки,
+# максимум подсказок в ответе и с какого числа подходящих документов подсказки для префикса считаются заранее
+SUGGEST_REFRESH_INTERVAL_IN_SECONDS = int(os.getenv("SUGGEST_REFRESH_INTERVAL_IN_SECONDS", 10 * 60))
+SUGGEST_LOAD_BATCH_SIZE = int(os.getenv("SUGGEST_LOAD_BATCH_SIZE", 1000))
+SUGGEST_MAX_SIZE = int(os.getenv("SUGGEST_MAX_SIZE", 10))
+SUGGEST_PRECOMPUTED_MIN_MATCHES = int(os.getenv("SUGGEST_PRECOMPUTED_MIN_MATCHES", 200))
+
+# Рейтинги фильмов в sorted set redis для выдачи film_filter без эластика: период полного перестроения
+# и время жизни ключей (если перестроения прекратились, выдача возвращается в эластик)
+FILM_RANKING_ENABLED = os.getenv("FILM_RANKING_ENABLED", "true").lower() == "true"
+FILM_RANKING_REFRESH_INTERVAL_IN_SECONDS = int(os.getenv("FILM_RANKING_REFRESH_INTERVAL_IN_SECONDS", 10 * 60))
+FILM_RANKING_EXPIRE_IN_SECONDS = int(os.getenv("FILM_RANKING_EXPIRE_IN_SECONDS", 3 * FILM_RANKING_REFRESH_INTERVAL_IN_SECONDS))
+
+# TTL отрицательного кеша: ненайденные по id документы и пустые выдачи поиска
+NEGATIVE_CACHE_EXPIRE_IN_SECONDS = int(os.getenv("NEGATIVE_CACHE_EXPIRE_IN_SECONDS", 30))
+
+# Сколько запись кеша хранится в redis после hard TTL: её отдают, только если эластик недоступен
+CACHE_STALE_IF_ERROR_IN_SECONDS = int(os.getenv("CACHE_STALE_IF_ERROR_IN_SECONDS", 60 * 60))
+
+# Статистика самых частых поисковых запросов (для прогрева кеша): период сброса счётчиков в redis,
+# сколько запросов хранить на индекс и сколько живёт статистика без новых обращений
+POPULAR_QUERIES_FLUSH_INTERVAL_IN_SECONDS = int(os.getenv("POPULAR_QUERIES_FLUSH_INTERVAL_IN_SECONDS", 10))
+POPULAR_QUERIES_MAX_SIZE = int(os.getenv("POPULAR_QUERIES_MAX_SIZE", 1000))
+POPULAR_QUERIES_EXPIRE_IN_SECONDS = int(os.getenv("POPULAR_QUERIES_EXPIRE_IN_SECONDS", 7 * 24 * 60 * 60))
+
+# Прогрев кеша: при старте сервера (один воркер на WARMUP_LOCK_EXPIRE_IN_SECONDS) или командой python -m warmup
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+WARMUP_LOCK_EXPIRE_IN_SECONDS = int(os.getenv("WARMUP_LOCK_EXPIRE_IN_SECONDS", 60))
+# Сколько фильмов с начала выдачи по рейтингу прогревать для каждого жанра и для выдачи без фильтра
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", 50))
+# Сколько самых частых поисковых запросов прогревать на индекс
+WARMUP_POPULAR_QUERIES = int(os.getenv("WARMUP_POPULAR_QUERIES", 200))
+# Одновременных запросов в эластик и запросов в одном msearch
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", 4))
+WARMUP_BATCH_SIZE = int(os.getenv("WARMUP_BATCH_SIZE", 20))
+
+# Сброс кеша по событиям: производитель (ETL) публикует в канал {"index": ..., "ids": [...]} изменённых документов.
+# Обратный индекс (id документа -> ключи кеша с ним) живёт до истечения самой долгоживущей записи кеша.
+CACHE_INVALIDATION_ENABLED = os.getenv("CACHE_INVALIDATION_ENABLED", "true").lower() == "true"
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", f"{CACHE_KEY_PREFIX}:invalidate")
+
+# Сжатие ответов по Accept-Encoding (zstd и br - если установлены zstandard и brotli).
+# Ответы меньше RESPONSE_COMPRESS_MIN_BYTES не сжимаются, сжатые тела хранятся рядом с закешированным ответом.
+RESPONSE_COMPRESSION_ENABLED = os.getenv("RESPONSE_COMPRESSION_ENABLED", "true").lower() == "true"
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", 1024))
+RESPONSE_COMPRESS_GZIP_LEVEL = int(os.getenv("RESPONSE_COMPRESS_GZIP_LEVEL", 6))
+RESPONSE_COMPRESS_BROTLI_QUALITY = int(os.getenv("RESPONSE_COMPRESS_BROTLI_QUALITY", 5))
+RESPONSE_COMPRESS_ZSTD_LEVEL = int(os.getenv("RESPONSE_COMPRESS_ZSTD_LEVEL", 3))
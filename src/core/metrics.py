@@ -0,0 +1,163 @@
+"""
+Метрики сервиса в формате Prometheus, отдаются эндпоинтом /metrics.
+Значения собираются хуками в BaseService, кешах, MetricsMiddleware и TimedRoute.
+"""
+import asyncio
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Coroutine, Optional
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Обращения к кешу: hit, negative_hit (закешированное отсутствие) и miss по уровням кеша",
+    ["service", "index", "tier", "result"],
+)
+REDIS_LATENCY = Histogram(
+    "redis_call_duration_seconds",
+    "Время вызова redis",
+    ["command"],
+    buckets=LATENCY_BUCKETS,
+)
+ELASTIC_LATENCY = Histogram(
+    "elastic_call_duration_seconds",
+    "Время вызова эластика с точки зрения клиента",
+    ["operation", "index"],
+    buckets=LATENCY_BUCKETS,
+)
+ELASTIC_TOOK = Histogram(
+    "elastic_took_seconds",
+    "Время выполнения запроса внутри эластика (поле took ответа)",
+    ["operation", "index"],
+    buckets=LATENCY_BUCKETS,
+)
+CIRCUIT_BREAKER_TRANSITIONS = Counter(
+    "circuit_breaker_transitions_total",
+    "Переходы предохранителей эластика в состояние state (closed, open, half_open)",
+    ["breaker", "state"],
+)
+CONCURRENCY_LIMIT = Gauge(
+    "concurrency_limit",
+    "Текущий лимит одновременных вызовов эластика по ограничителям (индекс:вид вызова)",
+    ["limiter"],
+    multiprocess_mode="liveall",
+)
+LIMITER_QUEUE_WAIT = Histogram(
+    "concurrency_limiter_queue_wait_seconds",
+    "Время ожидания слота ограничителя одновременных вызовов эластика",
+    ["limiter"],
+    buckets=LATENCY_BUCKETS,
+)
+LIMITER_REJECTIONS = Counter(
+    "concurrency_limiter_rejections_total",
+    "Вызовы эластика, отклонённые ограничителем: очередь заполнена (queue_full) или истекло ожидание (timeout)",
+    ["limiter", "reason"],
+)
+SERIALIZATION_LATENCY = Histogram(
+    "serialization_duration_seconds",
+    "Время валидации моделей pydantic, (де)сериализации записей кеша и сборки ответа (stage render)",
+    ["stage", "index"],
+    buckets=LATENCY_BUCKETS,
+)
+LOCAL_CACHE_STATS = Gauge(
+    "local_cache_stats",
+    "Счётчики локальных кешей воркера (LocalCache.stats): hits, misses, evictions, entries, bytes. "
+    "Обновляются при отдаче /metrics воркером, принявшим запрос",
+    ["cache", "stat"],
+    multiprocess_mode="liveall",
+)
+
+UNMATCHED_ROUTE = "unmatched"
+
+# Момент, когда эндпоинт текущего запроса вернул результат
+_endpoint_returned_at: ContextVar[Optional[float]] = ContextVar("endpoint_returned_at", default=None)
+
+
+class MetricsMiddleware:
+    """
+    Замеряет время обработки каждого HTTP-запроса. Метка route - шаблон пути маршрута
+    (/api/v1/film/{film_id}), а не сам путь, чтобы не плодить временные ряды.
+    Стоит снаружи кеша ответов, поэтому учитывает и запросы, отданные из него.
+    """
+
+    def __init__(self, app: ASGIApp, routes: list):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_LATENCY.labels(scope["method"], self._route_path(scope), status).observe(time.perf_counter() - started)
+
+    def _route_path(self, scope: Scope) -> str:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return UNMATCHED_ROUTE
+
+
+class TimedRoute(APIRoute):
+    """
+    Маршрут FastAPI, замеряющий сборку ответа после возврата эндпоинта: валидацию моделью ответа (response_model),
+    jsonable_encoder и сериализацию классом ответа (ORJSONResponse). Время попадает в SERIALIZATION_LATENCY
+    со stage render. Ответы, которые эндпоинт собрал сам (Response, StreamingResponse), не учитываются.
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        if asyncio.iscoroutinefunction(endpoint):
+            endpoint = _timed_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Request) -> Response:
+            response = await handler(request)
+            returned_at = _endpoint_returned_at.get()
+            if returned_at is not None:
+                SERIALIZATION_LATENCY.labels("render", "").observe(time.perf_counter() - returned_at)
+                _endpoint_returned_at.set(None)
+            return response
+
+        return timed_handler
+
+
+def _timed_endpoint(endpoint: Callable[..., Coroutine[Any, Any, Any]]) -> Callable[..., Coroutine[Any, Any, Any]]:
+    # Сигнатура эндпоинта сохраняется (functools.wraps): по ней FastAPI строит зависимости и параметры
+    @wraps(endpoint)
+    async def timed(*args: Any, **kwargs: Any) -> Any:
+        result = await endpoint(*args, **kwargs)
+        if not isinstance(result, Response):
+            _endpoint_returned_at.set(time.perf_counter())
+        return result
+
+    return timed
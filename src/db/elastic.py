@@ -2,8 +2,20 @@ from typing import Optional
 
 from elasticsearch import AsyncElasticsearch
 
+from core import config
+
 es: Optional[AsyncElasticsearch] = None
 
 
 async def get_elastic() -> AsyncElasticsearch:
     return es
+
+
+def create_elastic() -> AsyncElasticsearch:
+    return AsyncElasticsearch(
+        hosts=[f"{config.ELASTIC_HOST}:{config.ELASTIC_PORT}"],
+        maxsize=config.ELASTIC_MAXSIZE,
+        timeout=config.ELASTIC_TIMEOUT_IN_SECONDS,
+        max_retries=config.ELASTIC_MAX_RETRIES,
+        retry_on_timeout=True,
+    )
@@ -1,9 +1,21 @@
 from typing import Optional
 
+import aioredis
 from aioredis import Redis
 
+from core import config
+
 redis: Optional[Redis] = None
 
 
 async def get_redis() -> Redis:
     return redis
+
+
+async def create_redis() -> Redis:
+    return await aioredis.create_redis_pool(
+        (config.REDIS_HOST, config.REDIS_PORT),
+        minsize=config.REDIS_POOL_MIN_SIZE,
+        maxsize=config.REDIS_POOL_MAX_SIZE,
+        timeout=config.REDIS_CONNECT_TIMEOUT_IN_SECONDS,
+    )
@@ -1,15 +1,35 @@
+import asyncio
 import logging
+import math
+import os
+import tempfile
+from functools import partial
+from http import HTTPStatus
 
-import aioredis
 import uvicorn
-from elasticsearch import AsyncElasticsearch
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.responses import ORJSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
 
+from api.response_cache import ResponseCacheMiddleware
 from api.v1 import film, genre, person
 from core import config
 from core.logger import LOGGING
+from core.metrics import MetricsMiddleware
 from db import elastic, redis
+from db.elastic import create_elastic
+from db.redis import create_redis
+from services.circuit_breaker import ElasticUnavailableError
+from services.film_ranking import film_rankings
+from services.genre_catalog import genre_catalog
+from services.invalidation import cache_invalidator
+from services.local_cache import export_local_cache_stats
+from services.popular_queries import popular_queries
+from services.suggest import film_suggest, person_suggest
+from strings.exceptions import ELASTIC_UNAVAILABLE
+from warmup import warm_up_on_startup
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title=config.PROJECT_NAME,
@@ -18,28 +38,130 @@ app = FastAPI(
     default_response_class=ORJSONResponse,
 )
 
+# Фоновые задачи воркера, останавливаются при shutdown
+background_tasks = []
+
 
 @app.on_event("startup")
 async def startup():
-    redis.redis = await aioredis.create_redis_pool((config.REDIS_HOST, config.REDIS_PORT), minsize=10, maxsize=20)
-    elastic.es = AsyncElasticsearch(hosts=[f"{config.ELASTIC_HOST}:{config.ELASTIC_PORT}"])
+    redis.redis = await create_redis()
+    elastic.es = create_elastic()
+
+    try:
+        await genre_catalog.load(elastic.es)
+    except Exception as err:
+        logger.warning("Справочник жанров не загружен при старте: %s", err)
+    background_tasks.append(
+        asyncio.create_task(genre_catalog.refresh_forever(elastic.es, config.GENRE_CATALOG_REFRESH_INTERVAL_IN_SECONDS))
+    )
+    background_tasks.append(
+        asyncio.create_task(popular_queries.flush_forever(redis.redis, config.POPULAR_QUERIES_FLUSH_INTERVAL_IN_SECONDS))
+    )
+    for suggest_index in (film_suggest, person_suggest):
+        # Индекс подсказок загружается в фоне: пока он не готов, эндпоинты подсказок отвечают 503
+        background_tasks.append(
+            asyncio.create_task(suggest_index.refresh_forever(elastic.es, config.SUGGEST_REFRESH_INTERVAL_IN_SECONDS))
+        )
+    if config.FILM_RANKING_ENABLED:
+        background_tasks.append(
+            asyncio.create_task(
+                film_rankings.refresh_forever(redis.redis, elastic.es, config.FILM_RANKING_REFRESH_INTERVAL_IN_SECONDS)
+            )
+        )
+    if config.CACHE_INVALIDATION_ENABLED:
+        cache_invalidator.on_change(genre_catalog.index, lambda ids: genre_catalog.load(elastic.es))
+        cache_invalidator.on_change(film_suggest.index, partial(film_suggest.update, elastic.es))
+        cache_invalidator.on_change(person_suggest.index, partial(person_suggest.update, elastic.es))
+        if config.FILM_RANKING_ENABLED:
+            cache_invalidator.on_change(film_rankings.index, partial(film_rankings.update, redis.redis, elastic.es))
+        background_tasks.append(asyncio.create_task(cache_invalidator.listen_forever(redis.redis)))
+    if config.WARMUP_ON_STARTUP:
+        # Прогрев идёт в фоне: воркер начинает принимать запросы, не дожидаясь его окончания
+        background_tasks.append(asyncio.create_task(warm_up_on_startup(redis.redis, elastic.es)))
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await redis.redis.close()
+    for task in background_tasks:
+        task.cancel()
+    try:
+        await popular_queries.flush(redis.redis)
+    except Exception as err:
+        logger.warning("Не удалось сохранить статистику поисковых запросов: %s", err)
+    redis.redis.close()
+    await redis.redis.wait_closed()
     await elastic.es.close()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+@app.exception_handler(ElasticUnavailableError)
+async def elastic_unavailable_handler(request: Request, exc: ElasticUnavailableError) -> Response:
+    # Эластик недоступен, а подходящей записи в кеше нет: клиенту стоит повторить запрос позже
+    return ORJSONResponse(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        content={"detail": ELASTIC_UNAVAILABLE},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    export_local_cache_stats()
+    # В режиме нескольких воркеров метрики собираются из файлов всех процессов
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+# Middleware, добавленное последним, оказывается снаружи: метрики учитывают и ответы из кеша
+app.add_middleware(
+    ResponseCacheMiddleware,
+    routes=config.RESPONSE_CACHE_ROUTES,
+    enabled=config.RESPONSE_CACHE_ENABLED,
+    compression=config.RESPONSE_COMPRESSION_ENABLED,
+)
+app.add_middleware(MetricsMiddleware, routes=app.router.routes)
 
 app.include_router(film.router, prefix="/api/v1/film", tags=["film"])
 app.include_router(genre.router, prefix="/api/v1/genre", tags=["genre"])
 app.include_router(person.router, prefix="/api/v1/person", tags=["person"])
 
-if __name__ == "__main__":
+
+def run_production() -> None:
+    """Запуск нескольких воркеров на uvloop/httptools.
+
+    Каждый воркер держит собственные пулы Redis и Elasticsearch, поэтому
+    итоговое число соединений - это размер пула, умноженный на SERVER_WORKERS.
+    """
+    if config.SERVER_WORKERS > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        # Переменная должна быть задана до запуска воркеров: они импортируют prometheus_client заново
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus_")
     uvicorn.run(
         "main:app",
         host=config.SERVER_HOST,
         port=config.SERVER_PORT,
+        workers=config.SERVER_WORKERS,
+        loop="uvloop",
+        http="httptools",
+        backlog=config.SERVER_BACKLOG,
+        timeout_keep_alive=config.SERVER_KEEP_ALIVE_TIMEOUT_IN_SECONDS,
+        access_log=config.SERVER_ACCESS_LOG,
         log_config=LOGGING,
-        log_level=logging.DEBUG,
+        log_level=logging.INFO,
     )
+
+
+if __name__ == "__main__":
+    if config.SERVER_MODE == "production":
+        run_production()
+    else:
+        uvicorn.run(
+            "main:app",
+            host=config.SERVER_HOST,
+            port=config.SERVER_PORT,
+            log_config=LOGGING,
+            log_level=logging.DEBUG,
+        )
@@ -0,0 +1,14 @@
+from typing import List
+
+from pydantic import Field
+
+from core.config import BATCH_MAX_SIZE
+from models.base_orjson_model import BaseOrjsonModel
+
+
+class BatchRequest(BaseOrjsonModel):
+    """
+    Тело batch-запроса: список id документов
+    """
+
+    ids: List[str] = Field(..., min_items=1, max_items=BATCH_MAX_SIZE)
@@ -1,6 +1,6 @@
-from typing import Optional
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from models.base_orjson_model import BaseOrjsonModel
 
@@ -29,3 +29,28 @@ class FilmDetailResponse(BaseOrjsonModel):
     director: Optional[str]
     actors: Optional[list[FilmPersonResponse]]
     writers: Optional[list[FilmPersonResponse]]
+
+
+class GenreFacet(BaseModel):
+    name: str
+    count: int
+
+
+class RatingFacet(BaseModel):
+    from_: Optional[float] = Field(None, alias="from")
+    to: Optional[float]
+    count: int
+
+
+class FilmFacets(BaseModel):
+    genre: List[GenreFacet]
+    imdb_rating: List[RatingFacet]
+
+
+class FilmSearchFacetsResponse(BaseOrjsonModel):
+    """
+    Модель респонса выдачи фильмов вместе с фасетами (/film/search/facets и /film/facets)
+    """
+
+    result: List[ShortFilmResponse]
+    facets: FilmFacets
@@ -1,6 +1,7 @@
 from typing import Dict, List, Optional
 
 from models.base_orjson_model import BaseOrjsonModel
+from models.film_response import FilmPersonResponse
 
 
 class PersonFilmResponse(BaseOrjsonModel):
@@ -9,7 +10,34 @@ class PersonFilmResponse(BaseOrjsonModel):
     imdb_rating: Optional[float]
 
 
+class PersonFilmDetailResponse(PersonFilmResponse):
+    """
+    Модель респонса фильма персоны с данными из индекса фильмов (expand[films]=true)
+    """
+
+    role: str
+    description: Optional[str]
+    genre: Optional[list]
+    director: Optional[str]
+    actors: Optional[List[FilmPersonResponse]]
+    writers: Optional[List[FilmPersonResponse]]
+
+
+class PersonSuggestResponse(BaseOrjsonModel):
+    uuid: str
+    full_name: str
+    films_count: int
+
+
 class PersonResponse(BaseOrjsonModel):
     uuid: str
     full_name: str
     films: List[Dict]
+
+
+class PersonExpandedResponse(PersonResponse):
+    """
+    Модель респонса персоны вместе с данными её фильмов (expand[films]=true)
+    """
+
+    film_details: List[PersonFilmDetailResponse]
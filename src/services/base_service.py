@@ -1,64 +1,690 @@
-import json
+import asyncio
 import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+from functools import partial
 from http import HTTPStatus
-from typing import List, Optional, Union
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
 
 from aioredis import Redis
 from elasticsearch import AsyncElasticsearch, NotFoundError
 from fastapi import HTTPException
 from pydantic import BaseModel
 
-from core.config import CACHE_EXPIRE_IN_SECONDS
+from core.config import (
+    CACHE_EXPIRE_IN_SECONDS,
+    CACHE_INVALIDATION_ENABLED,
+    CACHE_KEY_PREFIX,
+    CACHE_LOCK_ENABLED,
+    CACHE_LOCK_EXPIRE_IN_MS,
+    CACHE_LOCK_POLL_INTERVAL_IN_MS,
+    CACHE_STALE_IF_ERROR_IN_SECONDS,
+    CURSOR_PIT_KEEP_ALIVE,
+    DEFAULT_PAGE_SIZE,
+    ELASTIC_GET_TIMEOUT_IN_SECONDS,
+    ELASTIC_LIMITER_ENABLED,
+    ELASTIC_SEARCH_TIMEOUT_IN_SECONDS,
+    EXPORT_BATCH_SIZE,
+    EXPORT_PIT_KEEP_ALIVE,
+    LOCAL_CACHE_EXPIRE_IN_SECONDS,
+    LOCAL_CACHE_MAX_BYTES,
+    LOCAL_CACHE_MAX_ENTRIES,
+    NEGATIVE_CACHE_EXPIRE_IN_SECONDS,
+)
+from core.metrics import CACHE_REQUESTS, ELASTIC_LATENCY, ELASTIC_TOOK, REDIS_LATENCY, SERIALIZATION_LATENCY
 
-from .utils import flatten_json
+from .cache_codec import CacheDecodeError, decode_cache_data, encode_cache_data
+from .cache_entry import CacheEntry, SearchPage
+from .circuit_breaker import CircuitOpenError, ElasticUnavailableError, elastic_breakers
+from .concurrency_limiter import GET, SEARCH, LimiterRejectedError, elastic_limiters
+from .invalidation import add_to_reverse_index, cache_invalidator
+from .local_cache import LocalCache
+from .popular_queries import PopularQueries, popular_queries
+from .single_flight import SingleFlight
+from .utils import hash_body
 
 logger = logging.getLogger(__name__)
 
+# Снимает блокировку, только если она всё ещё принадлежит нам
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Вызовы эластика, ограничиваемые отдельно от поиска как дешёвые чтения по id
+ELASTIC_GET_OPERATIONS = {"get", "mget"}
+# Части тела поискового запроса, от которых не зависят агрегации
+PAGING_KEYS = {"from", "size", "search_after", "sort", "_source", "pit"}
+
 
 class BaseService:
-    def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
+    def __init__(self, redis: Redis, elastic: AsyncElasticsearch, popular: PopularQueries = popular_queries):
         self.redis = redis
         self.elastic = elastic
         self.index = None
         self.model = None
+        self.schema_version = 1
+        self.cache_soft_ttl = CACHE_EXPIRE_IN_SECONDS
+        self.cache_hard_ttl = CACHE_EXPIRE_IN_SECONDS
+        self.local_cache = LocalCache(
+            max_entries=LOCAL_CACHE_MAX_ENTRIES,
+            max_bytes=LOCAL_CACHE_MAX_BYTES,
+            ttl=LOCAL_CACHE_EXPIRE_IN_SECONDS,
+            name=type(self).__name__,
+        )
+        self.single_flight = SingleFlight()
+        self.popular_queries = popular
+        cache_invalidator.track(self.local_cache)
 
-    async def get_by_id(self, id_: str, index: str = None) -> Optional[BaseModel]:
+    async def get_by_id(self, id_: str, index: str = None, fields: Optional[List[str]] = None) -> Optional[BaseModel]:
         """
-        Возвращает объект по id из указанного индекса. Сначала ищет объект в кеше,
-        при отсутствии: берёт из базы, кладёт в кеш, возвращает найденный объект.
+        Возвращает объект по id из указанного индекса. Сначала ищет объект в локальном кеше воркера,
+        затем в redis, при отсутствии: берёт из базы, кладёт в кеш, возвращает найденный объект.
 
         :param id_:
         :param index:
+        :param fields: забрать из эластика только эти поля документа (_source includes)
         :return:
         """
-        key = await self._generate_redis_key(self.index, id_)
-        obj = await self._get_from_cache_by_id(key)
-        if not obj:
-            index = index if index else self.index
-            obj = await self._get_by_id_from_elastic(id_, index)
-            if not obj:
-                return None
-            await self._put_obj_to_cache(obj, key=key)
-        return obj
+        index = index if index else self.index
+        key = self._generate_redis_key(index, id_, fields)
+        return await self._get_or_load(
+            key,
+            index,
+            fetch=partial(self._get_by_id_from_elastic, id_, index, fields),
+            read_cache=self._get_from_cache_by_id,
+        )
 
     async def search(self, body: dict) -> Optional[List[BaseModel]]:
         """
-        Выполняет поиск данных по запросу (body) и индексу. Сначала проверяет наличие данных в кеше.
+        Выполняет поиск данных по запросу (body) и индексу. Сначала проверяет наличие данных
+        в локальном кеше воркера, затем в redis.
         Если данных в кеше нет - обращается к эластику и кеширует положительный результат.
 
         :param body:
         :return:
         """
-        key = await self._generate_redis_key(self.index, body)
-        docs = await self._get_from_cache_by_body_key(key)
+        key = self._generate_redis_key(self.index, body)
+        docs = await self._get_or_load(
+            key,
+            self.index,
+            fetch=partial(self._search_in_elastic, body=body),
+            read_cache=self._get_from_cache_by_body_key,
+        )
         if not docs:
-            docs = await self._search_in_elastic(body=body)
-            if not docs:
-                return None
-            await self._put_obj_to_cache(docs, key=key)
+            return None
 
         return docs
 
+    async def search_page(self, body: dict) -> SearchPage:
+        """
+        Поиск с курсорной пагинацией. Возвращает документы вместе с курсором на следующую страницу.
+        Запросы внутри point-in-time не кешируются: у каждого клиента свой pit.
+        Остальные запросы учитываются в статистике для прогрева кеша.
+
+        :param body:
+        :return:
+        """
+        if "pit" in body:
+            return await self._search_page_in_elastic(body)
+
+        key = self._generate_redis_key(self.index, body)
+        self.popular_queries.record(self.index, key, body)
+        page = await self._get_or_load(
+            key,
+            self.index,
+            fetch=partial(self._search_page_in_elastic, body),
+            read_cache=self._get_from_cache_by_body_key,
+        )
+        return page if page is not None else SearchPage(docs=[])
+
+    async def search_page_with_aggs(self, body: dict, aggs: dict) -> SearchPage:
+        """
+        Поиск с курсорной пагинацией вместе с агрегациями (фасетами) по запросу.
+        Агрегации не зависят от страницы, поэтому кешируются отдельно от неё - по телу запроса без пагинации
+        и сортировки: остальные страницы того же запроса берут их из кеша, а сами страницы ищутся как в search_page.
+        Если агрегаций в кеше нет, они считаются в одном запросе к эластику со страницей, и страница кешируется
+        под тем же ключом, что и без агрегаций. Агрегации не сбрасываются по событиям изменения документов,
+        только по TTL.
+
+        :param body:
+        :param aggs: агрегации эластика
+        :return: страница с заполненным aggregations
+        """
+        if "pit" in body:
+            return await self._search_page_in_elastic({**body, "aggs": aggs})
+
+        aggs_body = {key: value for key, value in body.items() if key not in PAGING_KEYS}
+        aggs_body.update(aggs=aggs, size=0)
+        aggs_key = self._generate_redis_key(self.index, aggs_body)
+
+        entry = self.local_cache.get(aggs_key)
+        self._record_cache(self.index, "local", entry)
+        if entry is None:
+            entry = await self._get_from_cache_by_body_key(aggs_key)
+            self._record_cache(self.index, "redis", entry)
+        if entry is not None and entry.obj and not entry.is_expired:
+            if entry.is_stale:
+                self._refresh_in_background(aggs_key, partial(self._search_page_in_elastic, aggs_body))
+            page = await self.search_page(body)
+            return page._replace(aggregations=entry.obj.aggregations)
+
+        page_key = self._generate_redis_key(self.index, body)
+        self.popular_queries.record(self.index, page_key, body)
+        load = partial(self._search_page_and_aggs, body, aggs, page_key, aggs_key)
+        return await self.single_flight.do(aggs_key + ":" + page_key, load)
+
+    async def _search_page_and_aggs(self, body: dict, aggs: dict, page_key: str, aggs_key: str) -> SearchPage:
+        page = await self._search_page_in_elastic({**body, "aggs": aggs})
+        await self._put_many_to_cache(
+            {
+                page_key: page._replace(aggregations=None),
+                aggs_key: SearchPage(docs=[], aggregations=page.aggregations),
+            }
+        )
+        return page
+
+    async def search_many(self, bodies: List[dict]) -> List[SearchPage]:
+        """
+        Выполняет пачку поисковых запросов с курсорной пагинацией, результаты в порядке bodies.
+        Один MGET в redis -> один msearch в эластик только по незакешированным запросам ->
+        запись результатов в redis одним пайплайном. Запрос, на котором эластик вернул ошибку, даёт пустую страницу.
+
+        :param bodies:
+        :return:
+        """
+        if not bodies:
+            return []
+        keys = [self._generate_redis_key(self.index, body) for body in bodies]
+        unique = dict(zip(keys, bodies))
+
+        entries = await self._get_many_from_redis({key: key for key in unique}, self.index)
+        pages = {key: entry.obj for key, entry in entries.items() if not entry.is_expired}
+        expired = {key: entry.obj for key, entry in entries.items() if entry.is_expired}
+
+        missing = [key for key in unique if key not in pages]
+        if missing:
+            load = partial(self._msearch_and_put, {key: unique[key] for key in missing})
+            pages.update(await self._load_or_stale(self.index, missing, load, expired))
+
+        return [pages.get(key) or SearchPage(docs=[]) for key in keys]
+
+    async def _msearch_and_put(self, bodies: Dict[str, dict]) -> Dict[str, SearchPage]:
+        """
+        Выполняет запросы одним msearch и кладёт страницы в redis одним пайплайном.
+        Запросы, на которых эластик вернул ошибку, не кешируются.
+
+        :param bodies: тела запросов по ключам кеша
+        :return: страницы по ключам кеша
+        """
+        loaded = await self._msearch_in_elastic(list(bodies.values()))
+        pages = {key: page for key, page in zip(bodies, loaded) if page is not None}
+        await self._put_many_to_cache(pages)
+        return pages
+
+    async def open_point_in_time(self, keep_alive: str = CURSOR_PIT_KEEP_ALIVE) -> str:
+        """
+        Открывает point-in-time в индексе сервиса для стабильного обхода страниц курсором.
+
+        :param keep_alive:
+        :return: id point-in-time
+        """
+        response = await self._call_elastic(
+            "open_point_in_time",
+            self.index,
+            partial(self.elastic.open_point_in_time, index=self.index, keep_alive=keep_alive),
+            ELASTIC_SEARCH_TIMEOUT_IN_SECONDS,
+        )
+        return response["id"]
+
+    async def export(self, fields: Optional[List[str]] = None) -> AsyncIterator[List[BaseModel]]:
+        """
+        Обходит весь индекс сервиса внутри point-in-time курсором search_after, по EXPORT_BATCH_SIZE документов.
+        Следующая страница запрашивается, только когда потребитель забрал предыдущую, поэтому в памяти
+        всегда не больше одной страницы. Кеш не используется: выгрузка читает каждый документ один раз.
+
+        :param fields: забрать из эластика только эти поля документов (_source includes)
+        :return: страницы документов, провалидированных моделью
+        """
+        async with self.point_in_time(EXPORT_PIT_KEEP_ALIVE) as pit:
+            search_after = None
+            while True:
+                hits = await self._export_hits(pit, fields, search_after)
+                if hits:
+                    # Проекция может не содержать обязательных полей модели: такие документы не валидируются
+                    build = self.model.construct if fields else self.model
+                    with SERIALIZATION_LATENCY.labels("validate", self.index).time():
+                        yield [build(**hit["_source"]) for hit in hits]
+                if len(hits) < EXPORT_BATCH_SIZE:
+                    return
+                search_after = hits[-1]["sort"]
+
+    async def _export_hits(self, pit: dict, fields: Optional[List[str]], search_after: Optional[list]) -> List[dict]:
+        """
+        Страница выгрузки внутри point-in-time.
+
+        :param pit: параметр pit тела запроса из point_in_time, id обновляется по ответу эластика
+        :param fields:
+        :param search_after: значения сортировки последнего документа предыдущей страницы
+        :return: документы страницы
+        """
+        body = {"query": {"match_all": {}}, "size": EXPORT_BATCH_SIZE, "sort": [{"id": "asc"}], "pit": pit}
+        if fields:
+            body["_source"] = {"includes": fields}
+        if search_after:
+            body["search_after"] = search_after
+        response = await self._call_elastic(
+            "search",
+            self.index,
+            partial(self.elastic.search, body=body),
+            ELASTIC_SEARCH_TIMEOUT_IN_SECONDS,
+        )
+        pit["id"] = response.get("pit_id", pit["id"])
+        return response["hits"]["hits"]
+
+    @asynccontextmanager
+    async def point_in_time(self, keep_alive: str = CURSOR_PIT_KEEP_ALIVE) -> AsyncIterator[dict]:
+        """
+        Открывает point-in-time в индексе сервиса и закрывает его на выходе из блока,
+        в том числе по ошибке и когда потребитель выгрузки бросил её на середине.
+
+        :param keep_alive:
+        :return: параметр pit тела запроса; закрывается id, записанный в него последним
+        """
+        pit = {"id": await self.open_point_in_time(keep_alive), "keep_alive": keep_alive}
+        try:
+            yield pit
+        finally:
+            await self._close_point_in_time(pit["id"])
+
+    async def _close_point_in_time(self, pit_id: str) -> None:
+        # Незакрытый point-in-time держит ресурсы эластика до истечения keep-alive, но ошибка закрытия не критична
+        try:
+            await self.elastic.close_point_in_time(body={"id": pit_id})
+        except Exception as err:
+            logger.warning("Не удалось закрыть point-in-time в индексе %s: %s", self.index, err)
+
+    async def get_many(self, ids: List[str], index: str = None, fields: Optional[List[str]] = None) -> List[BaseModel]:
+        """
+        Возвращает объекты по списку id в порядке ids, ненайденные пропускаются.
+        Локальный кеш -> один MGET в redis -> один mget в эластик только по недостающим id ->
+        запись новых объектов в redis одним пайплайном.
+        Записи старше hard TTL перезагружаются и отдаются, только если эластик недоступен.
+
+        :param ids:
+        :param index:
+        :param fields: забрать из эластика только эти поля документов (_source includes)
+        :return:
+        """
+        index = index if index else self.index
+        ids = list(dict.fromkeys(ids))
+        keys = {id_: self._generate_redis_key(index, id_, fields) for id_ in ids}
+
+        entries = self._get_many_from_local_cache(keys, index)
+        entries.update(await self._get_many_from_redis({id_: keys[id_] for id_ in ids if id_ not in entries}, index))
+
+        found: Dict[str, Optional[BaseModel]] = {}
+        expired: Dict[str, Optional[BaseModel]] = {}
+        stale: List[str] = []
+        for id_, entry in entries.items():
+            if entry.is_expired:
+                expired[id_] = entry.obj
+                continue
+            if entry.is_stale:
+                stale.append(id_)
+            found[id_] = entry.obj
+        if stale:
+            self._refresh_many_in_background(stale, keys, index, fields)
+
+        missing = [id_ for id_ in ids if id_ not in found]
+        if missing:
+            load = partial(self._mget_and_put, missing, keys, index, fields)
+            found.update(await self._load_or_stale(index, missing, load, expired))
+
+        return [found[id_] for id_ in ids if found.get(id_) is not None]
+
+    def _get_many_from_local_cache(self, keys: Dict[str, str], index: str) -> Dict[str, CacheEntry]:
+        """
+        Записи локального кеша воркера.
+
+        :param keys: ключи кеша по id
+        :param index: индекс эластика, для метрик
+        :return: найденные записи по id
+        """
+        entries: Dict[str, CacheEntry] = {}
+        for id_, key in keys.items():
+            entry = self.local_cache.get(key)
+            self._record_cache(index, "local", entry)
+            if entry is not None:
+                entries[id_] = entry
+        return entries
+
+    async def _get_many_from_redis(self, keys: Dict[Any, str], index: str) -> Dict[Any, CacheEntry]:
+        """
+        Записи redis одним MGET.
+
+        :param keys: ключи кеша по id (или другому идентификатору записи)
+        :param index: индекс эластика, для метрик
+        :return: найденные записи по id
+        """
+        if not keys:
+            return {}
+        with REDIS_LATENCY.labels("mget").time():
+            cached = await self.redis.mget(*keys.values())
+        entries: Dict[Any, CacheEntry] = {}
+        for (id_, key), data in zip(keys.items(), cached):
+            entry = self._parse_cached_obj(key, data, index) if data else None
+            self._record_cache(index, "redis", entry)
+            if entry is not None:
+                entries[id_] = entry
+        return entries
+
+    async def _mget_and_put(
+        self,
+        ids: List[str],
+        keys: Dict[str, str],
+        index: str,
+        fields: Optional[List[str]],
+    ) -> Dict[str, Optional[BaseModel]]:
+        """
+        Загружает объекты одним mget и кладёт их в redis одним пайплайном, ненайденные id кешируются как отсутствующие.
+
+        :param ids:
+        :param keys: ключи кеша по id
+        :param index:
+        :param fields:
+        :return: объекты по id, None - документ не найден
+        """
+        loaded = await self._mget_from_elastic(ids, index, fields)
+        loaded = {id_: loaded.get(id_) for id_ in ids}
+        await self._put_many_to_cache({keys[id_]: obj for id_, obj in loaded.items()})
+        return loaded
+
+    async def _load_or_stale(
+        self,
+        index: str,
+        missing: List[str],
+        load: Callable[[], Awaitable[Dict[str, Any]]],
+        expired: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """
+        Пачечная загрузка недостающих записей (get_many, search_many). Если эластик недоступен,
+        а записи старше hard TTL есть по всем недостающим, отдаются они - иначе ошибка пробрасывается.
+
+        :param index: индекс эластика, для метрик
+        :param missing: недостающие id или ключи кеша
+        :param load: загрузка недостающих записей из эластика
+        :param expired: записи старше hard TTL по id или ключам кеша
+        :return: записи по id или ключам кеша
+        """
+        try:
+            return await load()
+        except ElasticUnavailableError:
+            if len(expired) < len(missing):
+                raise
+            self._record_stale_fallback(index, len(expired))
+            return expired
+
+    async def _get_or_load(
+        self,
+        key: str,
+        index: str,
+        fetch: Callable[[], Awaitable[Any]],
+        read_cache: Callable[[str], Awaitable[Optional[CacheEntry]]],
+    ) -> Any:
+        """
+        Общий путь чтения: локальный кеш -> redis -> эластик.
+        Если запись старше soft TTL, она всё равно отдаётся сразу, а обновление из эластика
+        запускается в фоне. Блокирующая загрузка происходит, только когда записи нет или она старше hard TTL.
+        Запись старше hard TTL ещё CACHE_STALE_IF_ERROR_IN_SECONDS хранится в redis и отдаётся,
+        если эластик недоступен (таймаут, ошибка соединения, разомкнутый предохранитель).
+
+        :param key:
+        :param index: индекс эластика, для метрик
+        :param fetch: загрузка данных из эластика
+        :param read_cache: чтение данных из redis по ключу
+        :return:
+        """
+        entry = self.local_cache.get(key)
+        self._record_cache(index, "local", entry)
+        if entry is None:
+            entry = await read_cache(key)
+            self._record_cache(index, "redis", entry)
+        if entry is None:
+            return await self._load_on_miss(key, fetch, read_cache)
+
+        if entry.is_expired:
+            try:
+                return await self._load_on_miss(key, fetch, read_cache)
+            except ElasticUnavailableError:
+                self._record_stale_fallback(index)
+                return entry.obj
+
+        if entry.is_stale:
+            self._refresh_in_background(key, fetch)
+        return entry.obj
+
+    async def _load_on_miss(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[Any]],
+        read_cache: Callable[[str], Awaitable[Optional[CacheEntry]]],
+    ) -> Any:
+        """
+        Загружает данные при промахе кеша. Одновременные промахи по одному ключу внутри воркера
+        склеиваются: в эластик идёт одна корутина, остальные ждут её результат.
+        При включённом CACHE_LOCK_ENABLED то же самое обеспечивается и между воркерами через блокировку в redis.
+
+        :param key: ключ в redis
+        :param fetch: загрузка данных из эластика
+        :param read_cache: чтение данных из redis по ключу
+        :return:
+        """
+        if CACHE_LOCK_ENABLED:
+            load = partial(self._fetch_under_lock, key, fetch, read_cache)
+        else:
+            load = partial(self._fetch_and_put, key, fetch)
+        return await self.single_flight.do(key, load)
+
+    def _refresh_in_background(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Запускает фоновое обновление устаревшей записи. На ключ в воркере работает не больше одной задачи,
+        при включённом CACHE_LOCK_ENABLED - не больше одной на все воркеры.
+        Обновление склеивается под своим ключом, а не под ключом загрузки при промахе: иначе промах
+        присоединился бы к обновлению, которое при занятой блокировке ничего не загружает.
+
+        :param key:
+        :param fetch:
+        :return:
+        """
+        self._start_refresh(key, partial(self._fetch_and_put, key, fetch))
+
+    def _refresh_many_in_background(
+        self,
+        ids: List[str],
+        keys: Dict[str, str],
+        index: str,
+        fields: Optional[List[str]],
+    ) -> None:
+        """
+        Запускает фоновое обновление устаревших записей пачки get_many одним mget.
+        Обновление склеивается и блокируется по ключу пачки: её повторный запрос не запускает второй mget.
+
+        :param ids: id устаревших записей
+        :param keys: ключи кеша по id
+        :param index:
+        :param fields:
+        :return:
+        """
+        batch_key = self._generate_redis_key(index, {"ids": sorted(ids), "fields": fields})
+        self._start_refresh(batch_key, partial(self._mget_and_put, ids, keys, index, fields))
+
+    def _start_refresh(self, key: str, refresh: Callable[[], Awaitable[Any]]) -> None:
+        refresh_key = f"{key}:refresh"
+        if self.single_flight.in_flight(refresh_key):
+            return
+
+        task = asyncio.ensure_future(self.single_flight.do(refresh_key, partial(self._refresh, key, refresh)))
+        task.add_done_callback(self._log_refresh_error)
+
+    async def _refresh(self, key: str, refresh: Callable[[], Awaitable[Any]]) -> None:
+        if not CACHE_LOCK_ENABLED:
+            await refresh()
+            return
+
+        # Блокировку держит другой воркер: запись обновит он
+        lock_key, token = await self._acquire_lock(key)
+        if not token:
+            return
+        try:
+            await refresh()
+        finally:
+            await self._release_lock(lock_key, token)
+
+    def _record_cache(self, index: str, tier: str, entry: Optional[CacheEntry]) -> None:
+        """
+        Учитывает обращение к уровню кеша в метриках.
+
+        :param index:
+        :param tier: local или redis
+        :param entry: найденная запись или None при промахе
+        :return:
+        """
+        if entry is None:
+            result = "miss"
+        elif not entry.obj:
+            result = "negative_hit"
+        else:
+            result = "hit"
+        CACHE_REQUESTS.labels(type(self).__name__, index, tier, result).inc()
+
+    def _record_stale_fallback(self, index: str, count: int = 1) -> None:
+        """
+        Учитывает в метриках записи старше hard TTL, отданные из-за недоступности эластика.
+
+        :param index:
+        :param count:
+        :return:
+        """
+        CACHE_REQUESTS.labels(type(self).__name__, index, "stale", "hit").inc(count)
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Future) -> None:
+        if task.cancelled() or not task.exception():
+            return
+        if isinstance(task.exception(), ElasticUnavailableError):
+            # Уже залогировано в _call_elastic, устаревшая запись остаётся в кеше
+            logger.debug("Фоновое обновление кеша отложено: %s", task.exception())
+            return
+        logger.warning("Ошибка фонового обновления кеша", exc_info=task.exception())
+
+    async def _fetch_and_put(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Забирает данные из эластика и кладёт результат в кеш.
+        Отсутствующий документ и пустая выдача тоже кешируются, но на NEGATIVE_CACHE_EXPIRE_IN_SECONDS.
+
+        :param key:
+        :param fetch:
+        :return:
+        """
+        obj = await fetch()
+        await self._put_obj_to_cache(obj, key=key)
+        return obj
+
+    async def _fetch_under_lock(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[Any]],
+        read_cache: Callable[[str], Awaitable[Optional[CacheEntry]]],
+    ) -> Any:
+        """
+        Короткая блокировка в redis на время загрузки. Воркер, не получивший блокировку,
+        ждёт, пока владелец заполнит кеш. Если за время жизни блокировки данные не появились -
+        идёт в эластик сам.
+
+        :param key:
+        :param fetch:
+        :param read_cache:
+        :return:
+        """
+        lock_key, token = await self._acquire_lock(key)
+        if token:
+            try:
+                return await self._fetch_and_put(key, fetch)
+            finally:
+                await self._release_lock(lock_key, token)
+
+        waited = 0
+        while waited < CACHE_LOCK_EXPIRE_IN_MS:
+            await asyncio.sleep(CACHE_LOCK_POLL_INTERVAL_IN_MS / 1000)
+            waited += CACHE_LOCK_POLL_INTERVAL_IN_MS
+            entry = await read_cache(key)
+            if entry and not entry.is_expired:
+                return entry.obj
+            with REDIS_LATENCY.labels("exists").time():
+                lock_exists = await self.redis.exists(lock_key)
+            if not lock_exists:
+                break
+
+        return await self._fetch_and_put(key, fetch)
+
+    async def _acquire_lock(self, key: str) -> Tuple[str, Optional[str]]:
+        """
+        Пытается взять блокировку на ключ.
+
+        :param key:
+        :return: ключ блокировки и токен владельца (None, если блокировка занята)
+        """
+        lock_key = f"lock::{key}"
+        token = uuid.uuid4().hex
+        with REDIS_LATENCY.labels("set").time():
+            acquired = await self.redis.set(lock_key, token, pexpire=CACHE_LOCK_EXPIRE_IN_MS, exist=Redis.SET_IF_NOT_EXIST)
+        return lock_key, token if acquired else None
+
+    async def _release_lock(self, lock_key: str, token: str) -> None:
+        with REDIS_LATENCY.labels("eval").time():
+            await self.redis.eval(RELEASE_LOCK_SCRIPT, keys=[lock_key], args=[token])
+
+    async def _call_elastic(
+        self,
+        operation: str,
+        index: str,
+        call: Callable[[], Awaitable[Any]],
+        timeout: float,
+    ) -> Any:
+        """
+        Вызывает эластик через ограничитель одновременных вызовов и предохранитель индекса с таймаутом.
+        Недоступность эластика (таймаут, ошибка соединения, 429/5xx, разомкнутый предохранитель)
+        и отказ ограничителя превращаются в ElasticUnavailableError, остальные ошибки пробрасываются как есть.
+
+        :param operation: название вызова, для метрик
+        :param index:
+        :param call: фабрика корутины вызова клиента эластика
+        :param timeout:
+        :return: ответ эластика
+        """
+        breaker = elastic_breakers.get(index)
+
+        async def timed_call() -> Any:
+            with ELASTIC_LATENCY.labels(operation, index).time():
+                return await call()
+
+        try:
+            if ELASTIC_LIMITER_ENABLED:
+                limiter = elastic_limiters.get(index, GET if operation in ELASTIC_GET_OPERATIONS else SEARCH)
+                return await limiter.call(partial(breaker.call, timed_call, timeout))
+            return await breaker.call(timed_call, timeout)
+        except (CircuitOpenError, LimiterRejectedError) as err:
+            raise ElasticUnavailableError(index, err.retry_after) from err
+        except Exception as err:
+            if not breaker.is_failure(err):
+                raise
+            logger.warning("Эластик недоступен (%s по индексу %s): %r", operation, index, err)
+            raise ElasticUnavailableError(index, max(breaker.retry_after, 1.0)) from err
+
     async def _search_in_elastic(self, body: dict) -> Optional[List[BaseModel]]:
         """
         Выполяет поиск в индексе эластика index по запросу body.
@@ -67,31 +693,146 @@ class BaseService:
         :param body:
         :return:
         """
-        docs = await self.elastic.search(index=self.index, body=body)
-        docs = docs.get("hits", {})
-        docs = docs.get("hits", [])
-        docs = [self.model(**data["_source"]) for data in docs]
-        return docs
+        page = await self._search_page_in_elastic(body)
+        return page.docs
 
-    async def _get_by_id_from_elastic(self, id_: str, index: str = None) -> Optional[BaseModel]:
+    async def _search_page_in_elastic(self, body: dict) -> SearchPage:
+        """
+        Выполяет поиск в эластике и возвращает страницу с курсором на следующую.
+        Запрос с point-in-time выполняется без указания индекса - так требует эластик.
+
+        :param body:
+        :return:
+        """
+        if "pit" in body:
+            search = partial(self.elastic.search, body=body)
+        else:
+            search = partial(self.elastic.search, index=self.index, body=body)
+        response = await self._call_elastic("search", self.index, search, ELASTIC_SEARCH_TIMEOUT_IN_SECONDS)
+        ELASTIC_TOOK.labels("search", self.index).observe(response.get("took", 0) / 1000)
+        return self._parse_search_response(body, response)
+
+    async def _msearch_in_elastic(self, bodies: List[dict]) -> List[Optional[SearchPage]]:
+        """
+        Выполняет пачку поисковых запросов одним msearch.
+
+        :param bodies:
+        :return: страницы в порядке bodies, None для запросов, завершившихся ошибкой
+        """
+        request = []
+        for body in bodies:
+            request.extend([{"index": self.index}, body])
+        try:
+            response = await self._call_elastic(
+                "msearch",
+                self.index,
+                partial(self.elastic.msearch, body=request),
+                ELASTIC_SEARCH_TIMEOUT_IN_SECONDS,
+            )
+        except ElasticUnavailableError:
+            raise
+        except Exception as err:
+            logger.warning(err, exc_info=True)
+            raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=str(err))
+
+        pages = []
+        for body, item in zip(bodies, response["responses"]):
+            if "error" in item:
+                logger.warning("Ошибка запроса в msearch по индексу %s: %s", self.index, item["error"])
+                pages.append(None)
+                continue
+            ELASTIC_TOOK.labels("msearch", self.index).observe(item.get("took", 0) / 1000)
+            pages.append(self._parse_search_response(body, item))
+        return pages
+
+    def _parse_search_response(self, body: dict, response: dict) -> SearchPage:
+        """
+        Валидирует найденные документы моделью и вычисляет курсор на следующую страницу.
+
+        :param body:
+        :param response:
+        :return:
+        """
+        hits = response.get("hits", {}).get("hits", [])
+        with SERIALIZATION_LATENCY.labels("validate", self.index).time():
+            docs = [self.model(**data["_source"]) for data in hits]
+
+        next_search_after = None
+        if hits and "sort" in hits[-1] and len(hits) >= int(body.get("size", DEFAULT_PAGE_SIZE)):
+            next_search_after = hits[-1]["sort"]
+        return SearchPage(
+            docs=docs,
+            next_search_after=next_search_after,
+            pit_id=response.get("pit_id"),
+            aggregations=response.get("aggregations"),
+        )
+
+    async def _get_by_id_from_elastic(
+        self,
+        id_: str,
+        index: str = None,
+        fields: Optional[List[str]] = None,
+    ) -> Optional[BaseModel]:
         """
         Забирает данные из эластика по id. Результат валидируется моделью.
 
         :param id_:
+        :param index:
+        :param fields:
         :return:
         """
         try:
             index = index if index else self.index
-            doc = await self.elastic.get(index, id_)
-            return self.model(**doc["_source"])
-        except NotFoundError as err:
-            logger.exception("Ошибка на этапе забора документа из elastic по id")
-            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=err.info)
+            doc = await self._call_elastic(
+                "get",
+                index,
+                partial(self.elastic.get, index, id_, _source_includes=fields),
+                ELASTIC_GET_TIMEOUT_IN_SECONDS,
+            )
+            with SERIALIZATION_LATENCY.labels("validate", index).time():
+                return self.model(**doc["_source"])
+        except NotFoundError:
+            # Ожидаемая ситуация (например, перебор несуществующих id): без трейсбека, результат кешируется
+            logger.debug("Документ %s не найден в индексе %s", id_, index)
+            return None
+        except ElasticUnavailableError:
+            raise
         except Exception as err:
             logger.warning(err, exc_info=True)
             raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=err)
 
-    async def _get_from_cache_by_id(self, key: str) -> Optional[BaseModel]:
+    async def _mget_from_elastic(
+        self,
+        ids: List[str],
+        index: str = None,
+        fields: Optional[List[str]] = None,
+    ) -> Dict[str, BaseModel]:
+        """
+        Забирает из эластика пачку документов одним запросом mget. Результат валидируется моделью.
+
+        :param ids:
+        :param index:
+        :param fields:
+        :return: найденные объекты по id
+        """
+        index = index if index else self.index
+        try:
+            response = await self._call_elastic(
+                "mget",
+                index,
+                partial(self.elastic.mget, body={"ids": ids}, index=index, _source_includes=fields),
+                ELASTIC_GET_TIMEOUT_IN_SECONDS,
+            )
+        except ElasticUnavailableError:
+            raise
+        except Exception as err:
+            logger.warning(err, exc_info=True)
+            raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=str(err))
+
+        with SERIALIZATION_LATENCY.labels("validate", index).time():
+            return {doc["_id"]: self.model(**doc["_source"]) for doc in response["docs"] if doc.get("found")}
+
+    async def _get_from_cache_by_id(self, key: str) -> Optional[CacheEntry]:
         """
         # Пытаемся получить данные о фильме из кеша, используя команду get
         # https://redis.io/commands/get
@@ -100,33 +841,79 @@ class BaseService:
         :param key:
         :return:
         """
-        data = await self.redis.get(key)
+        with REDIS_LATENCY.labels("get").time():
+            data = await self.redis.get(key)
         if not data:
             return None
 
-        obj = self.model.parse_raw(data)
-        return obj
+        return self._parse_cached_obj(key, data)
+
+    def _parse_cached_obj(self, key: str, data: bytes, index: str = None) -> Optional[CacheEntry]:
+        """
+        Валидирует закешированный объект моделью и кладёт его в локальный кеш.
+        Нечитаемая запись считается промахом: её перезапишет загрузка из эластика.
+
+        :param key:
+        :param data:
+        :param index: индекс эластика, для метрик
+        :return:
+        """
+        try:
+            with SERIALIZATION_LATENCY.labels("decode", index if index else self.index).time():
+                obj, soft_expire_at, hard_expire_at = decode_cache_data(data, self.model)
+        except CacheDecodeError as err:
+            logger.warning("Запись кеша %s пропущена: %s", key, err)
+            return None
+        entry = CacheEntry(obj=obj, soft_expire_at=soft_expire_at, hard_expire_at=hard_expire_at)
+        self.local_cache.put(key, entry, size=len(data), tags=self._cache_tags(key, obj))
+        return entry
 
     @staticmethod
-    async def _generate_redis_key(index: str, body: Union[dict, str]) -> str:
+    def _cache_tags(key: str, obj: Optional[Union[BaseModel, List[BaseModel], SearchPage]]) -> Set[str]:
+        """
+        id документов, попавших в запись кеша: по ним запись сбрасывается при изменении документа.
+        Для ключа документа по id в теги попадает и сам id - так сбрасывается и отрицательная запись.
+
+        :param key:
+        :param obj:
+        :return:
+        """
+        if isinstance(obj, SearchPage):
+            docs = obj.docs
+        elif isinstance(obj, list):
+            docs = obj
+        elif obj is not None:
+            docs = [obj]
+        else:
+            docs = []
+        tags = {doc.id for doc in docs if getattr(doc, "id", None)}
+        if ":id:" in key:
+            tags.add(key.split(":id:", 1)[1].split(":f:", 1)[0])
+        return tags
+
+    def _generate_redis_key(self, index: str, body: Union[dict, str], fields: Optional[List[str]] = None) -> str:
         """
         Создаёт ключ для редиса, по которому будут храниться данные.
         Структура ключа:
-        <es_index>::<first_key>::<first_value>::<second_key>::<second_value>
+        <prefix>:<es_index>:v<schema_version>:id:<id>[:f:<hash полей>] - для документа по id
+        <prefix>:<es_index>:v<schema_version>:q:<hash> - для поискового запроса (проекция _source входит в body)
+
+        Смена schema_version сервиса разом инвалидирует все его ключи.
 
         :param index:
-        :param body:
+        :param body: id документа или тело поискового запроса
+        :param fields: проекция документа по id
         :return:
         """
+        namespace = f"{CACHE_KEY_PREFIX}:{index}:v{self.schema_version}"
+        if isinstance(body, str):
+            key = f"{namespace}:id:{body}"
+            if fields:
+                key = f"{key}:f:{hash_body(sorted(fields))}"
+            return key
+        return f"{namespace}:q:{hash_body(body)}"
 
-        body_list = await flatten_json(body)
-        keys_list = [index, *body_list]
-        separate_symbol = "::"
-        key = separate_symbol.join(keys_list)
-
-        return key
-
-    async def _get_from_cache_by_body_key(self, key: str) -> Optional[List[BaseModel]]:
+    async def _get_from_cache_by_body_key(self, key: str) -> Optional[CacheEntry]:
         """
         Забирает данные из кеша по ключу (body).
         Полученные данные вставляет в модель данных
@@ -134,32 +921,84 @@ class BaseService:
         :param body:
         :return:
         """
-        data = await self.redis.get(key)
+        with REDIS_LATENCY.labels("get").time():
+            data = await self.redis.get(key)
         if not data:
             return None
 
-        data = json.loads(data)["result"]
-        obj = [self.model.parse_raw(d) for d in data]
-        return obj
+        return self._parse_cached_obj(key, data)
 
     async def _put_obj_to_cache(
         self,
-        obj: Union[BaseModel, List[BaseModel]],
+        obj: Optional[Union[BaseModel, List[BaseModel], SearchPage]],
         key: str,
     ) -> None:
         """
         Сохраняем данные о фильме, используя команду set
-        Выставляем время жизни кеша — 5 минут
+        Ключ живёт в redis hard TTL, после soft TTL запись считается устаревшей и обновляется в фоне
         https://redis.io/commands/set
         pydantic позволяет сериализовать модель в json
+        Ключ положительной записи добавляется в обратный индекс её документов в том же пайплайне.
 
-        :param obj:
+        :param obj: None или пустая выдача сохраняются как отрицательный результат с коротким TTL
         :return:
         """
 
-        if isinstance(obj, list):
-            data_to_cache = json.dumps({"result": [d.json() for d in obj]})
+        data_to_cache, entry, ttl = self._pack_cache_data(obj)
+        tags = self._cache_tags(key, obj)
+        if CACHE_INVALIDATION_ENABLED and obj:
+            pipe = self.redis.pipeline()
+            pipe.set(key, data_to_cache, expire=ttl)
+            add_to_reverse_index(pipe, key, tags, ttl)
+            with REDIS_LATENCY.labels("pipeline").time():
+                await pipe.execute()
         else:
-            data_to_cache = obj.json()
+            with REDIS_LATENCY.labels("set").time():
+                await self.redis.set(key, data_to_cache, expire=ttl)
+        self.local_cache.put(key, entry, size=len(data_to_cache), tags=tags)
+
+    async def _put_many_to_cache(self, objs: Dict[str, Optional[Union[BaseModel, SearchPage]]]) -> None:
+        """
+        Сохраняет пачку объектов в redis одним пайплайном.
+
+        :param objs: объекты по ключам redis
+        :return:
+        """
+        if not objs:
+            return
 
-        await self.redis.set(key, data_to_cache, expire=CACHE_EXPIRE_IN_SECONDS)
+        pipe = self.redis.pipeline()
+        for key, obj in objs.items():
+            data_to_cache, entry, ttl = self._pack_cache_data(obj)
+            tags = self._cache_tags(key, obj)
+            pipe.set(key, data_to_cache, expire=ttl)
+            # Отрицательная запись живёт недолго и в обратный индекс не попадает
+            if CACHE_INVALIDATION_ENABLED and obj:
+                add_to_reverse_index(pipe, key, tags, ttl)
+            self.local_cache.put(key, entry, size=len(data_to_cache), tags=tags)
+        with REDIS_LATENCY.labels("pipeline").time():
+            await pipe.execute()
+
+    def _pack_cache_data(
+        self,
+        obj: Optional[Union[BaseModel, List[BaseModel], SearchPage]],
+    ) -> Tuple[bytes, CacheEntry, int]:
+        """
+        Упаковывает объект для записи в redis вместе с моментами устаревания (soft TTL) и истечения (hard TTL).
+        Положительный результат живёт в redis ещё CACHE_STALE_IF_ERROR_IN_SECONDS после hard TTL
+        на случай недоступности эластика.
+        Для отрицательного результата soft и hard TTL совпадают: в фоне он не обновляется и после hard TTL не хранится.
+
+        :param obj:
+        :return: данные для redis, запись для локального кеша и TTL ключа в redis
+        """
+        if obj:
+            soft_ttl, hard_ttl = self.cache_soft_ttl, self.cache_hard_ttl
+            redis_ttl = hard_ttl + CACHE_STALE_IF_ERROR_IN_SECONDS
+        else:
+            soft_ttl = hard_ttl = redis_ttl = NEGATIVE_CACHE_EXPIRE_IN_SECONDS
+        now = time.time()
+        entry = CacheEntry(obj=obj, soft_expire_at=now + soft_ttl, hard_expire_at=now + hard_ttl)
+        with SERIALIZATION_LATENCY.labels("encode", self.index).time():
+            data_to_cache = encode_cache_data(obj, entry.soft_expire_at, entry.hard_expire_at)
+        return data_to_cache, entry, redis_ttl
@@ -0,0 +1,141 @@
+"""
+Бинарный формат записей кеша в redis.
+
+Заголовок (18 байт): версия формата, флаги, тип значения, soft_expire_at и hard_expire_at (double, big-endian).
+Дальше одна orjson-сериализация всего значения, сжатая zlib, если она больше CACHE_COMPRESS_MIN_BYTES.
+
+Записи предыдущих форматов (версия 1 без hard_expire_at, "<soft_expire_at>|<json>" и голый json)
+по-прежнему читаются, чтобы кеш не сбрасывался на время выкатки. Для них hard_expire_at не ограничен:
+такие записи удаляет сам redis по истечении hard TTL.
+"""
+import json
+import struct
+import zlib
+from typing import List, Optional, Tuple, Type, Union
+
+import orjson
+from pydantic import BaseModel
+
+from core.config import CACHE_COMPRESS_LEVEL, CACHE_COMPRESS_MIN_BYTES
+
+from .cache_entry import SearchPage
+
+FORMAT_VERSION = 2
+HEADER = struct.Struct(">BBBdd")
+HEADER_V1 = struct.Struct(">BBBd")
+
+FLAG_ZLIB = 0x01
+
+KIND_OBJ = 0
+KIND_LIST = 1
+KIND_PAGE = 2
+KIND_NONE = 3
+
+CacheValue = Optional[Union[BaseModel, List[BaseModel], SearchPage]]
+
+
+class CacheDecodeError(ValueError):
+    pass
+
+
+def encode_cache_data(obj: CacheValue, soft_expire_at: float, hard_expire_at: float) -> bytes:
+    """
+    Сериализует объект, список объектов или страницу поиска одним проходом orjson.
+    None (документ не найден) хранится одним заголовком.
+
+    :param obj:
+    :param soft_expire_at: после этого момента запись обновляется в фоне
+    :param hard_expire_at: после этого момента запись отдаётся, только если эластик недоступен
+    :return:
+    """
+    if obj is None:
+        return HEADER.pack(FORMAT_VERSION, 0, KIND_NONE, soft_expire_at, hard_expire_at)
+
+    if isinstance(obj, SearchPage):
+        kind = KIND_PAGE
+        value = {"result": [doc.dict() for doc in obj.docs], "search_after": obj.next_search_after}
+        if obj.aggregations is not None:
+            value["aggregations"] = obj.aggregations
+    elif isinstance(obj, list):
+        kind = KIND_LIST
+        value = [doc.dict() for doc in obj]
+    else:
+        kind = KIND_OBJ
+        value = obj.dict()
+
+    payload = orjson.dumps(value)
+    flags = 0
+    if len(payload) >= CACHE_COMPRESS_MIN_BYTES:
+        payload = zlib.compress(payload, CACHE_COMPRESS_LEVEL)
+        flags |= FLAG_ZLIB
+
+    return HEADER.pack(FORMAT_VERSION, flags, kind, soft_expire_at, hard_expire_at) + payload
+
+
+def decode_cache_data(data: bytes, model: Type[BaseModel]) -> Tuple[CacheValue, float, float]:
+    """
+    Разбирает запись из redis и валидирует её моделью.
+
+    :param data:
+    :param model:
+    :return: объект, момент его устаревания и момент истечения hard TTL
+    :raises CacheDecodeError: запись обрезана, повреждена или не проходит валидацию
+    """
+    try:
+        return _decode(data, model)
+    except (struct.error, zlib.error, ValueError) as err:
+        raise CacheDecodeError(f"Не удалось разобрать запись кеша: {err}") from err
+
+
+def _decode(data: bytes, model: Type[BaseModel]) -> Tuple[CacheValue, float, float]:
+    if data[:1] == bytes([FORMAT_VERSION]):
+        _, flags, kind, soft_expire_at, hard_expire_at = HEADER.unpack_from(data)
+        payload = data[HEADER.size :]
+    elif data[:1] == bytes([1]):
+        _, flags, kind, soft_expire_at = HEADER_V1.unpack_from(data)
+        hard_expire_at = float("inf")
+        payload = data[HEADER_V1.size :]
+    else:
+        return (*_decode_legacy(data, model), float("inf"))
+
+    if kind == KIND_NONE:
+        return None, soft_expire_at, hard_expire_at
+    if kind not in (KIND_OBJ, KIND_LIST, KIND_PAGE):
+        raise ValueError(f"неизвестный тип значения {kind}")
+
+    if flags & FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+    value = orjson.loads(payload)
+
+    if kind == KIND_PAGE:
+        docs = [model.parse_obj(doc) for doc in value["result"]]
+        obj = SearchPage(docs=docs, next_search_after=value["search_after"], aggregations=value.get("aggregations"))
+    elif kind == KIND_LIST:
+        obj = [model.parse_obj(doc) for doc in value]
+    else:
+        obj = model.parse_obj(value)
+    return obj, soft_expire_at, hard_expire_at
+
+
+def _decode_legacy(data: bytes, model: Type[BaseModel]) -> Tuple[CacheValue, float]:
+    """
+    Старые форматы: json со списком json-строк в "result" или json объекта,
+    с префиксом "<soft_expire_at>|" или без него (такие записи считаются свежими).
+
+    :param data:
+    :param model:
+    :return:
+    """
+    soft_expire_at = float("inf")
+    if not data.startswith(b"{"):
+        prefix, _, data = data.partition(b"|")
+        soft_expire_at = float(prefix)
+
+    value = json.loads(data)
+    if "result" not in value:
+        return model.parse_obj(value), soft_expire_at
+
+    docs = [model.parse_raw(doc) for doc in value["result"]]
+    if "search_after" in value:
+        return SearchPage(docs=docs, next_search_after=value["search_after"]), soft_expire_at
+    return docs, soft_expire_at
@@ -0,0 +1,39 @@
+import time
+from typing import Any, List, NamedTuple, Optional
+
+from pydantic import BaseModel
+
+
+class CacheEntry(NamedTuple):
+    """
+    Закешированный объект, момент (unix time), после которого он считается устаревшим (soft TTL),
+    и момент, после которого он отдаётся только при недоступности эластика (hard TTL)
+    """
+
+    obj: Any
+    soft_expire_at: float
+    hard_expire_at: float = float("inf")
+
+    @property
+    def is_stale(self) -> bool:
+        return time.time() >= self.soft_expire_at
+
+    @property
+    def is_expired(self) -> bool:
+        return time.time() >= self.hard_expire_at
+
+
+class SearchPage(NamedTuple):
+    """
+    Страница результатов поиска и значения сортировки последнего документа для search_after.
+    next_search_after пустой, если страница последняя.
+    aggregations - ответ эластика по агрегациям запроса, если они запрашивались.
+    """
+
+    docs: List[BaseModel]
+    next_search_after: Optional[list] = None
+    pit_id: Optional[str] = None
+    aggregations: Optional[dict] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.docs) or bool(self.aggregations)
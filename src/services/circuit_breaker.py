@@ -0,0 +1,199 @@
+"""
+Предохранитель (circuit breaker) для вызовов эластика, свой на каждый индекс воркера.
+
+closed - вызовы идут в эластик, результаты последних ELASTIC_BREAKER_WINDOW вызовов копятся в окне.
+Если в окне не меньше ELASTIC_BREAKER_MIN_CALLS вызовов и доля ошибок достигла ELASTIC_BREAKER_FAILURE_RATE,
+предохранитель размыкается.
+open - вызовы сразу завершаются CircuitOpenError, эластик не нагружается. Через ELASTIC_BREAKER_OPEN_SECONDS
+предохранитель переходит в half_open.
+half_open - в эластик пропускается не больше ELASTIC_BREAKER_HALF_OPEN_CALLS пробных вызовов одновременно.
+Успешная проба замыкает предохранитель, ошибка снова размыкает его.
+
+Ошибкой считаются только признаки недоступности эластика: таймаут, ошибка соединения, ответ 429 или 5xx.
+NotFoundError и ошибки запроса (4xx) говорят о том, что эластик отвечает.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from elasticsearch import ConnectionError as ElasticConnectionError
+from elasticsearch import TransportError
+
+from core.config import (
+    ELASTIC_BREAKER_FAILURE_RATE,
+    ELASTIC_BREAKER_HALF_OPEN_CALLS,
+    ELASTIC_BREAKER_MIN_CALLS,
+    ELASTIC_BREAKER_OPEN_SECONDS,
+    ELASTIC_BREAKER_WINDOW,
+)
+from core.metrics import CIRCUIT_BREAKER_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Вызов отклонён разомкнутым предохранителем"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"circuit breaker {name} is open")
+        self.retry_after = retry_after
+
+
+class ElasticUnavailableError(Exception):
+    """Эластик не ответил вовремя, недоступен или отключён предохранителем"""
+
+    def __init__(self, index: str, retry_after: float):
+        super().__init__(f"elasticsearch index {index} is unavailable")
+        self.index = index
+        self.retry_after = retry_after
+
+
+def is_elastic_failure(err: BaseException) -> bool:
+    """
+    Признак недоступности эластика, по которому размыкается предохранитель.
+
+    :param err:
+    :return:
+    """
+    if isinstance(err, (asyncio.TimeoutError, ElasticConnectionError)):
+        return True
+    if isinstance(err, TransportError):
+        return isinstance(err.status_code, int) and (err.status_code == 429 or err.status_code >= 500)
+    return False
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window: int = ELASTIC_BREAKER_WINDOW,
+        min_calls: int = ELASTIC_BREAKER_MIN_CALLS,
+        failure_rate: float = ELASTIC_BREAKER_FAILURE_RATE,
+        open_seconds: float = ELASTIC_BREAKER_OPEN_SECONDS,
+        half_open_calls: int = ELASTIC_BREAKER_HALF_OPEN_CALLS,
+        is_failure: Callable[[BaseException], bool] = is_elastic_failure,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self._results: Deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def retry_after(self) -> float:
+        """Секунд до следующей пробы эластика"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """
+        Можно ли выполнить вызов. В half_open занимает слот пробного вызова,
+        вызывающий освобождает его через release_probe.
+
+        :return:
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                return False
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                return False
+            self._probes += 1
+        return True
+
+    def release_probe(self) -> None:
+        # Слоты считаются только внутри одного периода half_open: при входе в него счётчик обнуляется
+        if self.state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self) -> None:
+        if self.state == HALF_OPEN:
+            self._results.clear()
+            self._transition(CLOSED)
+            return
+        self._results.append(True)
+
+    def record_failure(self) -> None:
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        if self.state == OPEN:
+            return
+        self._results.append(False)
+        failures = self._results.count(False)
+        if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_rate:
+            self._open()
+
+    async def call(self, func: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """
+        Выполняет вызов через предохранитель с таймаутом.
+
+        :param func: фабрика корутины вызова
+        :param timeout: секунд на вызов, None - без таймаута
+        :return:
+        :raises CircuitOpenError: предохранитель разомкнут, вызов не выполнялся
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after)
+        probe = self.state == HALF_OPEN
+        try:
+            result = await asyncio.wait_for(func(), timeout)
+        except Exception as err:
+            if self.is_failure(err):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        else:
+            self.record_success()
+            return result
+        finally:
+            # Слот пробы возвращается и при отмене вызова снаружи: о здоровье эластика она ничего не говорит
+            if probe:
+                self.release_probe()
+
+    def _open(self) -> None:
+        self._opened_at = time.monotonic()
+        self._results.clear()
+        self._transition(OPEN)
+
+    def _transition(self, state: str) -> None:
+        if self.state == state and state != OPEN:
+            return
+        if state == HALF_OPEN:
+            self._probes = 0
+        if state == OPEN:
+            logger.warning("Предохранитель %s разомкнут на %s с", self.name, self.open_seconds)
+        else:
+            logger.info("Предохранитель %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        CIRCUIT_BREAKER_TRANSITIONS.labels(self.name, state).inc()
+
+
+class CircuitBreakers:
+    """Предохранители воркера по индексам эластика"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+elastic_breakers = CircuitBreakers()
@@ -0,0 +1,197 @@
+"""
+Адаптивный ограничитель одновременных вызовов эластика (bulkhead), свой на каждый индекс и вид вызова
+(search - поиск, get - чтение по id) в воркере: всплеск тяжёлых поисков не занимает слоты дешёвых чтений.
+
+Лимит подстраивается по AIMD: каждый быстрый вызов увеличивает его примерно на единицу за "окно" из limit
+вызовов, медленный (дольше latency_target) или неудачный вызов умножает его на backoff. Уменьшение
+происходит не чаще одного раза на поколение вызовов: вызовы, начатые до предыдущего уменьшения, его не повторяют.
+Вызовы, отклонённые разомкнутым предохранителем, до эластика не доходят и лимит не меняют.
+
+Вызовы сверх лимита ждут в очереди не дольше queue_timeout. Если очередь заполнена или время ожидания
+истекло, вызов отклоняется LimiterRejectedError.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Tuple
+
+from core.config import (
+    ELASTIC_LIMITER_BACKOFF,
+    ELASTIC_LIMITER_GET_LATENCY_TARGET_IN_SECONDS,
+    ELASTIC_LIMITER_INITIAL_LIMIT,
+    ELASTIC_LIMITER_MAX_LIMIT,
+    ELASTIC_LIMITER_MIN_LIMIT,
+    ELASTIC_LIMITER_QUEUE_SIZE,
+    ELASTIC_LIMITER_QUEUE_TIMEOUT_IN_SECONDS,
+    ELASTIC_LIMITER_SEARCH_LATENCY_TARGET_IN_SECONDS,
+)
+from core.metrics import CONCURRENCY_LIMIT, LIMITER_QUEUE_WAIT, LIMITER_REJECTIONS
+
+from .circuit_breaker import CircuitOpenError, is_elastic_failure
+
+logger = logging.getLogger(__name__)
+
+SEARCH = "search"
+GET = "get"
+
+
+class LimiterRejectedError(Exception):
+    """Вызов не дождался слота ограничителя или очередь заполнена"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"concurrency limiter {name} rejected the call")
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        latency_target: float,
+        initial_limit: int = ELASTIC_LIMITER_INITIAL_LIMIT,
+        min_limit: int = ELASTIC_LIMITER_MIN_LIMIT,
+        max_limit: int = ELASTIC_LIMITER_MAX_LIMIT,
+        backoff: float = ELASTIC_LIMITER_BACKOFF,
+        queue_size: int = ELASTIC_LIMITER_QUEUE_SIZE,
+        queue_timeout: float = ELASTIC_LIMITER_QUEUE_TIMEOUT_IN_SECONDS,
+        is_failure: Callable[[BaseException], bool] = is_elastic_failure,
+    ):
+        self.name = name
+        self.latency_target = latency_target
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.is_failure = is_failure
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._decreased_at = 0.0
+        CONCURRENCY_LIMIT.labels(name).set(self.limit)
+
+    async def call(self, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет вызов, заняв слот ограничителя, и подстраивает лимит по его результату.
+
+        :param func: фабрика корутины вызова
+        :return:
+        :raises LimiterRejectedError: слот не получен
+        """
+        await self.acquire()
+        started = time.monotonic()
+        overloaded = False
+        reached_backend = True
+        try:
+            return await func()
+        except CircuitOpenError:
+            # Предохранитель отклонил вызов, не дойдя до эластика: о нагрузке это ничего не говорит,
+            # а рост лимита во время отказа обрушил бы на эластик всплеск вызовов после восстановления
+            reached_backend = False
+            raise
+        except Exception as err:
+            overloaded = self.is_failure(err)
+            raise
+        finally:
+            latency = time.monotonic() - started
+            self.release()
+            if reached_backend:
+                self._adjust(started, overloaded or latency > self.latency_target)
+
+    async def acquire(self) -> None:
+        """
+        Занимает слот. Без очереди, если есть свободный, иначе ждёт в очереди не дольше queue_timeout.
+
+        :return:
+        """
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            self._reject("queue_full")
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.monotonic()
+        try:
+            await self._wait(waiter)
+        finally:
+            LIMITER_QUEUE_WAIT.labels(self.name).observe(time.monotonic() - started)
+
+    async def _wait(self, waiter: asyncio.Future) -> None:
+        """
+        Ждёт слот в очереди не дольше queue_timeout. При таймауте или отмене снимает ожидание с очереди,
+        а если слот уже выдан - возвращает его следующему.
+
+        :param waiter: future ожидающего, слот выдаёт release
+        :return:
+        :raises LimiterRejectedError: истекло время ожидания
+        """
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self._reject("timeout")
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        if waiter.done() and not waiter.cancelled():
+            # Слот выдан одновременно с отменой: возвращаем его следующему в очереди
+            self.release()
+        elif waiter in self._waiters:
+            self._waiters.remove(waiter)
+
+    def release(self) -> None:
+        """
+        Освобождает слот и передаёт свободные слоты ожидающим в порядке очереди.
+        Слот ожидающего занимается здесь же, до его пробуждения.
+
+        :return:
+        """
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def _adjust(self, started: float, overloaded: bool) -> None:
+        if overloaded:
+            if started < self._decreased_at:
+                return
+            self.limit = max(float(self.min_limit), self.limit * self.backoff)
+            self._decreased_at = time.monotonic()
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        CONCURRENCY_LIMIT.labels(self.name).set(self.limit)
+
+    def _reject(self, reason: str) -> None:
+        LIMITER_REJECTIONS.labels(self.name, reason).inc()
+        logger.debug("Ограничитель %s отклонил вызов: %s, лимит %.1f", self.name, reason, self.limit)
+        raise LimiterRejectedError(self.name, retry_after=self.queue_timeout)
+
+
+class ConcurrencyLimiters:
+    """Ограничители воркера по индексам эластика и видам вызовов"""
+
+    LATENCY_TARGETS = {
+        SEARCH: ELASTIC_LIMITER_SEARCH_LATENCY_TARGET_IN_SECONDS,
+        GET: ELASTIC_LIMITER_GET_LATENCY_TARGET_IN_SECONDS,
+    }
+
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, str], AdaptiveLimiter] = {}
+
+    def get(self, index: str, kind: str) -> AdaptiveLimiter:
+        limiter = self._limiters.get((index, kind))
+        if limiter is None:
+            limiter = AdaptiveLimiter(f"{index}:{kind}", latency_target=self.LATENCY_TARGETS[kind])
+            self._limiters[(index, kind)] = limiter
+        return limiter
+
+
+elastic_limiters = ConcurrencyLimiters()
@@ -5,6 +5,7 @@ from aioredis import Redis
 from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
 
+from core.config import FILM_CACHE_HARD_TTL_IN_SECONDS, FILM_CACHE_SCHEMA_VERSION, FILM_CACHE_SOFT_TTL_IN_SECONDS
 from db.elastic import get_elastic
 from db.redis import get_redis
 from models.film import Film
@@ -18,6 +19,9 @@ class FilmService(BaseService):
         super().__init__(redis, elastic)
         self.index = "movies"
         self.model = Film
+        self.schema_version = FILM_CACHE_SCHEMA_VERSION
+        self.cache_soft_ttl = FILM_CACHE_SOFT_TTL_IN_SECONDS
+        self.cache_hard_ttl = FILM_CACHE_HARD_TTL_IN_SECONDS
 
 
 @lru_cache()
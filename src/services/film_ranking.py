@@ -0,0 +1,212 @@
+"""
+Рейтинги фильмов в redis, по которым выдача film_filter отдаётся без эластика.
+
+Для всех фильмов и для каждого жанра хранятся два sorted set id фильмов: по возрастанию и по убыванию imdb_rating.
+Порядок совпадает с сортировкой эластика (build_film_search_body): при равном рейтинге фильмы идут по возрастанию id,
+а redis упорядочивает равные score по member, поэтому для убывания хранится отдельный set со score -imdb_rating.
+Фильмы без рейтинга эластик ставит в конец при любом направлении, здесь они получают score +inf.
+Страница выдачи - один ZRANGE, её стоимость не зависит от глубины.
+
+Рейтинги целиком перестраиваются раз в FILM_RANKING_REFRESH_INTERVAL_IN_SECONDS одним из воркеров (блокировка в redis)
+и между перестроениями обновляются точечно по событиям изменения фильмов (см. services.invalidation).
+Готовность рейтингов отмечает отдельный ключ с TTL FILM_RANKING_EXPIRE_IN_SECONDS: если перестроения прекратились,
+выдача возвращается в эластик.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+from aioredis import Redis
+from elasticsearch import AsyncElasticsearch
+
+from core.config import CACHE_KEY_PREFIX, FILM_RANKING_EXPIRE_IN_SECONDS
+from core.metrics import REDIS_LATENCY
+from models.film import Film
+
+from .film import get_film_service
+
+logger = logging.getLogger(__name__)
+
+ASC = "asc"
+DESC = "desc"
+UNRATED_SCORE = float("inf")
+# Поля фильма, нужные для рейтингов
+RANKING_FIELDS = ["id", "imdb_rating", "genre"]
+
+
+def ranking_score(imdb_rating: Optional[float], direction: str) -> float:
+    if imdb_rating is None:
+        return UNRATED_SCORE
+    return -imdb_rating if direction == DESC else imdb_rating
+
+
+def score_rating(score: float, direction: str) -> Optional[float]:
+    if score == UNRATED_SCORE:
+        return None
+    return -score if direction == DESC else score
+
+
+class FilmRankings:
+    def __init__(self, index: str = "movies"):
+        self.index = index
+        self.built_key = f"{CACHE_KEY_PREFIX}:ranking:{index}:built"
+        self.genres_key = f"{CACHE_KEY_PREFIX}:ranking:{index}:genres"
+        self.lock_key = f"{CACHE_KEY_PREFIX}:ranking:{index}:lock"
+
+    def key(self, direction: str, genre: Optional[str] = None) -> str:
+        scope = f"genre:{genre}" if genre else "all"
+        return f"{CACHE_KEY_PREFIX}:ranking:{self.index}:{direction}:{scope}"
+
+    async def page(
+        self,
+        redis: Redis,
+        descending: bool,
+        genre: Optional[str],
+        offset: int,
+        size: int,
+    ) -> Optional[List[Tuple[str, Optional[float]]]]:
+        """
+        Страница рейтинга: один пайплайн из проверки готовности и ZRANGE.
+
+        :param redis:
+        :param descending: от лучших фильмов к худшим
+        :param genre: название жанра, None - все фильмы
+        :param offset: сколько фильмов пропустить
+        :param size:
+        :return: id фильмов с рейтингом в порядке выдачи, None - рейтинги не построены
+        """
+        direction = DESC if descending else ASC
+        pipe = redis.pipeline()
+        pipe.exists(self.built_key)
+        pipe.zrange(self.key(direction, genre), offset, offset + size - 1, withscores=True)
+        with REDIS_LATENCY.labels("pipeline").time():
+            built, ranked = await pipe.execute()
+        if not built:
+            return None
+        return [(member.decode(), score_rating(score, direction)) for member, score in ranked]
+
+    async def rebuild(self, redis: Redis, elastic: AsyncElasticsearch) -> None:
+        """
+        Перестраивает рейтинги по всем фильмам индекса. Рейтинги собираются во временных ключах
+        и подменяют действующие одной транзакцией, поэтому читатели не видят частично построенных рейтингов.
+
+        :param redis:
+        :param elastic:
+        :return:
+        """
+        build_id = uuid.uuid4().hex
+        written: Set[str] = set()
+        genres: Set[str] = set()
+        films_count = 0
+
+        async for films in get_film_service(redis=redis, elastic=elastic).export(RANKING_FIELDS):
+            members: Dict[str, list] = {}
+            for film in films:
+                for key, score in self._film_scores(film):
+                    members.setdefault(key, []).extend((score, film.id))
+                genres.update(film.genre or [])
+            pipe = redis.pipeline()
+            for key, pairs in members.items():
+                # Временные ключи живут ограниченное время: прерванное построение не оставляет мусора
+                pipe.zadd(self._build_key(key, build_id), *pairs)
+                pipe.expire(self._build_key(key, build_id), FILM_RANKING_EXPIRE_IN_SECONDS)
+            with REDIS_LATENCY.labels("pipeline").time():
+                await pipe.execute()
+            written.update(members)
+            films_count += len(films)
+
+        old_genres = {genre.decode() for genre in await redis.smembers(self.genres_key)}
+        stale = {self.key(direction, genre) for direction in (ASC, DESC) for genre in [None, *old_genres]} - written
+
+        tr = redis.multi_exec()
+        for key in written:
+            tr.rename(self._build_key(key, build_id), key)
+            tr.expire(key, FILM_RANKING_EXPIRE_IN_SECONDS)
+        if stale:
+            tr.delete(*stale)
+        tr.delete(self.genres_key)
+        if genres:
+            tr.sadd(self.genres_key, *genres)
+            tr.expire(self.genres_key, FILM_RANKING_EXPIRE_IN_SECONDS)
+        tr.set(self.built_key, str(time.time()), expire=FILM_RANKING_EXPIRE_IN_SECONDS)
+        with REDIS_LATENCY.labels("multi_exec").time():
+            await tr.execute()
+        logger.info("Рейтинги фильмов перестроены: %s фильмов, %s жанров", films_count, len(genres))
+
+    async def update(self, redis: Redis, elastic: AsyncElasticsearch, ids: List[str]) -> None:
+        """
+        Точечно обновляет фильмы ids: перечитывает их из эластика, удалённые убирает из рейтингов.
+
+        :param redis:
+        :param elastic:
+        :param ids:
+        :return:
+        """
+        if not ids or not await redis.exists(self.built_key):
+            return
+        response = await elastic.mget(body={"ids": ids}, index=self.index, _source_includes=RANKING_FIELDS)
+        genres = {genre.decode() for genre in await redis.smembers(self.genres_key)}
+
+        tr = redis.multi_exec()
+        for doc in response["docs"]:
+            self._update_film(tr, doc, genres)
+        with REDIS_LATENCY.labels("multi_exec").time():
+            await tr.execute()
+
+    def _update_film(self, tr, doc: dict, genres: Set[str]) -> None:
+        """
+        Добавляет в транзакцию замену фильма из ответа mget во всех рейтингах.
+
+        :param tr: транзакция redis
+        :param doc: документ из ответа mget
+        :param genres: жанры, по которым построены рейтинги
+        :return:
+        """
+        # Прежние жанры фильма неизвестны, поэтому он удаляется из рейтингов всех жанров
+        for direction in (ASC, DESC):
+            for genre in [None, *genres]:
+                tr.zrem(self.key(direction, genre), doc["_id"])
+        if not doc.get("found"):
+            return
+        film = Film.construct(**doc["_source"])
+        for key, score in self._film_scores(film):
+            tr.zadd(key, score, film.id)
+            tr.expire(key, FILM_RANKING_EXPIRE_IN_SECONDS)
+        if film.genre:
+            tr.sadd(self.genres_key, *film.genre)
+
+    async def refresh_forever(self, redis: Redis, elastic: AsyncElasticsearch, interval: float) -> None:
+        """
+        Перестраивает рейтинги сразу и затем раз в interval секунд. Воркеры запускают цикл одновременно,
+        поэтому перестраивает тот, кто взял блокировку в redis. Блокировка не снимается и истекает сама.
+        Ошибка перестроения не роняет цикл: до следующей попытки используются прежние рейтинги.
+
+        :param redis:
+        :param elastic:
+        :param interval:
+        :return:
+        """
+        while True:
+            try:
+                acquired = await redis.set(self.lock_key, "1", expire=int(interval), exist=Redis.SET_IF_NOT_EXIST)
+                if acquired:
+                    await self.rebuild(redis, elastic)
+            except Exception as err:
+                logger.warning("Не удалось перестроить рейтинги фильмов: %s", err)
+            await asyncio.sleep(interval)
+
+    def _film_scores(self, film: Film) -> List[Tuple[str, float]]:
+        return [
+            (self.key(direction, genre), ranking_score(film.imdb_rating, direction))
+            for direction in (ASC, DESC)
+            for genre in [None, *(film.genre or [])]
+        ]
+
+    @staticmethod
+    def _build_key(key: str, build_id: str) -> str:
+        return f"{key}:build:{build_id}"
+
+
+film_rankings = FilmRankings()
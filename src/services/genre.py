@@ -1,20 +1,66 @@
 from functools import lru_cache
+from typing import List, Optional
 
 from aioredis import Redis
 from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
 
+from core.config import (
+    GENRE_CACHE_HARD_TTL_IN_SECONDS,
+    GENRE_CACHE_SCHEMA_VERSION,
+    GENRE_CACHE_SOFT_TTL_IN_SECONDS,
+    GENRE_CATALOG_MAX_SIZE,
+)
 from db.elastic import get_elastic
 from db.redis import get_redis
 from models.genre import Genre
 from services.base_service import BaseService
+from services.genre_catalog import GenreCatalog, genre_catalog
 
 
 class GenreService(BaseService):
-    def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
+    def __init__(self, redis: Redis, elastic: AsyncElasticsearch, catalog: GenreCatalog = genre_catalog):
         super().__init__(redis, elastic)
         self.index = "genre"
         self.model = Genre
+        self.schema_version = GENRE_CACHE_SCHEMA_VERSION
+        self.cache_soft_ttl = GENRE_CACHE_SOFT_TTL_IN_SECONDS
+        self.cache_hard_ttl = GENRE_CACHE_HARD_TTL_IN_SECONDS
+        self.catalog = catalog
+
+    async def get_by_id(self, id_: str, index: str = None, fields: Optional[List[str]] = None) -> Optional[Genre]:
+        """
+        Берёт жанр из справочника в памяти. Жанр, появившийся после последней загрузки справочника,
+        ищется обычным путём через кеш и эластик.
+
+        :param id_:
+        :param index:
+        :param fields:
+        :return:
+        """
+        genre = self.catalog.get(id_)
+        if genre:
+            return genre
+        return await super().get_by_id(id_, index, fields)
+
+    async def get_all(self) -> List[Genre]:
+        """
+        Все жанры. Если справочник ещё не загружен - поиск по индексу через кеш.
+
+        :return:
+        """
+        if self.catalog.loaded:
+            return self.catalog.all()
+        return await self.search_all()
+
+    async def search_all(self) -> List[Genre]:
+        """
+        Все жанры поиском по индексу через кеш, в обход справочника.
+
+        :return:
+        """
+        genres = await self.search(body={"query": {"match_all": {}}, "size": GENRE_CATALOG_MAX_SIZE})
+        return genres or []
 
 
 @lru_cache()
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from elasticsearch import AsyncElasticsearch
+
+from core.config import GENRE_CATALOG_MAX_SIZE
+from models.genre import Genre
+
+logger = logging.getLogger(__name__)
+
+
+class GenreCatalog:
+    """
+    Справочник жанров в памяти воркера. Индекс жанров маленький, поэтому он целиком загружается
+    при старте и периодически перезагружается, а чтения жанров не ходят ни в redis, ни в эластик.
+    """
+
+    def __init__(self, index: str = "genre"):
+        self.index = index
+        self._by_id: Dict[str, Genre] = {}
+        self._genres: List[Genre] = []
+        self.loaded = False
+
+    async def load(self, elastic: AsyncElasticsearch) -> None:
+        """
+        Загружает все жанры из эластика и атомарно подменяет справочник.
+
+        :param elastic:
+        :return:
+        """
+        response = await elastic.search(
+            index=self.index,
+            body={"query": {"match_all": {}}, "size": GENRE_CATALOG_MAX_SIZE},
+        )
+        genres = [Genre(**hit["_source"]) for hit in response["hits"]["hits"]]
+        genres.sort(key=lambda genre: genre.name)
+
+        self._genres = genres
+        self._by_id = {genre.id: genre for genre in genres}
+        self.loaded = True
+        logger.info("Справочник жанров загружен: %s шт.", len(genres))
+
+    def get(self, id_: str) -> Optional[Genre]:
+        return self._by_id.get(id_)
+
+    def all(self) -> List[Genre]:
+        return self._genres
+
+    async def refresh_forever(self, elastic: AsyncElasticsearch, interval: float) -> None:
+        """
+        Перезагружает справочник раз в interval секунд. Ошибка загрузки не роняет цикл:
+        до следующей попытки используется предыдущая версия справочника.
+
+        :param elastic:
+        :param interval:
+        :return:
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load(elastic)
+            except Exception as err:
+                logger.warning("Не удалось обновить справочник жанров: %s", err)
+
+
+genre_catalog = GenreCatalog()
@@ -0,0 +1,180 @@
+"""
+Сброс кеша по событиям изменения документов.
+
+Производитель (ETL или любой другой) публикует в канал CACHE_INVALIDATION_CHANNEL сообщение
+{"index": "movies", "ids": ["<id>", ...]}. Каждый воркер подписан на канал и по сообщению:
+- удаляет из redis все ключи, в которых есть документ, по обратному индексу <prefix>:revidx:<id>;
+- удаляет из своих локальных кешей записи с тегом id документа;
+- вызывает обработчики изменения индекса (например, перезагрузку справочника жанров или обновление подсказок).
+
+Обратный индекс пополняется при каждой записи в кеш: ключ записи добавляется в sorted set
+всех документов, которые в неё попали (сам документ, документы страницы поиска, id из ответа).
+Score ключа - момент его истечения в redis: истёкшие ключи вычищаются из индекса при следующей записи,
+а сам индекс живёт до истечения самой долгоживущей записи. Отрицательные записи в индекс не попадают:
+они живут NEGATIVE_CACHE_EXPIRE_IN_SECONDS и в redis событиями не сбрасываются.
+"""
+import asyncio
+import logging
+import time
+import weakref
+from typing import Awaitable, Callable, Dict, Iterable, List
+
+import orjson
+from aioredis import Redis
+
+from core.config import CACHE_INVALIDATION_CHANNEL, CACHE_KEY_PREFIX
+from core.metrics import REDIS_LATENCY
+
+from .local_cache import LocalCache
+
+logger = logging.getLogger(__name__)
+
+
+# Вычищает из обратного индекса истёкшие ключи, добавляет ключ записи с моментом его истечения
+# и продлевает TTL индекса до TTL записи, если он короче. KEYS: индекс; ARGV: ключ записи, её TTL, сейчас, момент истечения
+ADD_TO_REVERSE_INDEX_SCRIPT = """
+redis.call("zremrangebyscore", KEYS[1], "-inf", ARGV[3])
+redis.call("zadd", KEYS[1], ARGV[4], ARGV[1])
+if redis.call("ttl", KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call("expire", KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+
+def reverse_index_key(doc_id: str) -> str:
+    # Множества прежнего формата (revidx:<id>) сбрасывают воркеры предыдущей версии, а затем они истекают сами
+    return f"{CACHE_KEY_PREFIX}:revidx:z:{doc_id}"
+
+
+def add_to_reverse_index(pipe, key: str, doc_ids: Iterable[str], ttl: int) -> None:
+    """
+    Добавляет в пайплайн запись ключа кеша в обратный индекс документов.
+
+    :param pipe: пайплайн или транзакция redis
+    :param key: ключ записи кеша
+    :param doc_ids: id документов, попавших в запись
+    :param ttl: TTL записи в redis
+    :return:
+    """
+    now = time.time()
+    for doc_id in doc_ids:
+        pipe.eval(ADD_TO_REVERSE_INDEX_SCRIPT, keys=[reverse_index_key(doc_id)], args=[key, ttl, now, now + ttl])
+
+
+async def publish_invalidation(redis: Redis, index: str, ids: List[str]) -> int:
+    """
+    Публикует изменение документов индекса.
+
+    :param redis:
+    :param index:
+    :param ids:
+    :return: количество подписчиков, получивших сообщение
+    """
+    with REDIS_LATENCY.labels("publish").time():
+        return await redis.publish(CACHE_INVALIDATION_CHANNEL, orjson.dumps({"index": index, "ids": ids}))
+
+
+class CacheInvalidator:
+    """
+    Подписчик на события изменения документов. Локальные кеши воркера регистрируются через track,
+    ссылки на них слабые: кеш удалённого сервиса не удерживается.
+    """
+
+    def __init__(self):
+        self._local_caches: "weakref.WeakSet[LocalCache]" = weakref.WeakSet()
+        self._handlers: Dict[str, List[Callable[[List[str]], Awaitable[None]]]] = {}
+
+    def track(self, local_cache: LocalCache) -> None:
+        self._local_caches.add(local_cache)
+
+    def on_change(self, index: str, handler: Callable[[List[str]], Awaitable[None]]) -> None:
+        """
+        Регистрирует обработчик, вызываемый после сброса кеша по документам индекса.
+
+        :param index:
+        :param handler: получает id изменённых документов
+        :return:
+        """
+        self._handlers.setdefault(index, []).append(handler)
+
+    async def invalidate(self, redis: Redis, index: str, ids: List[str]) -> int:
+        """
+        Сбрасывает все записи кеша с документами ids. Сообщение получают все воркеры:
+        ключи в redis удаляет первый, у остальных обратный индекс уже пуст.
+
+        :param redis:
+        :param index:
+        :param ids:
+        :return: количество удалённых ключей redis
+        """
+        if not ids:
+            return 0
+        revidx_keys = [reverse_index_key(id_) for id_ in ids]
+        pipe = redis.pipeline()
+        for revidx_key in revidx_keys:
+            pipe.zrange(revidx_key, 0, -1)
+        with REDIS_LATENCY.labels("pipeline").time():
+            members = await pipe.execute()
+        keys = {key for keys in members for key in keys}
+        with REDIS_LATENCY.labels("delete").time():
+            await redis.delete(*revidx_keys, *keys)
+
+        for local_cache in list(self._local_caches):
+            for id_ in ids:
+                local_cache.invalidate_tag(id_)
+
+        for handler in self._handlers.get(index, []):
+            await handler(ids)
+        logger.debug("Сброшен кеш по %s документам индекса %s: %s ключей", len(ids), index, len(keys))
+        return len(keys)
+
+    async def listen_forever(self, redis: Redis) -> None:
+        """
+        Слушает канал изменений. После переподключения локальные кеши очищаются целиком:
+        сообщения, пришедшие во время разрыва, потеряны.
+
+        :param redis:
+        :return:
+        """
+        reconnect = False
+        while True:
+            try:
+                await self._listen(redis, clear_local_caches=reconnect)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logger.warning("Подписка на сброс кеша прервана: %s", err)
+            reconnect = True
+            await asyncio.sleep(1)
+
+    async def _listen(self, redis: Redis, clear_local_caches: bool) -> None:
+        """
+        Одна подписка на канал изменений: обрабатывает сообщения, пока подписка не закроется.
+
+        :param redis:
+        :param clear_local_caches: очистить локальные кеши после подписки
+        :return:
+        """
+        (channel,) = await redis.subscribe(CACHE_INVALIDATION_CHANNEL)
+        if clear_local_caches:
+            for local_cache in list(self._local_caches):
+                local_cache.clear()
+        while await channel.wait_message():
+            await self._handle(redis, await channel.get())
+        logger.warning("Подписка на сброс кеша закрыта")
+
+    async def _handle(self, redis: Redis, message: bytes) -> None:
+        try:
+            event = orjson.loads(message)
+            index, ids = event["index"], [str(id_) for id_ in event["ids"]]
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Некорректное сообщение о сбросе кеша: %r", message)
+            return
+        try:
+            await self.invalidate(redis, index, ids)
+        except Exception as err:
+            logger.warning("Не удалось сбросить кеш по документам %s: %s", ids, err)
+
+
+cache_invalidator = CacheInvalidator()
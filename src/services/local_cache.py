@@ -0,0 +1,159 @@
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+
+from core.metrics import LOCAL_CACHE_STATS
+
+
+class _Entry(NamedTuple):
+    value: Any
+    size: int
+    expire_at: float
+    tags: Tuple[str, ...]
+
+
+class LocalCache:
+    """
+    In-process LRU-кеш с TTL (L1), стоящий перед Redis.
+    Хранит уже провалидированные объекты моделей, поэтому попадание в него
+    избавляет и от похода в сеть, и от парсинга pydantic.
+
+    Ограничен количеством записей и суммарным размером (в байтах сериализованного значения).
+    Живёт в пределах одного воркера. Записи можно помечать тегами (id документов, которые в них
+    попали) и удалять все записи с тегом разом - так кеш сбрасывается при изменении документа.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float, name: Optional[str] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._tags: Dict[str, Set[str]] = {}
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if name:
+            _named_caches.add(self)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Возвращает объект по ключу, если он есть и не протух. Обновляет позицию в LRU.
+
+        :param key:
+        :return:
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.expire_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def put(self, key: str, value: Any, size: int, tags: Iterable[str] = ()) -> None:
+        """
+        Кладёт объект в кеш. Если лимиты превышены - вытесняет самые давно использованные записи.
+        Объекты больше max_bytes не кешируются, а прежняя запись по ключу всё равно удаляется:
+        иначе воркер продолжал бы отдавать устаревшее значение.
+
+        :param key:
+        :param value:
+        :param size: размер сериализованного значения в байтах
+        :param tags: теги записи для invalidate_tag
+        :return:
+        """
+        if key in self._data:
+            self._remove(key)
+
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+
+        tags = tuple(tags)
+        self._data[key] = _Entry(value=value, size=size, expire_at=time.monotonic() + self.ttl, tags=tags)
+        self._bytes += size
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._data))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        if key in self._data:
+            self._remove(key)
+
+    def invalidate_tag(self, tag: str) -> int:
+        """
+        Удаляет все записи с тегом.
+
+        :param tag:
+        :return: количество удалённых записей
+        """
+        keys = self._tags.pop(tag, set())
+        for key in keys:
+            if key in self._data:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._tags.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счётчики для мониторинга.
+
+        :return:
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._data),
+            "bytes": self._bytes,
+        }
+
+    def export_stats(self) -> None:
+        """
+        Переносит счётчики stats в метрики по имени кеша.
+
+        :return:
+        """
+        for stat, value in self.stats().items():
+            LOCAL_CACHE_STATS.labels(self.name, stat).set(value)
+
+    def _remove(self, key: str) -> None:
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+# Кеши с именем, их счётчики попадают в метрики. Ссылки слабые: кеш удалённого сервиса не удерживается
+_named_caches: "weakref.WeakSet[LocalCache]" = weakref.WeakSet()
+
+
+def export_local_cache_stats() -> None:
+    """
+    Обновляет метрики счётчиков всех именованных локальных кешей воркера, вызывается перед отдачей /metrics.
+
+    :return:
+    """
+    for local_cache in list(_named_caches):
+        local_cache.export_stats()
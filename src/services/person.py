@@ -4,6 +4,7 @@ from aioredis import Redis
 from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
 
+from core.config import PERSON_CACHE_HARD_TTL_IN_SECONDS, PERSON_CACHE_SCHEMA_VERSION, PERSON_CACHE_SOFT_TTL_IN_SECONDS
 from db.elastic import get_elastic
 from db.redis import get_redis
 from models.person import Person
@@ -15,6 +16,9 @@ class PersonService(BaseService):
         super().__init__(redis, elastic)
         self.index = "person"
         self.model = Person
+        self.schema_version = PERSON_CACHE_SCHEMA_VERSION
+        self.cache_soft_ttl = PERSON_CACHE_SOFT_TTL_IN_SECONDS
+        self.cache_hard_ttl = PERSON_CACHE_HARD_TTL_IN_SECONDS
 
 
 @lru_cache()
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+
+import orjson
+from aioredis import Redis
+
+from core.config import CACHE_KEY_PREFIX, POPULAR_QUERIES_EXPIRE_IN_SECONDS, POPULAR_QUERIES_MAX_SIZE
+from core.metrics import REDIS_LATENCY
+
+from .utils import canonical_dumps
+
+logger = logging.getLogger(__name__)
+
+
+def popular_queries_key(index: str) -> str:
+    return f"{CACHE_KEY_PREFIX}:popular:{index}"
+
+
+def popular_body_key(index: str, cache_key: str) -> str:
+    return f"{CACHE_KEY_PREFIX}:popular:{index}:body:{cache_key}"
+
+
+class PopularQueries:
+    """
+    Статистика самых частых поисковых запросов, по ней прогревается кеш.
+    Обращения копятся в памяти воркера и периодически сбрасываются в redis одним пайплайном,
+    чтобы поиск не делал лишнюю запись в redis на каждый запрос.
+
+    В redis на индекс хранится sorted set ключей кеша по числу обращений и тела запросов
+    отдельными ключами с TTL: вытесненные из sorted set запросы со временем удаляются сами.
+    """
+
+    def __init__(self, max_size: int = POPULAR_QUERIES_MAX_SIZE):
+        self.max_size = max_size
+        self._counts: Dict[Tuple[str, str], int] = {}
+        self._bodies: Dict[Tuple[str, str], bytes] = {}
+
+    def record(self, index: str, cache_key: str, body: dict) -> None:
+        """
+        Учитывает обращение к поисковому запросу. Новые запросы сверх max_size до сброса не учитываются.
+
+        :param index:
+        :param cache_key: ключ кеша, под которым хранится выдача запроса
+        :param body:
+        :return:
+        """
+        counter_key = (index, cache_key)
+        if counter_key not in self._counts:
+            if len(self._counts) >= self.max_size:
+                return
+            self._bodies[counter_key] = canonical_dumps(body)
+            self._counts[counter_key] = 0
+        self._counts[counter_key] += 1
+
+    async def flush(self, redis: Redis) -> None:
+        """
+        Сбрасывает накопленные счётчики в redis и обрезает статистику до max_size запросов на индекс.
+
+        :param redis:
+        :return:
+        """
+        if not self._counts:
+            return
+        counts, bodies = self._counts, self._bodies
+        self._counts, self._bodies = {}, {}
+
+        pipe = redis.pipeline()
+        indices = set()
+        for (index, cache_key), count in counts.items():
+            pipe.zincrby(popular_queries_key(index), count, cache_key)
+            pipe.set(popular_body_key(index, cache_key), bodies[(index, cache_key)], expire=POPULAR_QUERIES_EXPIRE_IN_SECONDS)
+            indices.add(index)
+        for index in indices:
+            pipe.zremrangebyrank(popular_queries_key(index), 0, -self.max_size - 1)
+            pipe.expire(popular_queries_key(index), POPULAR_QUERIES_EXPIRE_IN_SECONDS)
+        with REDIS_LATENCY.labels("pipeline").time():
+            await pipe.execute()
+
+    async def flush_forever(self, redis: Redis, interval: float) -> None:
+        """
+        Сбрасывает счётчики раз в interval секунд. Ошибка сброса не роняет цикл, накопленное за период теряется.
+
+        :param redis:
+        :param interval:
+        :return:
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush(redis)
+            except Exception as err:
+                logger.warning("Не удалось сохранить статистику поисковых запросов: %s", err)
+
+    @staticmethod
+    async def top(redis: Redis, index: str, limit: int) -> List[dict]:
+        """
+        Тела самых частых поисковых запросов по индексу, от самого частого.
+
+        :param redis:
+        :param index:
+        :param limit:
+        :return:
+        """
+        with REDIS_LATENCY.labels("zrevrange").time():
+            cache_keys = await redis.zrevrange(popular_queries_key(index), 0, limit - 1)
+        if not cache_keys:
+            return []
+        with REDIS_LATENCY.labels("mget").time():
+            bodies = await redis.mget(*[popular_body_key(index, cache_key.decode()) for cache_key in cache_keys])
+        return [orjson.loads(body) for body in bodies if body]
+
+
+popular_queries = PopularQueries()
@@ -0,0 +1,33 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    Склеивает одновременные запросы с одинаковым ключом в пределах воркера:
+    загрузку выполняет только первая корутина, остальные ждут тот же future.
+
+    Загрузка запускается отдельной задачей, поэтому отмена одного из ожидающих
+    (например, клиент закрыл соединение) не отменяет её для остальных.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет func один раз на ключ среди одновременно ожидающих и возвращает её результат всем.
+
+        :param key:
+        :param func: фабрика корутины загрузки
+        :return:
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
@@ -0,0 +1,336 @@
+"""
+Подсказки при наборе (автодополнение) названий фильмов и имён персон из памяти воркера, без эластика.
+
+Индекс - отсортированный массив пар (ключ, id документа). Ключи - нормализованный текст документа,
+начиная с каждого его слова: "звёздные войны" даёт ключи "звездные войны" и "войны", поэтому префикс
+находится и по второму слову. Все ключи с префиксом лежат в массиве подряд и находятся двумя bisect.
+Для префиксов, под которые попадает больше SUGGEST_PRECOMPUTED_MIN_MATCHES документов (короткие и частые
+слова), перебор диапазона дорог, поэтому лучшие подсказки для них считаются заранее.
+
+Индекс целиком загружается при старте и раз в SUGGEST_REFRESH_INTERVAL_IN_SECONDS, а между загрузками
+обновляется точечно по событиям изменения документов (см. services.invalidation).
+"""
+import asyncio
+import heapq
+import logging
+import re
+from bisect import bisect_left, insort
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from elasticsearch import AsyncElasticsearch
+
+from core.config import SUGGEST_LOAD_BATCH_SIZE, SUGGEST_MAX_SIZE, SUGGEST_PRECOMPUTED_MIN_MATCHES
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w+")
+# Верхняя граница диапазона ключей с префиксом: больше любого символа, который встречается в ключах
+KEY_END = "\U0010ffff"
+
+
+class Suggestion(NamedTuple):
+    id: str
+    text: str
+    score: Optional[float]
+
+
+def normalize(text: str) -> str:
+    """
+    Приводит текст к виду, в котором сравниваются префиксы: слова в нижнем регистре через пробел, ё -> е.
+
+    :param text:
+    :return:
+    """
+    return " ".join(WORD_RE.findall(text.casefold().replace("ё", "е")))
+
+
+def suggestion_keys(text: str) -> List[str]:
+    """
+    Ключи индекса для текста: нормализованный текст, начиная с каждого слова.
+
+    :param text:
+    :return:
+    """
+    words = normalize(text).split(" ")
+    return list(dict.fromkeys(" ".join(words[i:]) for i in range(len(words)) if words[i]))
+
+
+class SuggestIndex:
+    def __init__(
+        self,
+        index: str,
+        fields: List[str],
+        to_suggestion: Callable[[str, dict], Optional[Suggestion]],
+        max_size: int = SUGGEST_MAX_SIZE,
+        precomputed_min_matches: int = SUGGEST_PRECOMPUTED_MIN_MATCHES,
+    ):
+        """
+        :param index: индекс эластика
+        :param fields: поля _source, нужные для подсказки
+        :param to_suggestion: подсказка из id и _source документа, None - документ не подсказывается
+        :param max_size: максимальное количество подсказок в ответе
+        :param precomputed_min_matches: для префиксов, под которые попадает больше документов, подсказки считаются заранее
+        """
+        self.index = index
+        self.fields = fields
+        self.to_suggestion = to_suggestion
+        self.max_size = max_size
+        self.precomputed_min_matches = precomputed_min_matches
+        self._docs: Dict[str, Suggestion] = {}
+        self._entries: List[Tuple[str, str]] = []
+        self._top: Dict[str, List[str]] = {}
+        self.loaded = False
+
+    def suggest(self, prefix: str, limit: Optional[int] = None) -> List[Suggestion]:
+        """
+        Лучшие по score документы, текст которых (или одно из слов текста) начинается с prefix.
+
+        :param prefix:
+        :param limit:
+        :return:
+        """
+        limit = min(limit or self.max_size, self.max_size)
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        if prefix in self._top:
+            ids = self._top[prefix][:limit]
+        else:
+            ids = self._best(self._range_ids(prefix), limit)
+        return [self._docs[id_] for id_ in ids]
+
+    async def load(self, elastic: AsyncElasticsearch) -> None:
+        """
+        Загружает все документы индекса страницами по SUGGEST_LOAD_BATCH_SIZE и атомарно подменяет индекс.
+
+        :param elastic:
+        :return:
+        """
+        docs = await self._fetch_docs(elastic)
+
+        # Построение индекса - чистый питон и из-за GIL в потоке не ускоряется. Поток нужен только для того,
+        # чтобы event loop воркера между переключениями потоков продолжал обслуживать запросы
+        entries, top = await asyncio.get_event_loop().run_in_executor(None, self._build, docs)
+        self._docs, self._entries, self._top = docs, entries, top
+        self.loaded = True
+        logger.info("Индекс подсказок %s загружен: %s документов, %s ключей", self.index, len(docs), len(entries))
+
+    async def update(self, elastic: AsyncElasticsearch, ids: List[str]) -> None:
+        """
+        Точечно обновляет документы ids: перечитывает их из эластика, удалённые убирает из индекса.
+
+        :param elastic:
+        :param ids:
+        :return:
+        """
+        if not self.loaded or not ids:
+            return
+        response = await elastic.mget(body={"ids": ids}, index=self.index, _source_includes=self.fields)
+        for doc in response["docs"]:
+            self._update_doc(doc)
+
+    async def refresh_forever(self, elastic: AsyncElasticsearch, interval: float) -> None:
+        """
+        Загружает индекс сразу и затем перезагружает раз в interval секунд.
+        Ошибка загрузки не роняет цикл: до следующей попытки используется предыдущая версия индекса.
+
+        :param elastic:
+        :param interval:
+        :return:
+        """
+        while True:
+            try:
+                await self.load(elastic)
+            except Exception as err:
+                logger.warning("Не удалось загрузить индекс подсказок %s: %s", self.index, err)
+            await asyncio.sleep(interval if self.loaded else min(interval, 5))
+
+    async def _fetch_docs(self, elastic: AsyncElasticsearch) -> Dict[str, Suggestion]:
+        """
+        Забирает подсказки по всем документам индекса страницами по SUGGEST_LOAD_BATCH_SIZE.
+
+        :param elastic:
+        :return: подсказки по id документов
+        """
+        docs: Dict[str, Suggestion] = {}
+        search_after = None
+        while True:
+            body = {
+                "query": {"match_all": {}},
+                "size": SUGGEST_LOAD_BATCH_SIZE,
+                "sort": [{"id": "asc"}],
+                "_source": {"includes": self.fields},
+            }
+            if search_after:
+                body["search_after"] = search_after
+            response = await elastic.search(index=self.index, body=body)
+            hits = response["hits"]["hits"]
+            suggestions = (self.to_suggestion(hit["_id"], hit["_source"]) for hit in hits)
+            docs.update((suggestion.id, suggestion) for suggestion in suggestions if suggestion is not None)
+            if len(hits) < SUGGEST_LOAD_BATCH_SIZE:
+                return docs
+            search_after = hits[-1]["sort"]
+
+    def _update_doc(self, doc: dict) -> None:
+        """
+        Заменяет в индексе документ из ответа mget: прежние ключи удаляются, ненайденный документ не добавляется.
+
+        :param doc: документ из ответа mget
+        :return:
+        """
+        old = self._docs.get(doc["_id"])
+        old_keys = self._remove(doc["_id"])
+        new = self.to_suggestion(doc["_id"], doc["_source"]) if doc.get("found") else None
+        new_keys = self._add(new) if new is not None else []
+        self._refresh_top(doc["_id"], old, new, _key_prefixes(old_keys), _key_prefixes(new_keys))
+
+    def _refresh_top(
+        self,
+        id_: str,
+        old: Optional[Suggestion],
+        new: Optional[Suggestion],
+        old_prefixes: Set[str],
+        new_prefixes: Set[str],
+    ) -> None:
+        """
+        Обновляет заранее посчитанные подсказки по префиксам ключей изменённого документа.
+        Подсказки для новых больших префиксов появятся при полной загрузке.
+
+        :param id_:
+        :param old: прежняя подсказка документа
+        :param new: новая подсказка документа, None - документ удалён
+        :param old_prefixes: префиксы прежних ключей документа
+        :param new_prefixes: префиксы новых ключей документа
+        :return:
+        """
+        moved_down = new is None or (old is not None and _rank(new) > _rank(old))
+        for prefix in (old_prefixes | new_prefixes) & self._top.keys():
+            top = self._updated_top(prefix, id_, prefix in new_prefixes, moved_down)
+            if top:
+                self._top[prefix] = top
+            else:
+                self._top.pop(prefix, None)
+
+    def _updated_top(self, prefix: str, id_: str, matches: bool, moved_down: bool) -> List[str]:
+        """
+        Подсказки префикса после изменения документа: документ вставляется в список или убирается из него.
+        Диапазон ключей перебирается, только если документ ушёл из заполненного списка или опустился в нём:
+        его место может занять документ за пределами списка.
+
+        :param prefix:
+        :param id_:
+        :param matches: документ подходит под префикс после изменения
+        :param moved_down: документ стал хуже по score или удалён
+        :return:
+        """
+        top = self._top[prefix]
+        if id_ in top and len(top) >= self.max_size and (moved_down or not matches):
+            return self._best(self._range_ids(prefix), self.max_size)
+        candidates = [other for other in top if other != id_]
+        if matches:
+            candidates.append(id_)
+        return self._best(candidates, self.max_size)
+
+    def _add(self, suggestion: Suggestion) -> List[str]:
+        self._docs[suggestion.id] = suggestion
+        keys = suggestion_keys(suggestion.text)
+        for key in keys:
+            insort(self._entries, (key, suggestion.id))
+        return keys
+
+    def _remove(self, id_: str) -> List[str]:
+        suggestion = self._docs.pop(id_, None)
+        if suggestion is None:
+            return []
+        keys = suggestion_keys(suggestion.text)
+        for key in keys:
+            position = bisect_left(self._entries, (key, id_))
+            if position < len(self._entries) and self._entries[position] == (key, id_):
+                del self._entries[position]
+        return keys
+
+    def _range_ids(self, prefix: str) -> Iterable[str]:
+        return {id_ for _, id_ in _prefix_range(self._entries, prefix)}
+
+    def _best(self, ids: Iterable[str], limit: int, docs: Optional[Dict[str, Suggestion]] = None) -> List[str]:
+        docs = self._docs if docs is None else docs
+        return heapq.nsmallest(limit, ids, key=lambda id_: _rank(docs[id_]))
+
+    def _build(self, docs: Dict[str, Suggestion]) -> Tuple[List[Tuple[str, str]], Dict[str, List[str]]]:
+        """
+        Строит отсортированный массив ключей и заранее посчитанные подсказки.
+        Подсказки считаются для префиксов, продолжающих "большие" префиксы (пустой префикс большой).
+        Префиксы наращиваются по символу, пока под них попадает больше precomputed_min_matches документов.
+
+        :param docs:
+        :return:
+        """
+        entries = sorted((key, doc.id) for doc in docs.values() for key in suggestion_keys(doc.text))
+        top: Dict[str, List[str]] = {}
+        large = [""]
+        while large:
+            large = [prefix for parent in large for prefix in self._precompute_children(entries, docs, parent, top)]
+        return entries, top
+
+    def _precompute_children(
+        self,
+        entries: List[Tuple[str, str]],
+        docs: Dict[str, Suggestion],
+        parent: str,
+        top: Dict[str, List[str]],
+    ) -> List[str]:
+        """
+        Считает подсказки для префиксов на символ длиннее parent и дописывает их в top.
+
+        :param entries: отсортированный массив ключей
+        :param docs:
+        :param parent: большой префикс
+        :param top:
+        :return: большие префиксы среди посчитанных
+        """
+        large = []
+        for prefix, ids in _child_prefixes(entries, parent).items():
+            top[prefix] = self._best(ids, self.max_size, docs)
+            if len(ids) > self.precomputed_min_matches:
+                large.append(prefix)
+        return large
+
+
+def _rank(suggestion: Suggestion) -> Tuple[float, str]:
+    # Порядок подсказок: по убыванию score, при равном score - по тексту
+    return -(suggestion.score or 0), suggestion.text
+
+
+def _key_prefixes(keys: Iterable[str]) -> Set[str]:
+    return {key[:length] for key in keys for length in range(1, len(key) + 1)}
+
+
+def _child_prefixes(entries: List[Tuple[str, str]], parent: str) -> Dict[str, Set[str]]:
+    # id документов по префиксам на символ длиннее parent
+    children: Dict[str, Set[str]] = {}
+    for key, id_ in _prefix_range(entries, parent):
+        if len(key) > len(parent):
+            children.setdefault(key[: len(parent) + 1], set()).add(id_)
+    return children
+
+
+def _prefix_range(entries: List[Tuple[str, str]], prefix: str) -> List[Tuple[str, str]]:
+    start = bisect_left(entries, (prefix,))
+    end = bisect_left(entries, (prefix + KEY_END,), lo=start)
+    return entries[start:end]
+
+
+def film_suggestion(id_: str, source: dict) -> Optional[Suggestion]:
+    if not source.get("title"):
+        return None
+    return Suggestion(id=id_, text=source["title"], score=source.get("imdb_rating"))
+
+
+def person_suggestion(id_: str, source: dict) -> Optional[Suggestion]:
+    if not source.get("fullname"):
+        return None
+    return Suggestion(id=id_, text=source["fullname"], score=len(source.get("film_ids") or []))
+
+
+film_suggest = SuggestIndex("movies", ["title", "imdb_rating"], film_suggestion)
+person_suggest = SuggestIndex("person", ["fullname", "film_ids"], person_suggestion)
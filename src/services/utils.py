@@ -1,25 +1,29 @@
-async def flatten_json(obj):
+import hashlib
+from typing import Any
+
+import orjson
+
+
+def canonical_dumps(obj: Any) -> bytes:
+    """
+    Каноническая сериализация: ключи словарей отсортированы, типы значений сохраняются
+    (1 и "1" дают разный результат). Эквивалентные запросы сериализуются одинаково
+    независимо от порядка ключей.
+
+    :param obj:
+    :return:
+    """
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+
+
+def hash_body(obj: Any) -> str:
     """
-    "Плющит" входной объект.
+    Хеш фиксированной длины от канонической сериализации объекта.
 
     Пример работы:
-    {'a': {'b': 'c'}} -> ['a', 'b', 'c']
+    {'a': 1, 'b': 2} и {'b': 2, 'a': 1} -> один и тот же хеш
 
     :param obj:
     :return:
     """
-    body_list = []
-
-    async def flatten(x):
-        if isinstance(x, dict):
-            for a in x:
-                body_list.append(a)
-                await flatten(x[a])
-        elif isinstance(x, list):
-            for a in x:
-                await flatten(a)
-        else:
-            body_list.append(x)
-
-    await flatten(obj)
-    return body_list
+    return hashlib.blake2b(canonical_dumps(obj), digest_size=16).hexdigest()
@@ -1,3 +1,8 @@
 PERSON_NOT_FOUND = "person not found"
 GENRE_NOT_FOUND = "genre not found"
 FILM_NOT_FOUND = "film not found"
+INVALID_CURSOR = "invalid cursor"
+CURSOR_EXPIRED = "cursor expired"
+UNKNOWN_FIELDS = "unknown fields"
+ELASTIC_UNAVAILABLE = "search backend is temporarily unavailable"
+SUGGEST_NOT_READY = "suggestions are not loaded yet"
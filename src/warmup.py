@@ -0,0 +1,224 @@
+"""
+Прогрев кеша после деплоя или сброса redis: список жанров, начало выдачи фильмов по рейтингу
+для каждого жанра и без фильтра, карточки этих фильмов и самые частые поисковые запросы.
+
+Запускается при старте сервера (WARMUP_ON_STARTUP=true) или отдельной командой:
+python -m warmup --concurrency 4
+"""
+import argparse
+import asyncio
+import logging
+import logging.config
+from typing import Dict, List, Optional, Tuple
+
+from aioredis import Redis
+from elasticsearch import AsyncElasticsearch
+
+from api.utils import source_fields
+from api.v1.film import build_film_search_body
+from core import config
+from core.logger import LOGGING
+from db.elastic import create_elastic
+from db.redis import create_redis
+from models.film_response import ShortFilmResponse
+from models.genre import Genre
+from services.base_service import BaseService
+from services.cache_entry import SearchPage
+from services.film import FilmService, get_film_service
+from services.genre import get_genre_service
+from services.person import get_person_service
+from services.popular_queries import PopularQueries
+
+logger = logging.getLogger(__name__)
+
+# Сортировки выдачи film_filter, которые прогреваются: по умолчанию и от лучших фильмов к худшим
+LISTING_SORTS = ("imdb_rating", "-imdb_rating")
+WARMUP_LOCK_KEY = f"{config.CACHE_KEY_PREFIX}:warmup:lock"
+
+
+async def search_in_batches(service: BaseService, bodies: List[dict], semaphore: asyncio.Semaphore) -> List[SearchPage]:
+    """
+    Выполняет поисковые запросы пачками по WARMUP_BATCH_SIZE (один msearch на пачку),
+    одновременно не больше пачек, чем позволяет semaphore.
+
+    :param service:
+    :param bodies:
+    :param semaphore:
+    :return: страницы в порядке bodies
+    """
+
+    async def search_batch(batch: List[dict]) -> List[SearchPage]:
+        async with semaphore:
+            return await service.search_many(batch)
+
+    batches = [bodies[i : i + config.WARMUP_BATCH_SIZE] for i in range(0, len(bodies), config.WARMUP_BATCH_SIZE)]
+    results = await asyncio.gather(*[search_batch(batch) for batch in batches])
+    return [page for batch in results for page in batch]
+
+
+async def warm_film_listings(
+    film_service: FilmService,
+    genres: List[Genre],
+    top_n: int,
+    semaphore: asyncio.Semaphore,
+) -> Tuple[int, List[str]]:
+    """
+    Прогревает первые top_n фильмов выдачи film_filter для каждого жанра и без фильтра.
+    Страницы после первой запрашиваются так же, как их запрашивает клиент - курсором из предыдущей страницы,
+    поэтому прогретые ключи совпадают с ключами запросов клиентов.
+
+    :param film_service:
+    :param genres:
+    :param top_n:
+    :param semaphore:
+    :return: количество прогретых страниц и id фильмов на них
+    """
+    listings: List[Tuple[str, Optional[Genre], int]] = [(sort, genre, 0) for sort in LISTING_SORTS for genre in [None, *genres]]
+    cursors: List[Optional[dict]] = [None] * len(listings)
+    pages_count = 0
+    film_ids: List[str] = []
+
+    while listings:
+        bodies = [
+            await build_film_search_body(None, None, None, sort, genre, cursor)
+            for (sort, genre, _), cursor in zip(listings, cursors)
+        ]
+        pages = await search_in_batches(film_service, bodies, semaphore)
+        pages_count += len(pages)
+
+        next_listings, next_cursors = [], []
+        for (sort, genre, collected), page in zip(listings, pages):
+            film_ids.extend(film.id for film in page.docs)
+            collected += len(page.docs)
+            if page.next_search_after and collected < top_n:
+                next_listings.append((sort, genre, collected))
+                next_cursors.append({"search_after": page.next_search_after})
+        listings, cursors = next_listings, next_cursors
+
+    return pages_count, list(dict.fromkeys(film_ids))
+
+
+async def warm_film_details(film_service: FilmService, film_ids: List[str], semaphore: asyncio.Semaphore) -> int:
+    """
+    Прогревает карточки фильмов пачками по BATCH_MAX_SIZE: MGET в redis и mget в эластик на пачку.
+    Карточки прогреваются целиком и в проекции ShortFilmResponse, которую берёт выдача из рейтингов
+    (film_ranking_page): у проекции свои ключи кеша.
+
+    :param film_service:
+    :param film_ids:
+    :param semaphore:
+    :return: количество найденных фильмов
+    """
+
+    async def load_batch(batch: List[str], fields: Optional[List[str]]) -> int:
+        async with semaphore:
+            return len(await film_service.get_many(batch, fields=fields))
+
+    batches = [film_ids[i : i + config.BATCH_MAX_SIZE] for i in range(0, len(film_ids), config.BATCH_MAX_SIZE)]
+    counts = await asyncio.gather(
+        *[load_batch(batch, fields) for fields in (None, source_fields(ShortFilmResponse)) for batch in batches]
+    )
+    return sum(counts[: len(batches)])
+
+
+async def warm_popular_queries(service: BaseService, limit: int, semaphore: asyncio.Semaphore) -> int:
+    """
+    Прогревает самые частые поисковые запросы по индексу сервиса.
+
+    :param service:
+    :param limit:
+    :param semaphore:
+    :return: количество прогретых запросов
+    """
+    bodies = await PopularQueries.top(service.redis, service.index, limit)
+    await search_in_batches(service, bodies, semaphore)
+    return len(bodies)
+
+
+async def warm_up(
+    redis: Redis,
+    elastic: AsyncElasticsearch,
+    top_n: int = config.WARMUP_TOP_N,
+    popular_limit: int = config.WARMUP_POPULAR_QUERIES,
+    concurrency: int = config.WARMUP_CONCURRENCY,
+) -> Dict[str, int]:
+    """
+    Прогревает кеш. Используются те же экземпляры сервисов, что и в эндпоинтах,
+    поэтому внутри сервера заполняется и локальный кеш воркера.
+
+    :param redis:
+    :param elastic:
+    :param top_n: сколько фильмов с начала каждой выдачи прогревать
+    :param popular_limit: сколько частых запросов прогревать на индекс
+    :param concurrency: одновременных запросов в эластик
+    :return: статистика прогрева
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    # Фабрики кешируются по аргументам, а FastAPI вызывает их с именованными: позиционный вызов дал бы другой экземпляр
+    film_service = get_film_service(redis=redis, elastic=elastic)
+    genre_service = get_genre_service(redis=redis, elastic=elastic)
+    person_service = get_person_service(redis=redis, elastic=elastic)
+
+    genres = await genre_service.search_all()
+    # Жанры по id нужны фильтру выдачи, пока справочник жанров в памяти не загружен
+    await genre_service.get_many([genre.id for genre in genres])
+    listing_pages, film_ids = await warm_film_listings(film_service, genres, top_n, semaphore)
+    films = await warm_film_details(film_service, film_ids, semaphore)
+    film_queries, person_queries = await asyncio.gather(
+        warm_popular_queries(film_service, popular_limit, semaphore),
+        warm_popular_queries(person_service, popular_limit, semaphore),
+    )
+
+    stats = {
+        "genres": len(genres),
+        "listing_pages": listing_pages,
+        "films": films,
+        "film_queries": film_queries,
+        "person_queries": person_queries,
+    }
+    logger.info("Кеш прогрет: %s", stats)
+    return stats
+
+
+async def warm_up_on_startup(redis: Redis, elastic: AsyncElasticsearch) -> None:
+    """
+    Прогрев при старте сервера. Воркеры стартуют одновременно, поэтому прогревает только тот,
+    кто первым взял блокировку в redis. Блокировка не снимается и истекает сама:
+    повторный прогрев возможен не раньше, чем через WARMUP_LOCK_EXPIRE_IN_SECONDS.
+
+    :param redis:
+    :param elastic:
+    :return:
+    """
+    acquired = await redis.set(WARMUP_LOCK_KEY, "1", expire=config.WARMUP_LOCK_EXPIRE_IN_SECONDS, exist=Redis.SET_IF_NOT_EXIST)
+    if not acquired:
+        logger.info("Кеш уже прогревается другим воркером")
+        return
+    try:
+        await warm_up(redis, elastic)
+    except Exception as err:
+        logger.warning("Не удалось прогреть кеш: %s", err, exc_info=True)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Прогрев кеша redis")
+    parser.add_argument("--top-n", type=int, default=config.WARMUP_TOP_N, help="фильмов с начала каждой выдачи")
+    parser.add_argument("--popular", type=int, default=config.WARMUP_POPULAR_QUERIES, help="частых запросов на индекс")
+    parser.add_argument("--concurrency", type=int, default=config.WARMUP_CONCURRENCY, help="одновременных запросов в эластик")
+    return parser.parse_args()
+
+
+async def main(args: argparse.Namespace) -> None:
+    redis = await create_redis()
+    elastic = create_elastic()
+    try:
+        await warm_up(redis, elastic, top_n=args.top_n, popular_limit=args.popular, concurrency=args.concurrency)
+    finally:
+        redis.close()
+        await redis.wait_closed()
+        await elastic.close()
+
+
+if __name__ == "__main__":
+    logging.config.dictConfig(LOGGING)
+    asyncio.run(main(parse_args()))
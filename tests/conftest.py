@@ -0,0 +1,88 @@
+"""
+Общие фикстуры тестов: приложение и сервисы работают поверх in-process заменителей redis и эластика
+из benchmarks.fakes, docker не нужен. Асинхронные тесты выполняются в собственном event loop через asyncio.run.
+"""
+import asyncio
+import inspect
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "src"), str(ROOT)]
+
+from benchmarks.corpus import generate_corpus  # noqa: E402
+from benchmarks.fakes import FakeElasticsearch, FakeRedis  # noqa: E402
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem: pytest.Function):
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    kwargs = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**kwargs))
+    return True
+
+
+@pytest.fixture
+def corpus() -> dict:
+    return generate_corpus(films=60, persons=30, seed=7)
+
+
+@pytest.fixture
+def fake_redis() -> FakeRedis:
+    return FakeRedis()
+
+
+@pytest.fixture
+def fake_es(corpus: dict) -> FakeElasticsearch:
+    return FakeElasticsearch(corpus)
+
+
+@pytest.fixture
+def film_service(fake_redis: FakeRedis, fake_es: FakeElasticsearch):
+    from services.film import FilmService
+
+    return FilmService(fake_redis, fake_es)
+
+
+@pytest.fixture(autouse=True)
+def worker_state():
+    """
+    Сбрасывает состояние воркера, общее для всех запросов: сервисы, предохранители, ограничители и справочники.
+    """
+    from services.circuit_breaker import elastic_breakers
+    from services.concurrency_limiter import elastic_limiters
+    from services.film import get_film_service
+    from services.genre import get_genre_service
+    from services.genre_catalog import genre_catalog
+    from services.person import get_person_service
+
+    for factory in (get_film_service, get_genre_service, get_person_service):
+        factory.cache_clear()
+    elastic_breakers._breakers.clear()
+    elastic_limiters._limiters.clear()
+    genre_catalog.__init__()
+    yield
+
+
+@pytest.fixture
+def app(fake_redis: FakeRedis, fake_es: FakeElasticsearch):
+    """
+    Приложение из main.py без событий startup: фоновые задачи не запускаются, стек middleware
+    (и кеш ответов в нём) собирается заново.
+    """
+    import main
+    from db import elastic, redis
+
+    redis.redis = fake_redis
+    elastic.es = fake_es
+    main.app.middleware_stack = main.app.build_middleware_stack()
+    return main.app
+
+
+@pytest.fixture
+def client(app) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
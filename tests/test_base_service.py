@@ -0,0 +1,119 @@
+import asyncio
+import time
+from functools import partial
+
+import pytest
+
+from core.config import NEGATIVE_CACHE_EXPIRE_IN_SECONDS
+from services import base_service
+from services.cache_entry import SearchPage
+from services.circuit_breaker import ElasticUnavailableError, elastic_breakers
+
+
+def expire_immediately(service) -> None:
+    # Записи сразу старше hard TTL, но ещё CACHE_STALE_IF_ERROR_IN_SECONDS лежат в redis
+    service.cache_soft_ttl = service.cache_hard_ttl = 0
+
+
+async def test_get_many_serves_expired_entries_when_breaker_is_open(film_service, corpus):
+    expire_immediately(film_service)
+    ids = list(corpus["movies"])[:3]
+    assert [film.id for film in await film_service.get_many(ids)] == ids
+
+    elastic_breakers.get("movies")._open()
+    assert [film.id for film in await film_service.get_many(ids)] == ids
+
+
+async def test_get_many_raises_when_expired_entries_do_not_cover_missing_ids(film_service, corpus):
+    expire_immediately(film_service)
+    ids = list(corpus["movies"])[:3]
+    await film_service.get_many(ids[:2])
+
+    elastic_breakers.get("movies")._open()
+    with pytest.raises(ElasticUnavailableError):
+        await film_service.get_many(ids)
+
+
+async def test_search_many_serves_expired_pages_when_breaker_is_open(film_service):
+    expire_immediately(film_service)
+    bodies = [{"query": {"match_all": {}}, "size": 5, "sort": [{"id": "asc"}]}, {"query": {"match_all": {}}, "size": 2}]
+    pages = await film_service.search_many(bodies)
+    assert [len(page.docs) for page in pages] == [5, 2]
+
+    elastic_breakers.get("movies")._open()
+    stale = await film_service.search_many(bodies)
+    assert [[doc.id for doc in page.docs] for page in stale] == [[doc.id for doc in page.docs] for page in pages]
+
+
+async def test_search_many_returns_empty_page_for_unknown_body(film_service):
+    pages = await film_service.search_many([{"query": {"term": {"id": "missing"}}}])
+    assert pages == [SearchPage(docs=[])]
+
+
+async def test_concurrent_misses_share_one_elastic_call(film_service, fake_es, corpus):
+    fake_es.latency = 0.01
+    id_ = next(iter(corpus["movies"]))
+    films = await asyncio.gather(*[film_service.get_by_id(id_) for _ in range(5)])
+    assert {film.id for film in films} == {id_}
+    assert fake_es.calls == 1
+
+
+async def test_stale_entry_is_served_and_refreshed_in_background(film_service, fake_es, corpus):
+    film_service.cache_soft_ttl = 0
+    id_ = next(iter(corpus["movies"]))
+    await film_service.get_by_id(id_)
+    assert fake_es.calls == 1
+
+    fake_es.latency = 0.01
+    films = await asyncio.gather(film_service.get_by_id(id_), film_service.get_by_id(id_))
+    assert {film.id for film in films} == {id_}
+    await asyncio.sleep(0.03)
+    assert fake_es.calls == 2
+
+
+async def test_miss_does_not_join_refresh_skipped_under_foreign_lock(film_service, fake_redis, corpus, monkeypatch):
+    monkeypatch.setattr(base_service, "CACHE_LOCK_ENABLED", True)
+    monkeypatch.setattr(base_service, "CACHE_LOCK_EXPIRE_IN_MS", 200)
+    monkeypatch.setattr(base_service, "CACHE_LOCK_POLL_INTERVAL_IN_MS", 10)
+    id_ = next(iter(corpus["movies"]))
+    await film_service.get_by_id(id_)
+    key = film_service._generate_redis_key("movies", id_)
+    # Блокировку держит другой воркер, фоновое обновление этого воркера ничего не загружает
+    await fake_redis.set(f"lock::{key}", "other", pexpire=200, exist=fake_redis.SET_IF_NOT_EXIST)
+
+    fetch = partial(film_service._get_by_id_from_elastic, id_, "movies", None)
+    film_service._refresh_in_background(key, fetch)
+    await asyncio.sleep(0)
+    film = await film_service._load_on_miss(key, fetch, film_service._get_from_cache_by_id)
+    assert film is not None and film.id == id_
+
+
+async def test_stale_batch_is_refreshed_with_one_mget(film_service, fake_es, corpus):
+    film_service.cache_soft_ttl = 0
+    ids = list(corpus["movies"])[:20]
+    await film_service.get_many(ids)
+    assert fake_es.calls == 1
+
+    fake_es.latency = 0.01
+    films = await asyncio.gather(film_service.get_many(ids), film_service.get_many(ids))
+    assert [[film.id for film in batch] for batch in films] == [ids, ids]
+    await asyncio.sleep(0.03)
+    assert fake_es.calls == 2
+
+
+async def test_missing_id_is_cached_as_negative_on_short_ttl(film_service, fake_redis, fake_es):
+    assert await film_service.get_by_id("missing") is None
+    assert await film_service.get_by_id("missing") is None
+    assert fake_es.calls == 1
+
+    key = film_service._generate_redis_key("movies", "missing")
+    entry = film_service.local_cache.get(key)
+    assert entry.obj is None and entry.soft_expire_at == entry.hard_expire_at
+    assert entry.hard_expire_at - time.time() <= NEGATIVE_CACHE_EXPIRE_IN_SECONDS < film_service.cache_hard_ttl
+    assert fake_redis.expire_at[key] - time.time() <= NEGATIVE_CACHE_EXPIRE_IN_SECONDS
+
+    # Истёкшая отрицательная запись снова загружается из эластика
+    fake_redis.expire_at[key] = time.time()
+    film_service.local_cache.clear()
+    assert await film_service.get_by_id("missing") is None
+    assert fake_es.calls == 2
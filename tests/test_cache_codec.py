@@ -0,0 +1,69 @@
+import json
+import math
+
+import orjson
+import pytest
+
+from models.film import Film
+from services import cache_codec
+from services.cache_codec import FLAG_ZLIB, HEADER, HEADER_V1, KIND_OBJ, CacheDecodeError, decode_cache_data, encode_cache_data
+from services.cache_entry import SearchPage
+
+FILMS = [Film(id=f"f{i}", title=f"Film {i}", imdb_rating=i / 2, genre=["Drama"]) for i in range(3)]
+
+
+@pytest.fixture(params=[False, True], ids=["plain", "zlib"])
+def compress(request, monkeypatch) -> bool:
+    if request.param:
+        monkeypatch.setattr(cache_codec, "CACHE_COMPRESS_MIN_BYTES", 0)
+    return request.param
+
+
+@pytest.mark.parametrize(
+    "obj",
+    [FILMS[0], FILMS, SearchPage(docs=FILMS, next_search_after=[1.0, "f2"], aggregations={"genre": {"buckets": []}}), None],
+    ids=["obj", "list", "page", "none"],
+)
+def test_round_trip(obj, compress):
+    data = encode_cache_data(obj, 10.0, 20.0)
+    assert bool(HEADER.unpack_from(data)[1] & FLAG_ZLIB) == (compress and obj is not None)
+    assert decode_cache_data(data, Film) == (obj, 10.0, 20.0)
+
+
+def test_decodes_version_1():
+    data = HEADER_V1.pack(1, 0, KIND_OBJ, 10.0) + orjson.dumps(FILMS[0].dict())
+    assert decode_cache_data(data, Film) == (FILMS[0], 10.0, math.inf)
+
+
+def test_decodes_legacy_json():
+    page = {"result": [film.json() for film in FILMS], "search_after": [1.0, "f2"]}
+    assert decode_cache_data(FILMS[0].json().encode(), Film) == (FILMS[0], math.inf, math.inf)
+    assert decode_cache_data(b"10.0|" + json.dumps(page).encode(), Film) == (
+        SearchPage(docs=FILMS, next_search_after=[1.0, "f2"]),
+        10.0,
+        math.inf,
+    )
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        encode_cache_data(FILMS[0], 10.0, 20.0)[: HEADER.size - 4],
+        HEADER.pack(2, 0, 9, 10.0, 20.0) + orjson.dumps(FILMS[0].dict()),
+        HEADER.pack(2, FLAG_ZLIB, KIND_OBJ, 10.0, 20.0) + b"not zlib",
+        b"\x07garbage",
+    ],
+    ids=["truncated", "unknown_kind", "corrupt_zlib", "unknown_version"],
+)
+def test_rejects_corrupt_data(data):
+    with pytest.raises(CacheDecodeError):
+        decode_cache_data(data, Film)
+
+
+async def test_corrupt_redis_entry_is_a_miss(film_service, fake_redis, fake_es, corpus):
+    id_ = next(iter(corpus["movies"]))
+    await fake_redis.set(film_service._generate_redis_key("movies", id_), b"\x07garbage")
+
+    film = await film_service.get_by_id(id_)
+    assert film.id == id_
+    assert fake_es.calls == 1
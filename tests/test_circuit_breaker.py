@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from elasticsearch import NotFoundError
+
+from services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+async def fail():
+    raise asyncio.TimeoutError()
+
+
+async def succeed():
+    return "ok"
+
+
+async def not_found():
+    raise NotFoundError(404, "not_found")
+
+
+def make_breaker() -> CircuitBreaker:
+    return CircuitBreaker("test", window=4, min_calls=2, failure_rate=0.5, open_seconds=0.05, half_open_calls=1)
+
+
+async def test_opens_on_failure_rate_and_rejects_calls():
+    breaker = make_breaker()
+    with pytest.raises(asyncio.TimeoutError):
+        await breaker.call(fail)
+    assert breaker.state == CLOSED
+    with pytest.raises(asyncio.TimeoutError):
+        await breaker.call(fail)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(succeed)
+
+
+async def test_half_open_probe_closes_or_reopens():
+    breaker = make_breaker()
+    breaker._open()
+    await asyncio.sleep(0.06)
+    with pytest.raises(asyncio.TimeoutError):
+        await breaker.call(fail)
+    assert breaker.state == OPEN
+
+    await asyncio.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.release_probe()
+    assert await breaker.call(succeed) == "ok"
+    assert breaker.state == CLOSED
+
+
+async def test_client_errors_do_not_open_breaker():
+    breaker = make_breaker()
+    for _ in range(4):
+        with pytest.raises(NotFoundError):
+            await breaker.call(not_found)
+    assert breaker.state == CLOSED
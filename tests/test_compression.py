@@ -0,0 +1,35 @@
+import pytest
+
+from api.compression import ENCODERS, choose_encoding
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        (None, None),
+        ("identity", None),
+        ("gzip;q=0", None),
+        ("*;q=0", None),
+        ("GZIP", "gzip"),
+        ("gzip;q=0.1, deflate", "gzip"),
+        ("gzip;q=0.1, br;q=abc", "gzip"),
+    ],
+)
+def test_choose_encoding(accept_encoding, expected):
+    assert choose_encoding(accept_encoding) == expected
+
+
+def test_equal_quality_prefers_server_order():
+    assert choose_encoding("*") == next(iter(ENCODERS))
+    assert choose_encoding(", ".join(reversed(ENCODERS))) == next(iter(ENCODERS))
+
+
+async def test_compressed_body_matches_plain_body(client):
+    params = {"sort": "-imdb_rating", "page[size]": 50}
+    plain = await client.get("/api/v1/film/", params=params, headers={"Accept-Encoding": "identity"})
+    response = await client.get("/api/v1/film/", params=params, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] != plain.headers["etag"]
+    # httpx распаковывает тело сам
+    assert response.content == plain.content
+    assert response.num_bytes_downloaded < len(plain.content)
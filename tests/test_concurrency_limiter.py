@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from services.circuit_breaker import CircuitOpenError
+from services.concurrency_limiter import AdaptiveLimiter, LimiterRejectedError
+
+
+def make_limiter(**kwargs) -> AdaptiveLimiter:
+    params = {
+        "latency_target": 0.05,
+        "initial_limit": 4,
+        "min_limit": 1,
+        "max_limit": 10,
+        "backoff": 0.5,
+        "queue_size": 1,
+        "queue_timeout": 0.05,
+    }
+    return AdaptiveLimiter("test", **{**params, **kwargs})
+
+
+async def sleep(seconds: float) -> str:
+    await asyncio.sleep(seconds)
+    return "ok"
+
+
+async def timeout():
+    raise asyncio.TimeoutError()
+
+
+async def test_fast_calls_increase_limit_additively():
+    limiter = make_limiter()
+    for _ in range(4):
+        assert await limiter.call(lambda: sleep(0)) == "ok"
+    assert 4.9 < limiter.limit < 5
+    assert limiter.in_flight == 0
+
+
+async def test_overload_decreases_limit_once_per_generation():
+    limiter = make_limiter()
+    # Все вызовы начаты до первого уменьшения: лимит уменьшается один раз
+    await asyncio.gather(*[limiter.call(lambda: sleep(0.06)) for _ in range(4)])
+    assert limiter.limit == 2
+
+    with pytest.raises(asyncio.TimeoutError):
+        await limiter.call(timeout)
+    assert limiter.limit == 1
+    with pytest.raises(asyncio.TimeoutError):
+        await limiter.call(timeout)
+    assert limiter.limit == 1
+
+
+async def test_calls_over_limit_queue_and_are_rejected():
+    limiter = make_limiter(initial_limit=1, latency_target=1)
+    running = asyncio.ensure_future(limiter.call(lambda: sleep(0.1)))
+    await asyncio.sleep(0)
+    queued = asyncio.ensure_future(limiter.call(lambda: sleep(0)))
+    await asyncio.sleep(0)
+
+    with pytest.raises(LimiterRejectedError):
+        await limiter.call(lambda: sleep(0))
+    with pytest.raises(LimiterRejectedError):
+        await queued
+    assert await running == "ok"
+    assert limiter.in_flight == 0
+    assert not limiter._waiters
+
+
+async def test_released_slot_goes_to_queued_call():
+    limiter = make_limiter(initial_limit=1, latency_target=1, queue_timeout=1)
+    results = await asyncio.gather(limiter.call(lambda: sleep(0.01)), limiter.call(lambda: sleep(0)))
+    assert results == ["ok", "ok"]
+    assert limiter.in_flight == 0
+
+
+async def test_calls_rejected_by_open_breaker_do_not_change_limit():
+    limiter = make_limiter()
+
+    async def circuit_open():
+        raise CircuitOpenError("test", retry_after=1)
+
+    for _ in range(10):
+        with pytest.raises(CircuitOpenError):
+            await limiter.call(circuit_open)
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
@@ -0,0 +1,53 @@
+import base64
+from http import HTTPStatus
+
+import pytest
+from fastapi import HTTPException
+
+from api.utils import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor([7.5, "film-id"], "pit-1")
+    assert decode_cursor(cursor) == {"search_after": [7.5, "film-id"], "pit": "pit-1"}
+    assert decode_cursor(None) is None
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", base64.urlsafe_b64encode(b'{"search_after": 1}').decode()])
+def test_malformed_cursor_is_bad_request(cursor):
+    with pytest.raises(HTTPException) as err:
+        decode_cursor(cursor)
+    assert err.value.status_code == HTTPStatus.BAD_REQUEST
+
+
+async def walk(client, url: str, params: dict) -> list:
+    pages = []
+    response = await client.get(url, params=params)
+    while True:
+        assert response.status_code == HTTPStatus.OK
+        pages.append(response.json())
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if not cursor:
+            return pages
+        response = await client.get(url, params={**params, "cursor": cursor})
+
+
+async def test_cursor_walks_all_films_and_ends_with_empty_page(client, corpus):
+    # 60 фильмов по 20: последняя полная страница отдаёт курсор, он ведёт на пустую страницу
+    pages = await walk(client, "/api/v1/film/", {"sort": "-imdb_rating", "page[size]": 20})
+    assert [len(page) for page in pages] == [20, 20, 20, 0]
+    assert sorted(film["id"] for page in pages for film in page) == sorted(corpus["movies"])
+
+
+async def test_cursor_for_other_sort_is_bad_request(client):
+    cursor = encode_cursor(["film-id"])
+    response = await client.get("/api/v1/film/", params={"sort": "imdb_rating", "cursor": cursor})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+async def test_cursor_of_closed_point_in_time_is_gone(client, fake_es):
+    response = await client.get("/api/v1/film/", params={"page[size]": 10, "pit": "true"})
+    assert response.status_code == HTTPStatus.OK
+    fake_es._pits.clear()
+    response = await client.get("/api/v1/film/", params={"page[size]": 10, "cursor": response.headers[NEXT_CURSOR_HEADER]})
+    assert response.status_code == HTTPStatus.GONE
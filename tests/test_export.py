@@ -0,0 +1,32 @@
+from http import HTTPStatus
+
+import orjson
+import pytest
+
+from services import base_service
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    # Выгрузка корпуса идёт в несколько страниц
+    monkeypatch.setattr(base_service, "EXPORT_BATCH_SIZE", 7)
+
+
+async def test_export_streams_every_film_as_ndjson(client, fake_es, corpus):
+    response = await client.get("/api/v1/film/export", params={"fields": "id,title"}, headers={"Accept-Encoding": "identity"})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    films = [orjson.loads(line) for line in response.content.splitlines()]
+    assert sorted(film["id"] for film in films) == sorted(corpus["movies"])
+    assert all(set(film) == {"id", "title"} for film in films)
+    assert not fake_es._pits
+
+
+async def test_export_closes_point_in_time_when_abandoned(film_service, fake_es):
+    pages = film_service.export(["id"])
+    assert len(await pages.__anext__()) == 7
+    assert fake_es._pits
+
+    await pages.aclose()
+    assert not fake_es._pits
@@ -0,0 +1,39 @@
+from collections import Counter
+from http import HTTPStatus
+
+
+async def test_film_facets_count_all_films(client, corpus):
+    response = await client.get("/api/v1/film/facets", params={"page[size]": 5})
+    assert response.status_code == HTTPStatus.OK
+    data = response.json()
+
+    assert len(data["result"]) == 5
+    genres = Counter(genre for film in corpus["movies"].values() for genre in film.get("genre") or [])
+    assert {facet["name"]: facet["count"] for facet in data["facets"]["genre"]} == dict(genres)
+    rated = sum(film.get("imdb_rating") is not None for film in corpus["movies"].values())
+    assert sum(facet["count"] for facet in data["facets"]["imdb_rating"]) == rated
+
+
+async def test_film_search_facets_match_search_page(client, corpus):
+    query = next(iter(corpus["movies"].values()))["title"].split()[0]
+    search = await client.get("/api/v1/film/search", params={"query": query})
+    facets = await client.get("/api/v1/film/search/facets", params={"query": query})
+
+    assert facets.status_code == HTTPStatus.OK
+    assert facets.json()["result"] == search.json()
+    assert facets.json()["facets"]["genre"]
+
+
+async def test_list_routes_always_return_list(client):
+    for url, params in (("/api/v1/film/", {"facets": "true"}), ("/api/v1/film/search", {"query": "a", "facets": "true"})):
+        response = await client.get(url, params=params)
+        assert isinstance(response.json(), list)
+
+
+async def test_film_facets_response_is_cached(client, fake_es):
+    await client.get("/api/v1/film/facets")
+    calls = fake_es.calls
+    response = await client.get("/api/v1/film/facets")
+
+    assert response.status_code == HTTPStatus.OK
+    assert fake_es.calls == calls
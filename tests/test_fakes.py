@@ -0,0 +1,34 @@
+"""
+Заменитель эластика должен сортировать так же, как эластик: на нём проверяются выдачи, собранные без эластика.
+"""
+from benchmarks.fakes import FakeElasticsearch
+
+DOCS = {
+    "movies": {
+        "a": {"id": "a", "title": "Star", "imdb_rating": 5.0},
+        "b": {"id": "b", "title": "Star War", "imdb_rating": None},
+        "c": {"id": "c", "title": "War", "imdb_rating": 7.5},
+        "d": {"id": "d", "title": "Love", "imdb_rating": 5.0},
+    }
+}
+
+
+async def search_ids(body: dict) -> list:
+    response = await FakeElasticsearch(DOCS).search(index="movies", body=body)
+    return [hit["_id"] for hit in response["hits"]["hits"]]
+
+
+async def test_missing_values_are_last_in_both_directions():
+    for order, expected in (("asc", ["a", "d", "c", "b"]), ("desc", ["c", "a", "d", "b"])):
+        body = {"sort": [{"imdb_rating": order}, {"id": "asc"}], "size": 10}
+        assert await search_ids(body) == expected
+
+
+async def test_search_after_continues_from_last_sort_values():
+    body = {"sort": [{"imdb_rating": "asc"}, {"id": "asc"}], "size": 10, "search_after": [5.0, "a"]}
+    assert await search_ids(body) == ["d", "c", "b"]
+
+
+async def test_bool_query_filters_and_scores():
+    query = {"bool": {"must": [{"multi_match": {"query": "war"}}], "filter": {"term": {"imdb_rating": 7.5}}}}
+    assert await search_ids({"query": query}) == ["c"]
@@ -0,0 +1,68 @@
+from http import HTTPStatus
+
+import pytest
+
+from api.utils import NEXT_CURSOR_HEADER, encode_cursor
+from api.v1.film import build_film_search_body, ranking_page_bounds
+from models.genre import Genre
+from services.film_ranking import film_rankings
+
+
+@pytest.fixture
+def unrated(corpus) -> list:
+    # Фильмы без рейтинга эластик ставит в конец выдачи при любом направлении сортировки
+    ids = sorted(corpus["movies"])[:2]
+    for id_ in ids:
+        corpus["movies"][id_]["imdb_rating"] = None
+    return ids
+
+
+async def elastic_order(film_service, sort: str, genre) -> list:
+    body = await build_film_search_body(None, None, "1000", sort, genre)
+    page = await film_service.search_page(body)
+    return [film.id for film in page.docs]
+
+
+@pytest.mark.parametrize("sort", ["imdb_rating", "-imdb_rating"])
+async def test_ranking_order_matches_elastic(film_service, fake_redis, fake_es, corpus, unrated, sort):
+    await film_rankings.rebuild(fake_redis, fake_es)
+
+    for genre in [None, *(Genre(**genre) for genre in corpus["genre"].values())]:
+        ranked = await film_rankings.page(fake_redis, sort.startswith("-"), genre.name if genre else None, 0, 1000)
+        assert [id_ for id_, _ in ranked] == await elastic_order(film_service, sort, genre)
+    assert [id_ for id_, rating in ranked if rating is None] == [id_ for id_ in unrated if id_ in dict(ranked)]
+
+
+async def test_ranking_page_matches_elastic_page(client, film_service, fake_redis, fake_es):
+    await film_rankings.rebuild(fake_redis, fake_es)
+    body = await build_film_search_body(None, "2", "10", "-imdb_rating", None)
+    page = await film_service.search_page(body)
+
+    calls = fake_es.calls
+    response = await client.get("/api/v1/film/", params={"sort": "-imdb_rating", "page[number]": 2, "page[size]": 10})
+    assert [film["id"] for film in response.json()] == [film.id for film in page.docs]
+    assert response.headers[NEXT_CURSOR_HEADER] == encode_cursor(page.next_search_after)
+    # Порядок взят из redis: в эластик идёт только mget карточек страницы
+    assert fake_es.calls == calls + 1
+
+
+@pytest.mark.parametrize(
+    "from_, size, bounds",
+    [(None, None, (0, 10)), ("9990", "10", (9990, 10)), ("9991", "10", None), ("0", "1000000", None), ("0", "0", None)],
+)
+def test_ranking_page_bounds(from_, size, bounds):
+    assert ranking_page_bounds(from_, size) == bounds
+
+
+async def test_oversized_page_falls_back_to_elastic(client, fake_redis, fake_es, corpus, monkeypatch):
+    await film_rankings.rebuild(fake_redis, fake_es)
+    pages = []
+
+    async def page(*args):
+        pages.append(args)
+
+    monkeypatch.setattr(film_rankings, "page", page)
+    response = await client.get("/api/v1/film/", params={"sort": "-imdb_rating", "page[size]": 1000000})
+    assert response.status_code == HTTPStatus.OK
+    assert len(response.json()) == len(corpus["movies"])
+    assert not pages
@@ -0,0 +1,87 @@
+import time
+from http import HTTPStatus
+
+import orjson
+
+from api.response_cache import response_doc_ids
+from services.invalidation import CacheInvalidator, add_to_reverse_index, cache_invalidator, reverse_index_key
+
+
+async def test_invalidate_drops_cached_document_everywhere(film_service, fake_redis, corpus):
+    id_ = next(iter(corpus["movies"]))
+    await film_service.get_by_id(id_)
+    key = film_service._generate_redis_key("movies", id_)
+    assert await fake_redis.exists(key)
+
+    changed = []
+
+    async def on_change(ids):
+        changed.extend(ids)
+
+    invalidator = CacheInvalidator()
+    invalidator.track(film_service.local_cache)
+    invalidator.on_change("movies", on_change)
+    assert await invalidator.invalidate(fake_redis, "movies", [id_]) == 1
+
+    assert not await fake_redis.exists(key)
+    assert not await fake_redis.exists(reverse_index_key(id_))
+    assert film_service.local_cache.get(key) is None
+    assert changed == [id_]
+
+
+async def test_invalidate_drops_search_pages_with_document(film_service, fake_redis):
+    body = {"query": {"match_all": {}}, "size": 5, "sort": [{"id": "asc"}]}
+    page = await film_service.search_page(body)
+    key = film_service._generate_redis_key("movies", body)
+
+    await cache_invalidator.invalidate(fake_redis, "movies", [page.docs[-1].id])
+    assert not await fake_redis.exists(key)
+    assert film_service.local_cache.get(key) is None
+
+
+async def test_invalidate_drops_cached_response(client, fake_redis, fake_es, corpus):
+    url = f"/api/v1/film/{next(iter(corpus['movies']))}"
+    assert (await client.get(url)).status_code == HTTPStatus.OK
+    calls = fake_es.calls
+    await client.get(url)
+    assert fake_es.calls == calls
+
+    await cache_invalidator.invalidate(fake_redis, "movies", [url.rsplit("/", 1)[-1]])
+    assert (await client.get(url)).status_code == HTTPStatus.OK
+    assert fake_es.calls == calls + 1
+
+
+async def test_malformed_message_is_ignored(fake_redis):
+    invalidator = CacheInvalidator()
+    await invalidator._handle(fake_redis, b"not json")
+    await invalidator._handle(fake_redis, orjson.dumps({"index": "movies"}))
+
+
+def test_response_doc_ids_collects_path_and_nested_ids():
+    film_id = "0b4e4a2c-5d4f-4f8e-9c1b-2a3d4e5f6a7b"
+    body = orjson.dumps({"id": film_id, "actors": [{"uuid": "p1", "name": "n"}], "genre": [{"id": "g1"}], "title": "t"})
+    assert response_doc_ids(f"/api/v1/person/{film_id}/film", body) == {film_id, "p1", "g1"}
+    assert response_doc_ids("/api/v1/film/", b"not json") == set()
+
+
+async def test_negative_entry_is_not_reverse_indexed(film_service, fake_redis):
+    assert await film_service.get_by_id("bogus-0") is None
+    assert await fake_redis.exists(film_service._generate_redis_key("movies", "bogus-0"))
+    assert not await fake_redis.exists(reverse_index_key("bogus-0"))
+
+
+async def test_reverse_index_keeps_longest_ttl_and_drops_expired_keys(fake_redis):
+    revidx_key = reverse_index_key("doc")
+
+    async def add(key: str, ttl: int) -> float:
+        pipe = fake_redis.pipeline()
+        add_to_reverse_index(pipe, key, ["doc"], ttl)
+        await pipe.execute()
+        return fake_redis.expire_at[revidx_key] - time.time()
+
+    assert 90 < await add("long", 100) <= 100
+    assert 90 < await add("short", 10) <= 100
+    # Ключ "long" истёк: при следующей записи он уходит из индекса
+    fake_redis.data[revidx_key][b"long"] = time.time() - 1
+    assert 190 < await add("longer", 200) <= 200
+    assert set(await fake_redis.zrange(revidx_key)) == {b"short", b"longer"}
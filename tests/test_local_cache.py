@@ -0,0 +1,44 @@
+from prometheus_client import REGISTRY
+
+from services.local_cache import LocalCache, export_local_cache_stats
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = LocalCache(max_entries=2, max_bytes=100, ttl=60)
+    cache.put("a", 1, size=10)
+    cache.put("b", 2, size=10)
+    assert cache.get("a") == 1
+    cache.put("c", 3, size=10)
+    assert cache.get("b") is None
+    cache.put("d", 4, size=95)
+    assert cache.stats()["entries"] == 1
+    assert cache.get("d") == 4
+
+
+def test_too_large_value_drops_previous_entry():
+    cache = LocalCache(max_entries=10, max_bytes=100, ttl=60)
+    cache.put("key", "old", size=10, tags=["doc"])
+    cache.put("key", "new", size=1000)
+    assert cache.get("key") is None
+    assert cache.stats()["bytes"] == 0
+    assert cache.invalidate_tag("doc") == 0
+
+
+def test_invalidate_tag_removes_all_tagged_entries():
+    cache = LocalCache(max_entries=10, max_bytes=100, ttl=60)
+    cache.put("page", [1, 2], size=10, tags=["f1", "f2"])
+    cache.put("details", 1, size=10, tags=["f1"])
+    cache.put("other", 3, size=10, tags=["f3"])
+    assert cache.invalidate_tag("f1") == 2
+    assert cache.get("page") is None
+    assert cache.get("other") == 3
+
+
+def test_named_cache_stats_are_exported_as_gauges():
+    cache = LocalCache(max_entries=10, max_bytes=100, ttl=60, name="test")
+    cache.put("key", 1, size=10)
+    cache.get("key")
+    cache.get("missing")
+    export_local_cache_stats()
+    assert REGISTRY.get_sample_value("local_cache_stats", {"cache": "test", "stat": "hits"}) == 1
+    assert REGISTRY.get_sample_value("local_cache_stats", {"cache": "test", "stat": "bytes"}) == 10
@@ -0,0 +1,20 @@
+from http import HTTPStatus
+
+from prometheus_client import REGISTRY
+
+
+def render_count() -> float:
+    return REGISTRY.get_sample_value("serialization_duration_seconds_count", {"stage": "render", "index": ""}) or 0
+
+
+async def test_response_rendering_is_timed(client, corpus):
+    before = render_count()
+    response = await client.get(f"/api/v1/film/{next(iter(corpus['movies']))}")
+    assert response.status_code == HTTPStatus.OK
+    assert render_count() == before + 1
+
+
+async def test_metrics_endpoint_exports_local_cache_stats(client, corpus):
+    await client.get(f"/api/v1/film/{next(iter(corpus['movies']))}")
+    response = await client.get("/metrics")
+    assert 'local_cache_stats{cache="FilmService",stat="misses"}' in response.text
@@ -0,0 +1,35 @@
+from api.v1.person import expand_films
+from models.person import Person
+
+
+def wrap_mget(monkeypatch, client, requests: list) -> None:
+    # Запоминает аргументы каждого mget клиента
+    mget = client.mget
+
+    async def recording_mget(*args, **kwargs):
+        requests.append((args, kwargs))
+        return await mget(*args, **kwargs)
+
+    monkeypatch.setattr(client, "mget", recording_mget)
+
+
+async def test_expand_films_dedups_ids_in_one_mget(film_service, fake_redis, fake_es, corpus, monkeypatch):
+    first, second = (Person(**person) for person in list(corpus["person"].values())[:2])
+    # Общие фильмы у двух персон и повтор фильма у одной персоны
+    second.film_ids = first.film_ids[:3] + second.film_ids
+    first.film_ids.append(first.film_ids[0])
+    film_ids = {film.id for person in (first, second) for film in person.film_ids}
+    redis_requests, es_requests = [], []
+    wrap_mget(monkeypatch, fake_redis, redis_requests)
+    wrap_mget(monkeypatch, fake_es, es_requests)
+
+    expanded = await expand_films([first, second], film_service)
+
+    assert fake_es.calls == 1
+    assert len(es_requests) == 1
+    assert sorted(es_requests[0][1]["body"]["ids"]) == sorted(film_ids)
+    assert len(redis_requests) == 1
+    assert len(redis_requests[0][0]) == len(film_ids)
+    assert [[film.uuid for film in films] for films in expanded] == [
+        [film.id for film in person.film_ids] for person in (first, second)
+    ]
@@ -0,0 +1,31 @@
+from http import HTTPStatus
+
+
+async def test_conditional_request_is_answered_with_304(client, fake_es, corpus):
+    url = f"/api/v1/film/{next(iter(corpus['movies']))}"
+    response = await client.get(url)
+    assert response.status_code == HTTPStatus.OK
+    etag = response.headers["etag"]
+
+    calls = fake_es.calls
+    response = await client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert fake_es.calls == calls
+
+
+async def test_changed_etag_gets_full_response(client, corpus):
+    url = f"/api/v1/film/{next(iter(corpus['movies']))}"
+    first = await client.get(url)
+    response = await client.get(url, headers={"If-None-Match": '"other"'})
+    assert response.status_code == HTTPStatus.OK
+    assert response.content == first.content
+
+
+async def test_point_in_time_response_is_not_stored(client, fake_es):
+    params = {"page[size]": 5, "pit": "true"}
+    assert (await client.get("/api/v1/film/", params=params)).headers["cache-control"] == "no-store"
+    calls = fake_es.calls
+    await client.get("/api/v1/film/", params=params)
+    assert fake_es.calls > calls
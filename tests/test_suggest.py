@@ -0,0 +1,80 @@
+import pytest
+
+from services import suggest
+from services.suggest import SuggestIndex, film_suggestion, normalize, suggestion_keys
+
+
+def expected(corpus: dict, prefix: str, limit: int) -> list:
+    # Подсказки перебором всех фильмов корпуса
+    films = [
+        (-(film.get("imdb_rating") or 0), film["title"], id_)
+        for id_, film in corpus["movies"].items()
+        if any(key.startswith(normalize(prefix)) for key in suggestion_keys(film["title"]))
+    ]
+    return [id_ for *_, id_ in sorted(films)[:limit]]
+
+
+@pytest.fixture
+def index(monkeypatch) -> SuggestIndex:
+    # Маленькие страницы и порог, чтобы загрузка шла в несколько запросов, а подсказки частично считались заранее
+    monkeypatch.setattr(suggest, "SUGGEST_LOAD_BATCH_SIZE", 7)
+    return SuggestIndex("movies", ["title", "imdb_rating"], film_suggestion, max_size=5, precomputed_min_matches=3)
+
+
+def test_suggestion_keys_start_from_every_word():
+    assert suggestion_keys("Звёздные  войны!") == ["звездные войны", "войны"]
+
+
+async def test_load_matches_full_scan(index, fake_es, corpus):
+    await index.load(fake_es)
+
+    assert index.loaded
+    assert len(index._docs) == len(corpus["movies"])
+    assert index._top
+    for film in list(corpus["movies"].values())[:10]:
+        for prefix in {film["title"][:1], film["title"][:3], film["title"].split()[-1][:2]}:
+            assert [doc.id for doc in index.suggest(prefix)] == expected(corpus, prefix, 5)
+
+
+async def test_update_replaces_and_removes_documents(index, fake_es, corpus):
+    await index.load(fake_es)
+    renamed, removed = list(corpus["movies"])[:2]
+    fake_es.docs["movies"][renamed] = {**corpus["movies"][renamed], "title": "Qwertyuiop", "imdb_rating": 10.0}
+    removed_title = corpus["movies"].pop(removed)["title"]
+
+    await index.update(fake_es, [renamed, removed])
+
+    assert [doc.id for doc in index.suggest("qwerty")] == [renamed]
+    assert removed not in {doc.id for doc in index.suggest(removed_title)}
+    for prefix in ("a", "s", "q"):
+        assert [doc.id for doc in index.suggest(prefix)] == expected(corpus, prefix, 5)
+
+
+async def test_update_keeps_precomputed_suggestions_exact(index, fake_es, corpus):
+    await index.load(fake_es)
+    ids = list(corpus["movies"])
+    for i, id_ in enumerate(ids[:12]):
+        # Повышение, понижение рейтинга, смена названия и удаление
+        film = corpus["movies"][id_]
+        if i % 4 == 0:
+            film["imdb_rating"] = 10.0
+        elif i % 4 == 1:
+            film["imdb_rating"] = 0.0
+        elif i % 4 == 2:
+            film["title"] = f"Renamed {i}"
+        else:
+            del corpus["movies"][id_]
+    await index.update(fake_es, ids[:12])
+
+    assert index._top == {prefix: index._best(index._range_ids(prefix), 5) for prefix in index._top}
+
+
+async def test_new_low_rated_document_does_not_rescan_ranges(index, fake_es, corpus, monkeypatch):
+    await index.load(fake_es)
+    corpus["movies"]["new"] = {"id": "new", "title": "A New Film", "imdb_rating": 0.0}
+    scans = []
+    monkeypatch.setattr(index, "_range_ids", lambda prefix: scans.append(prefix) or set())
+
+    await index.update(fake_es, ["new"])
+    assert not scans
+    assert index._top["n"] == expected(corpus, "n", 5)
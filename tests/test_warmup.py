@@ -0,0 +1,27 @@
+from http import HTTPStatus
+
+from services.film import get_film_service
+from services.film_ranking import film_rankings
+from warmup import warm_up
+
+
+async def test_warm_up_fills_local_cache_of_endpoint_services(client, fake_redis, fake_es):
+    stats = await warm_up(fake_redis, fake_es, top_n=10, popular_limit=0, concurrency=2)
+    assert stats["films"] > 0
+    film_service = get_film_service(redis=fake_redis, elastic=fake_es)
+    assert film_service.local_cache.stats()["entries"] > 0
+
+    calls = fake_es.calls
+    response = await client.get("/api/v1/film/", params={"sort": "-imdb_rating"})
+    assert response.status_code == HTTPStatus.OK
+    assert fake_es.calls == calls
+
+
+async def test_warm_up_fills_projected_film_cards(client, fake_redis, fake_es):
+    await film_rankings.rebuild(fake_redis, fake_es)
+    await warm_up(fake_redis, fake_es, top_n=10, popular_limit=0, concurrency=2)
+
+    calls = fake_es.calls
+    response = await client.get("/api/v1/film/", params={"page[size]": 10})
+    assert response.status_code == HTTPStatus.OK
+    assert fake_es.calls == calls